@@ -0,0 +1,295 @@
+# Copyright 2023 Stanford University
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy 
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights 
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell 
+# copies of the Software, and to permit persons to whom the Software is 
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in 
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR 
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, 
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE 
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER 
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, 
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE 
+# SOFTWARE.
+import sys
+import os
+sys.path.append(os.getcwd())
+import numpy as np
+import torch as th
+import json
+import zlib
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+# labels of encoded fields are stored with these suffixes
+HEADER_SUFFIX = '.codec'
+DATA_SUFFIX = '.data'
+# compression methods that were replaced by zlib (reported once)
+_replaced_compressions = set()
+
+def default_codec():
+    """
+    Default codec parameters.
+
+    Returns:
+        dictionary of parameters
+    """
+    codec = {'dtype': 'float16',
+             'compression': 'zstd',
+             'chunk_size': 64,
+             'fields': ['pressure', 'flowrate']}
+    return codec
+
+def available_compression(compression):
+    """
+    Get a compression method that can be used.
+
+    zstd and lz4 require the optional packages zstandard and lz4; if they are
+    not installed, zlib is used instead.
+
+    Arguments:
+        compression (string): 'zstd', 'lz4', 'zlib' or 'none'
+
+    Returns:
+        compression method
+
+    """
+    if (compression == 'zstd' and zstandard == None) or \
+       (compression == 'lz4' and lz4 == None):
+        if compression not in _replaced_compressions:
+            print('Compression ' + compression + ' is not available, ' + \
+                  'using zlib')
+            _replaced_compressions.add(compression)
+        return 'zlib'
+    return compression
+
+def compress(data, compression):
+    """
+    Compress bytes.
+
+    Arguments:
+        data: bytes
+        compression (string): 'zstd', 'lz4', 'zlib' or 'none'
+
+    Returns:
+        compressed bytes
+
+    """
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor().compress(data)
+    elif compression == 'lz4':
+        return lz4.frame.compress(data)
+    elif compression == 'zlib':
+        return zlib.compress(data)
+    elif compression == 'none':
+        return data
+    raise Exception('Compression not implemented')
+
+def decompress(data, compression):
+    """
+    Decompress bytes.
+
+    Arguments:
+        data: bytes
+        compression (string): 'zstd', 'lz4', 'zlib' or 'none'
+
+    Returns:
+        decompressed bytes
+
+    """
+    if compression == 'zstd':
+        if zstandard == None:
+            raise ImportError('zstandard is required to decode this field')
+        return zstandard.ZstdDecompressor().decompress(data)
+    elif compression == 'lz4':
+        if lz4 == None:
+            raise ImportError('lz4 is required to decode this field')
+        return lz4.frame.decompress(data)
+    elif compression == 'zlib':
+        return zlib.decompress(data)
+    elif compression == 'none':
+        return data
+    raise Exception('Compression not implemented')
+
+def quantize(values, dtype):
+    """
+    Convert float values to a reduced precision type.
+
+    Arguments:
+        values: float32 numpy array
+        dtype (string): 'float32' (values are not converted), 'float16',
+                        'bfloat16' or 'int16' (values are scaled to the int16
+                        range)
+
+    Returns:
+        numpy array (bfloat16 values are stored as their int16 bits)
+        scale
+        offset
+
+    """
+    scale, offset = 1.0, 0.0
+    if dtype == 'float32':
+        return values.astype(np.float32), scale, offset
+    elif dtype == 'float16':
+        return values.astype(np.float16), scale, offset
+    elif dtype == 'bfloat16':
+        bits = th.from_numpy(values).to(th.bfloat16).view(th.int16)
+        return bits.numpy(), scale, offset
+    elif dtype == 'int16':
+        if values.size > 0:
+            minv = float(np.min(values))
+            maxv = float(np.max(values))
+            offset = (maxv + minv) / 2
+            if maxv > minv:
+                scale = (maxv - minv) / 65534
+        q = np.round((values.astype(np.float64) - offset) / scale)
+        return np.clip(q, -32767, 32767).astype(np.int16), scale, offset
+    raise Exception('Data type not implemented')
+
+def dequantize(values, dtype, scale, offset):
+    """
+    Convert reduced precision values back to float32 (see quantize).
+
+    Arguments:
+        values: numpy array returned by quantize
+        dtype (string): 'float32', 'float16', 'bfloat16' or 'int16'
+        scale (float): scale
+        offset (float): offset
+
+    Returns:
+        float32 numpy array
+
+    """
+    if dtype == 'float32' or dtype == 'float16':
+        return values.astype(np.float32)
+    elif dtype == 'bfloat16':
+        bits = th.from_numpy(np.ascontiguousarray(values))
+        return bits.view(th.bfloat16).float().numpy()
+    elif dtype == 'int16':
+        return (values.astype(np.float64) * scale + offset).astype(np.float32)
+    raise Exception('Data type not implemented')
+
+def encode(tensor, codec):
+    """
+    Encode a time-dependent field.
+
+    Values are converted to a reduced precision type (see quantize), split
+    in blocks of codec['chunk_size'] timesteps along the last dimension and
+    every block is compressed independently.
+
+    Arguments:
+        tensor: float32 tensor (last dimension: time)
+        codec: dictionary of codec parameters (see default_codec)
+
+    Returns:
+        header: uint8 tensor containing the encoding parameters (json)
+        data: uint8 tensor containing the compressed blocks
+
+    """
+    compression = available_compression(codec['compression'])
+    values, scale, offset = quantize(tensor.detach().numpy(), codec['dtype'])
+    ntimes = values.shape[-1]
+    chunk_size = codec['chunk_size']
+    chunks = []
+    for t in range(0, ntimes, chunk_size):
+        block = np.ascontiguousarray(values[..., t:t + chunk_size])
+        chunks.append(compress(block.tobytes(), compression))
+    header = {'dtype': codec['dtype'], 'compression': compression,
+              'shape': list(values.shape), 'chunk_size': chunk_size,
+              'chunks': [len(chunk) for chunk in chunks],
+              'scale': scale, 'offset': offset}
+    header = np.frombuffer(json.dumps(header).encode(), dtype = np.uint8)
+    data = np.frombuffer(b''.join(chunks), dtype = np.uint8)
+    return th.tensor(header), th.tensor(data)
+
+def decode(header, data):
+    """
+    Decode a field encoded with encode.
+
+    Arguments:
+        header: uint8 tensor returned by encode
+        data: uint8 tensor returned by encode
+
+    Returns:
+        float32 tensor
+
+    """
+    header = json.loads(header.numpy().tobytes().decode())
+    data = data.numpy().tobytes()
+    shape = header['shape']
+    storage = {'float32': np.float32,
+               'float16': np.float16}.get(header['dtype'], np.int16)
+    blocks = []
+    start = 0
+    for i, size in enumerate(header['chunks']):
+        t = i * header['chunk_size']
+        bshape = shape[:-1] + [min(header['chunk_size'], shape[-1] - t)]
+        block = decompress(data[start:start + size], header['compression'])
+        blocks.append(np.frombuffer(block, dtype = storage).reshape(bshape))
+        start = start + size
+    if len(blocks) == 0:
+        values = np.zeros(shape, dtype = storage)
+    else:
+        values = np.concatenate(blocks, axis = -1)
+    return th.tensor(dequantize(values, header['dtype'], header['scale'],
+                                header['offset']))
+
+def encode_labels(labels, codec):
+    """
+    Encode the fields listed in codec['fields'] in a dictionary of tensors.
+
+    The label of a field is the field name, possibly preceded by a prefix
+    ending with '/' (for example, the name of a graph in a graph store).
+    Encoded fields are replaced by two labels with suffixes HEADER_SUFFIX and
+    DATA_SUFFIX.
+
+    Arguments:
+        labels: dictionary of tensors (key: label, value: tensor)
+        codec: dictionary of codec parameters (see default_codec)
+
+    Returns:
+        dictionary of tensors
+
+    """
+    encoded = {}
+    for label in labels:
+        if label.rsplit('/', 1)[-1] in codec['fields']:
+            header, data = encode(labels[label], codec)
+            encoded[label + HEADER_SUFFIX] = header
+            encoded[label + DATA_SUFFIX] = data
+        else:
+            encoded[label] = labels[label]
+    return encoded
+
+def decode_labels(labels):
+    """
+    Decode all encoded fields in a dictionary of tensors (see encode_labels).
+
+    Arguments:
+        labels: dictionary of tensors (key: label, value: tensor)
+
+    Returns:
+        dictionary of tensors
+
+    """
+    decoded = {}
+    for label in labels:
+        if label.endswith(HEADER_SUFFIX):
+            name = label[:-len(HEADER_SUFFIX)]
+            decoded[name] = decode(labels[label],
+                                   labels[name + DATA_SUFFIX])
+        elif not label.endswith(DATA_SUFFIX):
+            decoded[label] = labels[label]
+    return decoded
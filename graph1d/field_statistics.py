@@ -0,0 +1,252 @@
+# Copyright 2023 Stanford University
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy 
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights 
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell 
+# copies of the Software, and to permit persons to whom the Software is 
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in 
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR 
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, 
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE 
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER 
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, 
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE 
+# SOFTWARE.
+import sys
+import os
+sys.path.append(os.getcwd())
+import tools.io_utils as io
+import numpy as np
+import torch as th
+import json
+
+class FieldStatistics:
+    """
+    Class to accumulate statistics of a field.
+
+    Statistics are updated with batches of values using Welford's algorithm
+    (in the parallel form by Chan et al.) in double precision. Accumulators
+    computed on different sets of values (for example, in different
+    processes) can be merged.
+
+    Attributes:
+        count (int): number of values
+        min (float): minimum value
+        max (float): maximum value
+        mean (float): mean value
+        m2 (float): sum of squared differences from the mean
+
+    """
+    def __init__(self, count = 0, min = np.infty, max = -np.infty,
+                 mean = 0.0, m2 = 0.0):
+        """
+        Init FieldStatistics.
+
+        Arguments:
+            count (int): number of values. Default -> 0
+            min (float): minimum value. Default -> inf
+            max (float): maximum value. Default -> -inf
+            mean (float): mean value. Default -> 0
+            m2 (float): sum of squared differences from the mean.
+                        Default -> 0
+
+        """
+        self.count = int(count)
+        self.min = float(min)
+        self.max = float(max)
+        self.mean = float(mean)
+        self.m2 = float(m2)
+
+    def update(self, values):
+        """
+        Update statistics with a batch of values.
+
+        Arguments:
+            values: tensor or numpy array of values (of any shape)
+
+        """
+        if isinstance(values, th.Tensor):
+            values = values.detach().cpu().numpy()
+        values = np.asarray(values, dtype = np.float64).reshape(-1)
+        if values.size == 0:
+            return
+        mean = np.mean(values)
+        batch = FieldStatistics(values.size, np.min(values), np.max(values),
+                                mean, np.sum((values - mean)**2))
+        self.merge(batch)
+
+    def merge(self, other):
+        """
+        Merge statistics accumulated on another set of values.
+
+        Arguments:
+            other: FieldStatistics
+
+        """
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.count, self.min, self.max = other.count, other.min, other.max
+            self.mean, self.m2 = other.mean, other.m2
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * other.count / count
+        self.m2 = self.m2 + other.m2 + \
+                  delta**2 * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def stdv(self):
+        """
+        Standard deviation (of the population).
+
+        Returns:
+            standard deviation (nan if there are no values)
+
+        """
+        if self.count == 0:
+            return np.nan
+        return float(np.sqrt(self.m2 / self.count))
+
+    def scaled(self, factor):
+        """
+        Accumulator of the values multiplied by a factor.
+
+        Arguments:
+            factor (float): the factor
+
+        Returns:
+            FieldStatistics
+
+        """
+        bounds = [self.min * factor, self.max * factor]
+        if self.count == 0:
+            bounds = [self.min, self.max]
+        return FieldStatistics(self.count, min(bounds), max(bounds),
+                               self.mean * factor, self.m2 * factor**2)
+
+    def statistics(self):
+        """
+        Statistics in the format used for normalization.
+
+        Returns:
+            dictionary with keys 'min', 'max', 'mean', 'stdv'
+
+        """
+        return {'min': self.min, 'max': self.max,
+                'mean': self.mean, 'stdv': self.stdv()}
+
+    def to_dict(self):
+        """
+        Convert to dictionary.
+
+        Returns:
+            dictionary with keys 'count', 'min', 'max', 'mean', 'm2'
+
+        """
+        return {'count': self.count, 'min': self.min, 'max': self.max,
+                'mean': self.mean, 'm2': self.m2}
+
+def merge_accumulators(accumulators, others):
+    """
+    Merge dictionaries of accumulators.
+
+    Arguments:
+        accumulators: dictionary (key: field name, value: FieldStatistics).
+                      It is modified in place
+        others: dictionary (key: field name, value: FieldStatistics)
+
+    Returns:
+        merged dictionary of accumulators
+
+    """
+    for name in others:
+        if name not in accumulators:
+            accumulators[name] = FieldStatistics()
+        accumulators[name].merge(others[name])
+    return accumulators
+
+def save_accumulators(accumulators, fname):
+    """
+    Save accumulators to a json file. The file is written atomically.
+
+    Arguments:
+        accumulators: dictionary (key: field name, value: FieldStatistics)
+        fname (string): name of the file
+
+    """
+    def write(f):
+        with open(f, 'w') as outfile:
+            json.dump({name: accumulators[name].to_dict()
+                       for name in accumulators}, outfile, indent = 4)
+
+    io.write_atomically(write, fname)
+
+def load_accumulators(fname):
+    """
+    Load accumulators from a json file.
+
+    Arguments:
+        fname (string): name of the file
+
+    Returns:
+        dictionary (key: field name, value: FieldStatistics)
+
+    """
+    with open(fname, 'r') as infile:
+        data = json.load(infile)
+    return {name: FieldStatistics(**data[name]) for name in data}
+
+def save_graph_accumulators(graph_accumulators, fname):
+    """
+    Save the accumulators of several graphs to a json file. The file is
+    written atomically.
+
+    Arguments:
+        graph_accumulators: dictionary (key: graph name, value: dictionary
+                            with keys 'file' (name of the file containing
+                            the graph), 'signature' (see
+                            io_utils.file_signature) and 'fields'
+                            (dictionary of accumulators of the graph))
+        fname (string): name of the file
+
+    """
+    def write(f):
+        data = {}
+        for name in graph_accumulators:
+            data[name] = dict(graph_accumulators[name])
+            fields = graph_accumulators[name]['fields']
+            data[name]['fields'] = {field: fields[field].to_dict()
+                                    for field in fields}
+        with open(f, 'w') as outfile:
+            json.dump(data, outfile)
+
+    io.write_atomically(write, fname)
+
+def load_graph_accumulators(fname):
+    """
+    Load the accumulators of several graphs from a json file (see
+    save_graph_accumulators).
+
+    Arguments:
+        fname (string): name of the file
+
+    Returns:
+        dictionary (key: graph name, value: dictionary with keys 'file',
+        'signature' and 'fields')
+
+    """
+    with open(fname, 'r') as infile:
+        data = json.load(infile)
+    for name in data:
+        fields = data[name]['fields']
+        data[name]['fields'] = {field: FieldStatistics(**fields[field])
+                                for field in fields}
+    return data
@@ -22,12 +22,13 @@ import sys
 import os
 sys.path.append(os.getcwd())
 import tools.io_utils as io
+import dgl
 from dgl.data import DGLDataset
 import time
 import graph1d.generate_normalized_graphs as nz
+import graph1d.graph_store as gs
 import random
 import numpy as np
-import copy
 import torch as th
 from tqdm import tqdm
 
@@ -44,6 +45,13 @@ class Dataset(DGLDataset):
                      dataset) mapping a graph index (first column) to the
                      timestep index (second column).
 
+    If params['time_shifts'] is larger than 1, every sample is shifted in time
+    by a random fraction k / params['time_shifts'] of the timestep (k being
+    an integer between 0 and params['time_shifts'] - 1). Pressure and flow
+    rate are linearly interpolated between consecutive timesteps, while the
+    loading flag is taken from the nearest timestep. This replaces
+    generating several time-shifted copies of every graph.
+
     """
     def __init__(self, graphs, params, graph_names):
         """
@@ -79,6 +87,9 @@ class Dataset(DGLDataset):
         offset = 0
         ngraphs = len(self.times)
         stride = self.params['stride']
+        # shifted samples need one more timestep for interpolation
+        if self.params.get('time_shifts', 1) > 1:
+            stride = stride + 1
         self.index_map = np.zeros((self.total_times - stride * ngraphs, 2))
         for t in self.times:
             # actual time (minus stride)
@@ -105,17 +116,15 @@ class Dataset(DGLDataset):
         for graph in tqdm(self.graphs, desc = 'Processing dataset',
                           colour='green'):
 
-            lightgraph = copy.deepcopy(graph)
-
-            node_data = [ndata for ndata in lightgraph.ndata]
-            edge_data = [edata for edata in lightgraph.edata]
-            for ndata in node_data:
-                if 'mask' not in ndata:
-                    del lightgraph.ndata[ndata]
-            for edata in edge_data:
-                del lightgraph.edata[edata]
+            # only the structure and the masks are copied
+            lightgraph = dgl.graph(graph.edges(), num_nodes = graph.num_nodes(),
+                                   idtype = graph.idtype,
+                                   device = graph.device)
+            for ndata in graph.ndata:
+                if 'mask' in ndata:
+                    lightgraph.ndata[ndata] = graph.ndata[ndata].clone()
 
-            self.times.append(graph.ndata['nfeatures'].shape[2])
+            self.times.append(nz.num_timesteps(graph))
             self.lightgraphs.append(lightgraph)
 
         self.times = np.array(self.times)
@@ -132,6 +141,8 @@ class Dataset(DGLDataset):
         Get ith lightgraph
 
         Noise is added to node features of the graph (pressure and flowrate).
+        If params['time_shifts'] > 1, pressure and flow rate are shifted in
+        time by a random fraction of the timestep.
 
         Arguments:
             i: index of the graph
@@ -143,9 +154,24 @@ class Dataset(DGLDataset):
         igraph = indices[0]
         itime = indices[1]
 
-        features = self.graphs[igraph].ndata['nfeatures'].clone()
-
-        nf = features[:,:,itime].clone()
+        graph = self.graphs[igraph]
+        # we only read the timesteps we need
+        window = nz.get_dynamic_features(graph, itime,
+                                         itime + self.params['stride'] + 2)
+
+        # random time shift (fraction of timestep)
+        time_shifts = self.params.get('time_shifts', 1)
+        shift = np.random.randint(time_shifts) / time_shifts
+        if shift > 0:
+            # the loading flag is taken from the nearest timestep
+            nearest = int(shift >= 0.5)
+            loading = window[:,2:,nearest:window.shape[2] - 1 + nearest]
+            window = window[:,0:2,:-1] * (1 - shift) + \
+                     window[:,0:2,1:] * shift
+            window = th.cat((window, loading), axis = 1)
+
+        nf = nz.assemble_node_features(graph.ndata['nfeatures_static'],
+                                       window[:,:,0])
         nfsize = nf[:,:2].shape
 
         dt = nz.invert_normalize(self.graphs[igraph].ndata['dt'][0], 'dt',
@@ -162,16 +188,19 @@ class Dataset(DGLDataset):
 
         self.lightgraphs[igraph].ndata['nfeatures'] = nf
 
-        ns = features[:,0:2,itime + 1:itime + 1 + self.params['stride']].clone()
+        ns = window[:,0:2,1:1 + self.params['stride']].clone()
 
         self.lightgraphs[igraph].ndata['next_steps'] = ns
 
         ef = self.graphs[igraph].edata['efeatures']
 
-        # add regular noise to the edge features to prevent overfitting
-        fnoise = np.random.normal(0, self.params['rate_noise_features'],
-                                  ef[:,2:].shape)
-        ef[:,2:] = ef[:,2:] + fnoise
+        # add regular noise to the edge features to prevent overfitting. The
+        # noise is added to a copy: the features of the graph (possibly
+        # memory-mapped) are not modified
+        fnoise = np.zeros(ef.shape)
+        fnoise[:,2:] = np.random.normal(0, self.params['rate_noise_features'],
+                                        ef[:,2:].shape)
+        ef = ef + th.tensor(fnoise, dtype = ef.dtype)
         self.lightgraphs[igraph].edata['efeatures'] = ef.squeeze()
 
         return self.lightgraphs[igraph]
@@ -304,6 +333,25 @@ def split(graphs, divs, dataset_info):
     
     return datasets
 
+def get_graphs(graphs, names):
+    """
+    Get list of graphs from their names.
+
+    If graphs are loaded lazily with a limit on the number of graphs in
+    memory, the returned list loads graphs when they are accessed.
+
+    Arguments:
+        graphs: list of graphs
+        names: list of graph names
+
+    Returns:
+        List of graphs
+
+    """
+    if isinstance(graphs, gs.LazyGraphs) and graphs.max_graphs != None:
+        return gs.GraphList(graphs, names)
+    return [graphs[name] for name in names]
+
 def generate_dataset(graphs, params, dataset_info, nchunks = 10):
     """
     Generate a list of datasets
@@ -325,10 +373,10 @@ def generate_dataset(graphs, params, dataset_info, nchunks = 10):
     dataset_list = []
     datasets = split(graphs, nchunks, dataset_info)
     for dataset in datasets:
-        train_graphs = [graphs[gname] for gname in dataset['train']]
+        train_graphs = get_graphs(graphs, dataset['train'])
         train_dataset = Dataset(train_graphs, params, dataset['train'])
 
-        test_graphs = [graphs[gname] for gname in dataset['test']]
+        test_graphs = get_graphs(graphs, dataset['test'])
         test_dataset = Dataset(test_graphs, params, dataset['test'])
 
         dataset_list.append({'train': train_dataset, 'test': test_dataset})
@@ -356,8 +404,8 @@ def generate_dataset_from_params(graphs, params):
 
     """
 
-    train = [graphs[train_graph] for train_graph in params['train_split']]
-    test = [graphs[test_graph] for test_graph in params['test_split']]
+    train = get_graphs(graphs, params['train_split'])
+    test = get_graphs(graphs, params['test_split'])
 
     train_dataset = Dataset(train, params, params['train_split'])
     test_dataset = Dataset(test, params, params['test_split'])
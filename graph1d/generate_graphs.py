@@ -22,9 +22,13 @@ import sys
 import os
 sys.path.append(os.getcwd())
 import tools.io_utils as io
+from graph1d.topology import CenterlineTopology, ArcLengthIndex
+import graph1d.graph_store as gs
+import graph1d.field_codec as fc
 import numpy as np
 import scipy
 from scipy import interpolate
+from scipy import spatial
 import dgl
 import torch as th
 from tqdm import tqdm
@@ -33,6 +37,33 @@ import random
 import tools.plot_tools as pt
 import matplotlib.pyplot as plt
 import shutil
+import heapq
+import argparse
+import hashlib
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# folder (in the output directory) of the cached time-independent graphs
+GEOMETRY_CACHE_DIR = 'geometry_cache'
+# file (in the output directory) with the inputs and outputs of every vtp file
+MANIFEST_FILE = 'manifest.json'
+
+def compute_norms(vectors):
+    """
+    Compute the euclidean norm of every row of an array.
+
+    The norms are computed with batched dot products, which give the same
+    rounding as calling np.linalg.norm on every row.
+
+    Arguments:
+        vectors: n x m numpy array
+
+    Returns:
+        n-dimensional numpy array containing the norms of the rows
+
+    """
+    return np.sqrt(np.matmul(vectors[:,None,:],
+                             vectors[:,:,None]).reshape(-1))
 
 def generate_types(bif_id, indices):
     """
@@ -50,27 +81,11 @@ def generate_types(bif_id, indices):
         Outlet maks, i.e., array containing 1 at outlet indices and 0 elsewhere
 
     """
-    types = []
-    inlet_mask = []
-    outlet_mask = []
-    for i, id in enumerate(bif_id):
-        if id == -1:
-            cur_type = 0
-        else:
-            cur_type = 1
-        if i in indices['inlet']:
-            cur_type = 2
-        elif i in indices['outlets']:
-            cur_type = 3
-        types.append(cur_type)
-        if cur_type == 2:
-            inlet_mask.append(True)
-        else:
-            inlet_mask.append(False)
-        if cur_type == 3:
-            outlet_mask.append(True)
-        else:
-            outlet_mask.append(False)
+    types = (np.asarray(bif_id) != -1).astype(np.int64)
+    types[np.asarray(indices['outlets'], dtype = np.int64)] = 3
+    types[np.asarray(indices['inlet'], dtype = np.int64)] = 2
+    inlet_mask = types == 2
+    outlet_mask = types == 3
     types = th.nn.functional.one_hot(th.tensor(types), num_classes = 4)
     return types, inlet_mask, outlet_mask
 
@@ -92,17 +107,11 @@ def generate_edge_features(points, edges1, edges2):
         n dimensional numpy array containing |x_j - x_i|
 
     """
-    rel_position = []
-    rel_position_norm = []
-    nedges = len(edges1)
-    for i in range(nedges):
-        diff = points[edges2[i],:] - points[edges1[i],:]
-        ndiff = np.linalg.norm(diff)
-        rel_position.append(diff / ndiff)
-        rel_position_norm.append(ndiff)
-    return np.array(rel_position), rel_position_norm
+    diff = points[edges2,:] - points[edges1,:]
+    ndiff = compute_norms(diff)
+    return diff / np.expand_dims(ndiff, axis = 1), ndiff
 
-def add_fields(graph, field, field_name, offset = 0,
+def add_fields(graph, field, times, field_name, offset = 0,
                pad = 10):
     """
     Add time-dependent fields to a DGL graph.
@@ -113,7 +122,8 @@ def add_fields(graph, field, field_name, offset = 0,
 
     Arguments:
         graph: DGL graph
-        field: dictionary with (key: timestep, value: field value)
+        field: n x m numpy array containing the field at all timesteps
+        times: m-dimensional numpy array of (sorted) timesteps
         field_name (string): name of the field
         offset (int): number of timesteps to skip.
                       Default: 0 -> keep all timesteps
@@ -121,42 +131,25 @@ def add_fields(graph, field, field_name, offset = 0,
                    zero initial conditions. Default: 0 -> start from actual
                    initial condition
     """
-    timesteps = [float(t) for t in field]
-    timesteps.sort()
-    dt = (timesteps[1] - timesteps[0])
-    T = timesteps[-1]
+    dt = float(times[1] - times[0])
+    T = float(times[-1])
+    nnodes = field.shape[0]
+    ntimes = field.shape[1] - offset + pad
     # we use the third dimension for time
-    field_t = th.zeros((list(field.values())[0].shape[0], 1,
-                        len(timesteps) - offset + pad))
-
-    times = [t for t in field]
-    times.sort()
-    times = times[offset:]
-
-    loading_t = th.zeros((list(field.values())[0].shape[0], 1,
-                          len(timesteps) - offset + pad), dtype = th.bool)
+    field_t = th.zeros((nnodes, 1, ntimes))
+    loading_t = th.zeros((nnodes, 1, ntimes), dtype = th.bool)
 
     if pad > 0:
-        # def interpolate_function(count):
-        #     return (1 - np.cos(np.pi * count / pad)) / 2
-
-        inc = th.tensor(field[times[0]], dtype = th.float32)
+        inc = th.tensor(field[:,offset], dtype = th.float32)
         deft = inc * 0
         if field_name == 'pressure':
+            deft = deft + np.min(field)
+        icount = th.arange(pad, dtype = th.float32)
+        field_t[:,0,:pad] = deft[:,None] * ((pad - icount) / pad) + \
+                            inc[:,None] * (icount / pad)
+        loading_t[:,0,:pad] = True
 
-            minp = np.infty
-            for t in field:
-                minp = np.min((minp, np.min(field[t])))
-            deft = deft + minp
-        for i in range(pad):
-            field_t[:,0,i] = deft * (pad - i)/pad + inc * (i / pad)
-            loading_t[:,0,i] = True
-    
-    for i, t in enumerate(times):
-        f = th.tensor(field[t], dtype = th.float32)
-        field_t[:,0,i + pad] = f
-        loading_t[:,0,i + pad] = False
-        # graph.ndata[field_name + '_{}'.format(count - offset)] = f
+    field_t[:,0,pad:] = th.tensor(field[:,offset:], dtype = th.float32)
 
     graph.ndata[field_name] = field_t
     graph.ndata['loading'] = loading_t
@@ -175,12 +168,11 @@ def find_outlets(edges1, edges2):
         edges1: numpy array containing indices of source nodes for every edge
         edges2: numpy array containing indices of dest nodes for every edge
 
+    Returns:
+        list of outlet indices
+
     """
-    outlets = []
-    for e in edges2:
-        if e not in edges1:
-            outlets.append(e)
-    return outlets
+    return CenterlineTopology(edges1, edges2).outlets()
 
 def remove_points(idxs_to_delete, idxs_to_replace, edges1, edges2, npoints):
     """
@@ -204,30 +196,161 @@ def remove_points(idxs_to_delete, idxs_to_replace, edges1, edges2, npoints):
         (modified) numpy array containing indices of dest nodes for every edge
 
     """
-    npoints_to_delete = len(idxs_to_delete)
+    sampled_indices, \
+    topology = CenterlineTopology(edges1, edges2,
+                                  npoints).remove_points(idxs_to_delete,
+                                                         idxs_to_replace)
+    edges1 = topology.edges1
+    edges2 = topology.edges2
+
+    return sampled_indices, edges1, edges2
+
+def collapse_edges(points, edges1, edges2, protected, ncollapses,
+                   forced = None):
+    """
+    Collapse the shortest edges of a graph.
 
-    for i in range(npoints_to_delete):
-        i1 = np.where(edges1 == idxs_to_delete[i])[0]
-        if (len(i1)) != 0:
-            edges1[i1] = idxs_to_replace[i]
+    Iteratively collapse the shortest edge of the graph by deleting one of its
+    nodes and replacing it with the other one. The destination node is
+    deleted unless it is protected (e.g., it is an outlet), in which case the
+    source node is deleted. Edge lengths are kept in a min-heap: after every
+    collapse, only the edges touching the deleted node are updated.
+    Edges shorter than 1e-13 (e.g., already collapsed) are never selected.
 
-        i2 = np.where(edges2 == idxs_to_delete[i])[0]
-        if (len(i2)) != 0:
-            edges2[i2] = idxs_to_replace[i]
+    Arguments:
+        points: n x 3 numpy array of point coordinates
+        edges1: numpy array containing indices of source nodes for every edge
+        edges2: numpy array containing indices of dest nodes for every edge
+        protected: list of indices of nodes that should not be deleted
+        ncollapses (int): number of edges to collapse. If np.inf, collapse
+                          edges until none is left
+        forced: list of (deleted node, replacing node) pairs applied, in
+                order, before collapsing the shortest edges (e.g., to remove
+                the caps). They are not counted in ncollapses.
+                Default -> None
 
-    edges_to_delete = np.where(edges1 == edges2)[0]
-    edges1 = np.delete(edges1, edges_to_delete)
-    edges2 = np.delete(edges2, edges_to_delete)
+    Returns:
+        list of indices of deleted nodes (in the order of deletion), starting
+            with the forced ones
+        list of indices of the nodes replacing the deleted nodes
+        (modified) numpy array containing indices of source nodes for every edge
+        (modified) numpy array containing indices of dest nodes for every edge
 
-    sampled_indices = np.delete(np.arange(npoints), idxs_to_delete)
-    for i in range(edges1.size):
-        edges1[i] = np.where(sampled_indices == edges1[i])[0][0]
-        edges2[i] = np.where(sampled_indices == edges2[i])[0][0]
+    """
+    edges1 = np.array(edges1)
+    edges2 = np.array(edges2)
+    npoints = points.shape[0]
+    nedges = edges1.size
+    protected = set(protected)
+
+    # for every node, list of edges the node belongs to
+    node_edges = [[] for _ in range(npoints)]
+    for iedge in range(nedges):
+        node_edges[edges1[iedge]].append(iedge)
+        node_edges[edges2[iedge]].append(iedge)
+
+    # heap entries are (length, edge index, version). An entry is valid only
+    # if its version matches the current version of the edge
+    versions = [0] * nedges
+    lengths = np.linalg.norm(points[edges1,:] - points[edges2,:], axis = 1)
+    heap = [(length, iedge, 0) for iedge, length in enumerate(lengths)
+            if length >= 1e-13]
+    heapq.heapify(heap)
 
-    return sampled_indices, edges1, edges2
+    ipoints_to_delete = []
+    ipoints_to_replace = []
+
+    def collapse(ipoint_to_delete, ipoint_to_replace):
+        for iedge in node_edges[ipoint_to_delete]:
+            if edges1[iedge] == ipoint_to_delete:
+                edges1[iedge] = ipoint_to_replace
+            if edges2[iedge] == ipoint_to_delete:
+                edges2[iedge] = ipoint_to_replace
+            versions[iedge] = versions[iedge] + 1
+            length = np.linalg.norm(points[edges1[iedge],:] - \
+                                    points[edges2[iedge],:])
+            if length >= 1e-13:
+                heapq.heappush(heap, (length, iedge, versions[iedge]))
+            # collapsed edges already belong to the replacing node
+            if edges1[iedge] != edges2[iedge]:
+                node_edges[ipoint_to_replace].append(iedge)
+        node_edges[ipoint_to_delete] = []
+
+        ipoints_to_delete.append(ipoint_to_delete)
+        ipoints_to_replace.append(ipoint_to_replace)
+
+    if forced == None:
+        forced = []
+    for ipoint_to_delete, ipoint_to_replace in forced:
+        collapse(ipoint_to_delete, ipoint_to_replace)
+
+    nforced = len(forced)
+    while len(ipoints_to_delete) - nforced < ncollapses:
+        mind = -1
+        while len(heap) != 0:
+            _, iedge, version = heapq.heappop(heap)
+            if version == versions[iedge]:
+                mind = iedge
+                break
+        if mind == -1:
+            if ncollapses == np.inf:
+                break
+            raise ValueError('No edge left to collapse. ' + \
+                             'You can try to adjust resample parameters.')
+
+        if edges2[mind] not in protected:
+            collapse(edges2[mind], edges1[mind])
+        else:
+            collapse(edges1[mind], edges2[mind])
+
+    return ipoints_to_delete, ipoints_to_replace, edges1, edges2
+
+def compute_collapse_sequence(points, edges1, edges2, indices, remove_caps,
+                              ncollapses = None):
+    """
+    Compute the sequence of collapses used to resample points.
+
+    The caps are removed first, then the shortest edges are collapsed (see
+    collapse_edges). By default, edges are collapsed until none is left. Since
+    every collapse only depends on the previous ones, the resampling at any
+    resolution is obtained by truncating the sequence (see resample_points).
+
+    Arguments:
+        points: n x 3 numpy array of point coordinates
+        edges1: numpy array containing indices of source nodes for every edge
+        edges2: numpy array containing indices of dest nodes for every edge
+        indices: dictionary containing inlet and outlets indices
+        remove_caps (int): number of points to remove at the caps
+        ncollapses (int): number of edges to collapse after removing the caps.
+                          Default -> None (collapse all edges)
+
+    Returns:
+        m x 2 numpy array containing, in order, the indices of the deleted
+            nodes (first column) and of the nodes replacing them (second
+            column)
+
+    """
+    # the caps are removed with the same updates as the collapses
+    caps = []
+    for ip in range(remove_caps):
+        for inlet in indices['inlet']:
+            caps.append((inlet + ip, inlet + remove_caps))
+        for outlet in indices['outlets']:
+            caps.append((outlet - ip, outlet - remove_caps))
+
+    new_outlets = [outlet - remove_caps for outlet in indices['outlets']]
+
+    if ncollapses == None:
+        ncollapses = np.inf
+    ipoints_to_delete, \
+    ipoints_to_replace, _, _ = collapse_edges(points, edges1, edges2,
+                                              new_outlets, ncollapses, caps)
+
+    return np.array([ipoints_to_delete, ipoints_to_replace],
+                    dtype = np.int64).reshape(2,-1).transpose()
 
 def resample_points(points, edges1, edges2, indices, perc_points_to_keep,
-                    remove_caps):
+                    remove_caps, collapse_sequence = None):
     """
     Resample points.
 
@@ -242,6 +365,10 @@ def resample_points(points, edges1, edges2, indices, perc_points_to_keep,
         indices: dictionary containing inlet and outlets indices
         perc_points_to_keep (float): percentage of points to keep (in decimals)
         remove_caps (int): number of points to remove at the caps
+        collapse_sequence: m x 2 numpy array computed with
+                           compute_collapse_sequence on the same inputs. If
+                           not None, the sequence is truncated instead of
+                           recomputing the collapses. Default -> None
 
     Returns:
         numpy array with indices of the remaining nodes
@@ -251,59 +378,24 @@ def resample_points(points, edges1, edges2, indices, perc_points_to_keep,
         (modified) dictionary containing inlet and outlets indices
 
     """
-
-    def modify_edges(edges1, edges2, ipoint_to_delete, ipoint_to_replace):
-        i1 = np.where(edges1 == ipoint_to_delete)[0]
-        if len(i1) != 0:
-            edges1[i1] = ipoint_to_replace
-
-        i2 = np.where(np.array(edges2) == ipoint_to_delete)[0]
-        if len(i2) != 0:
-            edges2[i2] = ipoint_to_replace
-        return edges1, edges2
     npoints = points.shape[0]
     npoints_to_keep = int(npoints * perc_points_to_keep)
-    ipoints_to_delete = []
-    ipoints_to_replace = []
+    ncaps = remove_caps * (len(indices['inlet']) + len(indices['outlets']))
+    ncollapses = ncaps + npoints - npoints_to_keep
 
-    new_outlets = []
-    for ip in range(remove_caps):
-        for inlet in indices['inlet']:
-            ipoints_to_delete.append(inlet + ip)
-            ipoints_to_replace.append(inlet + remove_caps)
-            edges1, edges2 = modify_edges(edges1, edges2,
-                                          inlet + ip, inlet + remove_caps)
-        for outlet in indices['outlets']:
-            ipoints_to_delete.append(outlet - ip)
-            ipoints_to_replace.append(outlet - remove_caps)
-            edges1, edges2 = modify_edges(edges1, edges2,
-                                          outlet - ip, outlet - remove_caps)
-
-    for outlet in indices['outlets']:
-        new_outlets.append(outlet - remove_caps)
-
-    indices['outlets'] = new_outlets
-
-    for _ in range(npoints - npoints_to_keep):
-        diff = np.linalg.norm(points[edges1,:] - points[edges2,:],
-                              axis = 1)
-        # we don't consider the points that we already deleted
-        diff[np.where(diff < 1e-13)[0]] = np.inf
-        mdiff = np.min(diff)
-        mind = np.where(np.abs(diff - mdiff) < 1e-12)[0][0]
-
-        if edges2[mind] not in new_outlets:
-            ipoint_to_delete = edges2[mind]
-            ipoint_to_replace = edges1[mind]
-        else:
-            ipoint_to_delete = edges1[mind]
-            ipoint_to_replace = edges2[mind]
+    if collapse_sequence is None:
+        collapse_sequence = compute_collapse_sequence(points, edges1, edges2,
+                                                      indices, remove_caps,
+                                                      npoints - \
+                                                      npoints_to_keep)
+    if collapse_sequence.shape[0] < ncollapses:
+        raise ValueError('No edge left to collapse. ' + \
+                         'You can try to adjust resample parameters.')
 
-        edges1, edges2 = modify_edges(edges1, edges2,
-                                      ipoint_to_delete, ipoint_to_replace)
+    ipoints_to_delete = collapse_sequence[:ncollapses,0]
+    ipoints_to_replace = collapse_sequence[:ncollapses,1]
 
-        ipoints_to_delete.append(ipoint_to_delete)
-        ipoints_to_replace.append(ipoint_to_replace)
+    indices['outlets'] = [outlet - remove_caps for outlet in indices['outlets']]
 
     sampled_indices, edges1, edges2 = remove_points(ipoints_to_delete,
                                                     ipoints_to_replace,
@@ -314,6 +406,37 @@ def resample_points(points, edges1, edges2, indices, perc_points_to_keep,
 
     return sampled_indices, points, edges1, edges2, indices
 
+def geodesic_distances(nodes, edges1, edges2, indices, allow_infinite = False):
+    """
+    Compute geodesic distances from a set of seed nodes.
+
+    The shortest paths from all seeds are computed in a single batched call
+    (see CenterlineTopology.geodesic_distances). Edges are considered directed
+    from edges1 to edges2.
+
+    Arguments:
+        nodes: n x 3 numpy array of point coordinates
+        edges1: numpy array containing indices of source nodes for every edge
+        edges2: numpy array containing indices of dest nodes for every edge
+        indices: list of indices of the seed nodes
+        allow_infinite (bool): if False, raise an error when some node cannot
+                               be reached from one of the seeds.
+                               Default -> False
+
+    Returns:
+        m x n numpy array (m being the number of seeds and n the total number
+            of nodes) containing all shortest path lengths
+        m x n numpy array containing the previous nodes explored when
+            traversing the graph (-1 if there is no previous node)
+
+    """
+    topology = CenterlineTopology(edges1, edges2, nodes.shape[0])
+    dists, prevs = topology.geodesic_distances(nodes, indices)
+    if not allow_infinite and np.max(dists) == np.infty:
+        raise ValueError("Distance in Dijkstra is infinite for some reason. You can try to adjust resample parameters.")
+
+    return dists, prevs
+
 def dijkstra_algorithm(nodes, edges1, edges2, index):
     """
     Dijkstra's algorithm.
@@ -334,34 +457,10 @@ def dijkstra_algorithm(nodes, edges1, edges2, index):
             when traversing the graph
 
     """
-    nnodes = nodes.shape[0]
-    tovisit = np.arange(0,nnodes)
-    dists = np.ones((nnodes)) * np.infty
-    prevs = np.ones((nnodes)) * (-1)
-    b_edges = np.array([edges1,edges2]).transpose()
-
-    dists[index] = 0
-    while len(tovisit) != 0:
-        minindex = -1
-        minlen = np.infty
-        for iinde in range(len(tovisit)):
-            if dists[tovisit[iinde]] < minlen:
-                minindex = iinde
-                minlen = dists[tovisit[iinde]]
-
-        curindex = tovisit[minindex]
-        tovisit = np.delete(tovisit, minindex)
-
-        # find neighbors of curindex
-        inb = b_edges[np.where(b_edges[:,0] == curindex)[0],1]
-
-        for neib in inb:
-            if np.where(tovisit == neib)[0].size != 0:
-                alt = dists[curindex] + np.linalg.norm(nodes[curindex,:] - \
-                        nodes[neib,:])
-                if alt < dists[neib]:
-                    dists[neib] = alt
-                    prevs[neib] = curindex
+    dists, prevs = geodesic_distances(nodes, edges1, edges2, [index],
+                                      allow_infinite = True)
+    dists = dists[0,:]
+    prevs = prevs[0,:]
     if np.max(dists) == np.infty:
         plt.figure()
         ax = plt.axes(projection='3d')
@@ -372,18 +471,22 @@ def dijkstra_algorithm(nodes, edges1, edges2, index):
         raise ValueError("Distance in Dijkstra is infinite for some reason. You can try to adjust resample parameters.")
     return dists, prevs
 
-def generate_boundary_edges(points, indices, edges1, edges2):
+def generate_boundary_edges(points, indices, edges1, edges2,
+                            n_boundary_edges = 1):
     """
     Generate boundary edges.
 
     Generate edges connecting boundary nodes to interior nodes. Every interior
-    node is connected to the closest boundary node (in terms of path length).
+    node is connected to the closest boundary nodes (in terms of path length).
+    Nodes that coincide with their closest boundary node are not connected.
 
     Arguments:
         points: n x 3 numpy array of point coordinates
         indices: dictionary containing inlet and outlets indices
         edges1: numpy array containing indices of source nodes for every edge
         edges2: numpy array containing indices of dest nodes for every edge
+        n_boundary_edges (int): number of closest boundary nodes every node is
+                                connected to. Default -> 1
 
     Returns:
         numpy array containing indices of source nodes for every boundary edge
@@ -395,62 +498,46 @@ def generate_boundary_edges(points, indices, edges1, edges2):
     """
     npoints = points.shape[0]
     idxs = indices['inlet'] + indices['outlets']
-    bedges1 = []
-    bedges2 = []
-    rel_positions = []
-    dists = []
-    types = []
-    for index in idxs:
-        d, _ = dijkstra_algorithm(points, edges1, edges2, index)
-        if index in indices['inlet']:
-            type = 2
-        else:
-            type = 3
-        for ipoint in range(npoints):
-            bedges1.append(index)
-            bedges2.append(ipoint)
-            rp = points[ipoint,:] - points[index,:]
-            rel_positions.append(rp)
-            if np.linalg.norm(rp) > 1e-12:
-                rel_positions[-1] = rel_positions[-1] / np.linalg.norm(rp)
-            dists.append(d[ipoint])
-            types.append(type)
-
-        # DEBUG: check distances computed with dijkstra_algorithm
-        # fig = plt.figure()
-        # ax = plt.axes(projection='3d')
-        # for i in range(npoints):
-        #     ax.scatter(points[i,0], points[i,1], points[i,2], color = 'black', s = 1)
-        #     ax.text(points[i,0], points[i,1], points[i,2],
-        #             "{:.1f}".format(d[i]),
-        #             fontsize=5)
-        #     ax.set_box_aspect((np.ptp(points[:,0]),
-        #                np.ptp(points[:,1]),
-        #                np.ptp(points[:,2])))
-        # plt.show()
-
-    # we only keep edges corresponding to the closest boundary node in graph
-    # distance to reduce number of edges
-    edges_to_delete = []
-
-    for ipoint in range(npoints):
-        cur_dists = dists[ipoint::npoints]
-        min_dist = np.min(cur_dists)
-        minidx = np.where(np.abs(cur_dists - min_dist) < 1e-12)[0][0]
-        if min_dist < 1e-12:
-            edges_to_delete.append(ipoint + minidx * npoints)
-        i = ipoint
-        while i < len(dists):
-            if i != ipoint + minidx * npoints:
-                edges_to_delete.append(i)
-            i = i + npoints
-
-    bedges1 = np.delete(np.array(bedges1), edges_to_delete)
-    bedges2 = np.delete(np.array(bedges2), edges_to_delete)
-    rel_positions = np.delete(np.array(rel_positions), edges_to_delete,
-                              axis = 0)
-    dists = np.delete(np.array(dists), edges_to_delete)
-    types = np.delete(np.array(types), edges_to_delete)
+    # distances from all inlets and outlets are computed in one batched call
+    bdists, _ = geodesic_distances(points, edges1, edges2, idxs)
+
+    # the closest boundary node is the first one (in the order of idxs) whose
+    # distance is within tolerance from the minimum
+    allpoints = np.arange(npoints)
+    min_dists = np.min(bdists, axis = 0)
+    closest = np.argmax(bdists - min_dists < 1e-12, axis = 0)
+    # nodes that coincide with a boundary node get no boundary edges
+    connected = min_dists >= 1e-12
+
+    k = min(n_boundary_edges, len(idxs))
+    if k == 1:
+        ibnds = closest[connected]
+        ipoints = allpoints[connected]
+    else:
+        # move the closest boundary node first and take the k nearest
+        sort_dists = bdists.copy()
+        sort_dists[closest, allpoints] = -np.infty
+        nearest = np.argsort(sort_dists, axis = 0, kind = 'stable')[:k,:]
+        ipoints = np.tile(allpoints[connected], k)
+        ibnds = nearest[:,connected].reshape(-1)
+        keep = bdists[ibnds, ipoints] >= 1e-12
+        ibnds = ibnds[keep]
+        ipoints = ipoints[keep]
+
+    # edges are sorted by boundary node and then by interior node
+    order = np.lexsort((ipoints, ibnds))
+    ibnds = ibnds[order]
+    ipoints = ipoints[order]
+
+    bedges1 = np.array(idxs)[ibnds]
+    bedges2 = ipoints
+    rel_positions = points[bedges2,:] - points[bedges1,:]
+    norms = compute_norms(rel_positions)
+    nonzero = norms > 1e-12
+    rel_positions[nonzero,:] = rel_positions[nonzero,:] / \
+                               np.expand_dims(norms[nonzero], axis = 1)
+    dists = bdists[ibnds, ipoints]
+    types = np.where(np.isin(bedges1, indices['inlet']), 2, 3)
 
     # make edges bidirectional
     bedges1_copy = bedges1.copy()
@@ -488,14 +575,9 @@ def create_continuity_mask(types):
         n-dimensional numpy array containing 1s only at junction inlet indices
 
     """
-    continuity_mask = [0]
-    npoints = types.shape[0]
-    for i in range(1,npoints-1):
-        if types[i-1,0] == 1 and types[i,0] == 1 and types[i + 1,0]:
-            continuity_mask.append(1)
-        else:
-            continuity_mask.append(0)
-    continuity_mask.append(0)
+    branch = np.asarray(types[:,0]) != 0
+    continuity_mask = np.zeros(types.shape[0], dtype = np.int64)
+    continuity_mask[1:-1] = branch[:-2] & branch[1:-1] & branch[2:]
     return continuity_mask
 
 def create_junction_edges(points, bif_id, edges1, edges2, outlets):
@@ -503,13 +585,16 @@ def create_junction_edges(points, bif_id, edges1, edges2, outlets):
     Generate junction edges.
 
     Junction edges are bidirectional edges connecting junction inlets to
-    the corresponding outlets.
+    the corresponding outlets. Path lengths are computed along the
+    centerline, which is expected to be a tree rooted at node 0.
 
     Arguments:
         points: n x 3 numpy array of point coordinates
         bif_id: n-dimensional array containing bifurcation (junction) ids
-        edges1: numpy array containing indices of source nodes for every edge
-        edges2: numpy array containing indices of dest nodes for every edge
+        edges1: numpy array containing indices of source nodes for every
+                centerline edge
+        edges2: numpy array containing indices of dest nodes for every
+                centerline edge
         outlets: list of outlets indices
 
     Returns:
@@ -528,6 +613,10 @@ def create_junction_edges(points, bif_id, edges1, edges2, outlets):
     juncts_inlets = {}
     jedges1 = []
     jedges2 = []
+    # the scan is sequential, hence we work on python containers to avoid
+    # the overhead of accessing numpy arrays element by element
+    outlets = set(outlets)
+    bif_id = bif_id.tolist()
     for ipoint in range(npoints - 1):
         if ((bif_id[ipoint] == -1 and bif_id[ipoint + 1] != -1) or \
            (ipoint == 0 and bif_id[ipoint] != -1)) and \
@@ -548,19 +637,26 @@ def create_junction_edges(points, bif_id, edges1, edges2, outlets):
             jedges2.append(ipoint)
             jun_mask[ipoint] = 1
     masks = {'inlets': jun_inlet_mask, 'all': jun_mask}
-    dists = {}
-    for jun_id in juncts_inlets:
-        d, _ = dijkstra_algorithm(points, edges1, edges2, juncts_inlets[jun_id])
-        dists[juncts_inlets[jun_id]] = d
+
+    # junction outlets are downstream of their inlets, hence path lengths
+    # are differences of arc lengths from the model inlet
+    topology = CenterlineTopology(edges1, edges2, npoints)
+    arc_length = ArcLengthIndex(topology, points, root = 0)
+    jdistance = arc_length.distances(jedges1, jedges2)
+    # we fall back to Dijkstra's algorithm for the remaining pairs
+    missing = np.where(np.isnan(jdistance))[0]
+    if missing.size > 0:
+        jinlets = list(set([jedges1[iedg] for iedg in missing]))
+        jdists, _ = geodesic_distances(points, edges1, edges2, jinlets)
+        for iedg in missing:
+            jdistance[iedg] = jdists[jinlets.index(jedges1[iedg]),
+                                     jedges2[iedg]]
 
     jrel_position = []
-    jdistance = []
     for iedg in range(len(jedges1)):
         jrel_position.append(points[jedges2[iedg],:] - points[jedges1[iedg],:])
-        jdistance.append(dists[jedges1[iedg]][jedges2[iedg]])
 
     jrel_position = np.array(jrel_position)
-    jdistance = np.array(jdistance)
 
     # make edges bidirectional
     jedges1_copy = jedges1.copy()
@@ -571,6 +667,41 @@ def create_junction_edges(points, bif_id, edges1, edges2, outlets):
     types = [4] * len(jedges1)
     return jedges1, jedges2, jrel_position, jdistance, types, masks
 
+def remove_nan_points(point_data, points, edges1, edges2):
+    """
+    Remove points where the area is NaN.
+
+    Every deleted point is merged into the previous point that we keep.
+
+    Arguments:
+        point_data: dictionary containing point data (key: name, value: data).
+                    Arrays are restricted to the remaining points.
+        points: n x 3 numpy array of point coordinates
+        edges1: numpy array containing indices of source nodes for every edge
+        edges2: numpy array containing indices of dest nodes for every edge
+
+    Returns:
+        (modified) n x 3 numpy array of point coordinates
+        (modified) numpy array containing indices of source nodes for every edge
+        (modified) numpy array containing indices of dest nodes for every edge
+
+    """
+    keep = np.logical_not(np.isnan(point_data['area']))
+    if not np.all(keep):
+        new_indices = np.maximum(np.cumsum(keep) - 1, 0)
+        edges1 = new_indices[edges1]
+        edges2 = new_indices[edges2]
+
+        edges_to_keep = edges1 != edges2
+        edges1 = edges1[edges_to_keep]
+        edges2 = edges2[edges_to_keep]
+
+        points = points[keep,:]
+        for ndata in point_data:
+            point_data[ndata] = point_data[ndata][keep]
+
+    return points, edges1, edges2
+
 def load_vtp(file, input_dir):
     """
     Load vtp file.
@@ -591,24 +722,57 @@ def load_vtp(file, input_dir):
     edges1, edges2 = io.get_edges(soln.GetOutput())
 
     # lets check for nans and delete points if they appear
-    ni = np.argwhere(np.isnan(point_data['area']))
-    if ni.size > 0:
-        for i in ni[0]:
-            indices = np.where(edges1 >= i)[0]
-            edges1[indices] = edges1[indices] - 1
+    points, edges1, edges2 = remove_nan_points(point_data, points,
+                                               edges1, edges2)
 
-            indices = np.where(edges2 >= i)[0]
-            edges2[indices] = edges2[indices] - 1
+    return point_data, points, edges1, edges2
 
-            indices = np.where(edges1 == edges2)[0]
-            edges1 = np.delete(edges1,indices)
-            edges2 = np.delete(edges2,indices)
+def load_vtp_fields(file, input_dir, arrays, time_fields):
+    """
+    Load selected fields from a vtp file.
 
-            points = np.delete(points, i, axis = 0)
-            for ndata in point_data:
-                point_data[ndata] = np.delete(point_data[ndata], i)
+    Only the requested arrays are loaded. Time-dependent fields (stored in
+    arrays named <field>_<time>) are returned as dense arrays.
 
-    return point_data, points, edges1, edges2
+    Arguments:
+        file (string): file name
+        input_dir (string): path to input_dir
+        arrays: list of names of time-independent arrays to load
+        time_fields: list of names of time-dependent fields to load. Fields
+                     that are not found are skipped
+
+    Returns:
+        dictionary containing point data (key: name, value: data)
+        dictionary containing time-dependent fields (key: name, value:
+            dictionary with keys 'times', sorted m-dimensional numpy array,
+            and 'values', n x m numpy array)
+        n x 3 numpy array of point coordinates
+        numpy array containing indices of source nodes for every edge
+        numpy array containing indices of dest nodes for every edge
+
+    """
+    geo = io.read_geo(input_dir + '/' + file).GetOutput()
+    point_data = io.get_arrays(geo.GetPointData(), arrays)
+    points = io.collect_points(geo.GetPoints())
+    edges1, edges2 = io.get_edges(geo)
+
+    index = io.index_time_arrays(geo.GetPointData())
+    time_data = {}
+    for field in time_fields:
+        times, values = io.get_time_series(geo.GetPointData(), field, index)
+        if times is not None:
+            time_data[field] = {'times': times, 'values': values}
+
+    # we temporarily add time-dependent fields to point data to restrict
+    # them to the points we keep
+    for field in time_data:
+        point_data['__time__' + field] = time_data[field]['values']
+    points, edges1, edges2 = remove_nan_points(point_data, points,
+                                               edges1, edges2)
+    for field in time_data:
+        time_data[field]['values'] = point_data.pop('__time__' + field)
+
+    return point_data, time_data, points, edges1, edges2
 
 def generate_tangents(points, branch_id):
     """
@@ -643,14 +807,69 @@ def generate_tangents(points, branch_id):
     # make sure tangents are unitary
     tangents = tangents / np.linalg.norm(tangents, axis = 0)
 
-    for i in range(tangents.shape[0]):
-        tangents[i] = tangents[i] / np.linalg.norm(tangents[i])
+    tangents = tangents / np.expand_dims(compute_norms(tangents), axis = 1)
 
     return tangents
 
+def compute_rcr(points, outlet_mask, rcr_values):
+    """
+    Compute boundary condition parameters at the outlets.
+
+    Every outlet is associated with the closest point in the rcr file.
+
+    Arguments:
+        points: n x 3 numpy array of point coordinates
+        outlet_mask: n-dimensional array containing 1 at outlet indices and 0
+                     elsewhere
+        rcr_values: dictionary associating each branch id outlet to values 
+                    of RCR boundary conditions
+
+    Returns:
+        n x 3 numpy array containing proximal resistance, capacitance and
+            distal resistance at the outlets (0 elsewhere)
+
+    """
+    # we need to find the closest point in the rcr file, because the
+    # id might be different if we used different centerlines for 
+    # solution and generation of the rcr file
+    npoints = points.shape[0]
+    rcr = np.zeros((npoints,3))
+    ioutlets = np.where(outlet_mask)[0]
+    if ioutlets.size > 0:
+        if rcr_values['bc_type'] not in ['RCR', 'R']:
+            raise ValueError('Unknown type of boundary conditions!')
+        rcr_ids = [id for id in rcr_values if type(rcr_values[id]) is dict \
+                   and 'point' in rcr_values[id]]
+        rcr_points = np.array([rcr_values[id]['point'] for id in rcr_ids])
+        _, closest = spatial.cKDTree(rcr_points).query(points[ioutlets,:])
+        for ipoint, iclosest in zip(ioutlets, closest):
+            id = rcr_ids[iclosest]
+            if rcr_values['bc_type'] == 'RCR':
+                rcr[ipoint,:] = rcr_values[id]['RCR']
+            else:
+                rcr[ipoint,0] = rcr_values[id]['RP'][0]
+    return rcr
+
+def add_boundary_conditions(graph, rcr_values):
+    """
+    Add boundary condition parameters to graph.
+
+    Arguments:
+        graph: DGL graph
+        rcr_values: dictionary associating each branch id outlet to values 
+                    of RCR boundary conditions
+
+    """
+    rcr = compute_rcr(graph.ndata['x'].detach().numpy(),
+                      graph.ndata['outlet_mask'].detach().numpy(),
+                      rcr_values)
+    graph.ndata['resistance1'] = th.reshape(th.tensor(rcr[:,0], dtype=th.float32), (-1,1,1))
+    graph.ndata['capacitance'] = th.reshape(th.tensor(rcr[:,1], dtype=th.float32), (-1,1,1))
+    graph.ndata['resistance2'] = th.reshape(th.tensor(rcr[:,2], dtype=th.float32), (-1,1,1))
+
 def generate_graph(point_data, points, edges1, edges2,
                    add_boundary_edges, add_junction_edges,
-                   rcr_values):
+                   rcr_values, n_boundary_edges = 1):
     """
     Generate graph.
 
@@ -665,6 +884,8 @@ def generate_graph(point_data, points, edges1, edges2,
         add_junction_edges (bool): decide whether to add junction edges
         rcr_values: dictionary associating each branch id outlet to values 
                     of RCR boundary conditions
+        n_boundary_edges (int): number of closest boundary nodes every node
+                                is connected to. Default -> 1
 
     Returns:
         DGL graph
@@ -694,50 +915,27 @@ def generate_graph(point_data, points, edges1, edges2,
     edges1_copy = edges1.copy()
     edges1 = np.concatenate((edges1, edges2))
     edges2 = np.concatenate((edges2, edges1_copy))
+    # junction edges only look at the centerline edges
+    cl_edges1 = edges1
+    cl_edges2 = edges2
 
     rel_position, distance = generate_edge_features(points, edges1, edges2)
 
     types, inlet_mask, \
     outlet_mask = generate_types(bif_id, indices)
 
-    # we need to find the closest point in the rcr file, because the
-    # id might be different if we used different centerlines for 
-    # solution and generation of the rcr file
-    def find_closest_point_in_rcr_file(point):
-        min_d = np.infty
-        sid = -1
-        for id in rcr_values:
-            if type(rcr_values[id]) is dict and 'point' in rcr_values[id]:
-                diff = np.linalg.norm(point - np.array(rcr_values[id]['point']))
-                if diff < min_d:
-                    min_d = diff
-                    sid = id
-        return sid
-    npoints = points.shape[0]
-    rcr = np.zeros((npoints,3))
-    for ipoint in range(npoints):
-        if outlet_mask[ipoint] == 1:
-            if rcr_values['bc_type'] == 'RCR':
-                id = find_closest_point_in_rcr_file(points[ipoint])
-                rcr[ipoint,:] = rcr_values[id]['RCR']
-            elif rcr_values['bc_type'] == 'R':
-                id = find_closest_point_in_rcr_file(points[ipoint])
-                rcr[ipoint,0] = rcr_values[id]['RP'][0]
-            else:
-                raise ValueError('Unknown type of boundary conditions!')
-    etypes = [0] * edges1.size
     # we set etype to 1 if either of the nodes is a junction
-    for iedge in range(edges1.size):
-        if types[edges1[iedge],1] == 1 or types[edges2[iedge],1] == 1:
-            etypes[iedge] = 1
+    junction = np.asarray(types[:,1]) == 1
+    etypes = (junction[edges1] | junction[edges2]).astype(np.int64)
 
     if add_boundary_edges:
         bedges1, bedges2, \
         brel_position, bdistance, \
-        btypes = generate_boundary_edges(points, indices, edges1, edges2)
+        btypes = generate_boundary_edges(points, indices, edges1, edges2,
+                                         n_boundary_edges)
         edges1 = np.concatenate((edges1, bedges1))
         edges2 = np.concatenate((edges2, bedges2))
-        etypes = etypes + btypes
+        etypes = np.concatenate((etypes, btypes))
         distance = np.concatenate((distance, bdistance))
         rel_position = np.concatenate((rel_position, brel_position), axis = 0)
 
@@ -745,12 +943,12 @@ def generate_graph(point_data, points, edges1, edges2,
         jedges1, jedges2, \
         jrel_position, jdistance, \
         jtypes, jmasks = create_junction_edges(points, bif_id,
-                                               edges1,
-                                               edges2,
+                                               cl_edges1,
+                                               cl_edges2,
                                                outlets)
         edges1 = np.concatenate((edges1, jedges1))
         edges2 = np.concatenate((edges2, jedges2))
-        etypes = etypes + jtypes
+        etypes = np.concatenate((etypes, jtypes))
         distance = np.concatenate((distance, jdistance))
         rel_position = np.concatenate((rel_position, jrel_position), axis = 0)
     else:
@@ -778,9 +976,7 @@ def generate_graph(point_data, points, edges1, edges2,
     graph.ndata['branch_id'] = th.tensor(point_data['BranchId'],
                                          dtype = th.int8)
 
-    graph.ndata['resistance1'] = th.reshape(th.tensor(rcr[:,0], dtype=th.float32), (-1,1,1))
-    graph.ndata['capacitance'] = th.reshape(th.tensor(rcr[:,1], dtype=th.float32), (-1,1,1))
-    graph.ndata['resistance2'] = th.reshape(th.tensor(rcr[:,2], dtype=th.float32), (-1,1,1))
+    add_boundary_conditions(graph, rcr_values)
 
     graph.edata['rel_position'] = th.unsqueeze(th.tensor(rel_position,
                                                dtype = th.float32), 2)
@@ -811,7 +1007,9 @@ def create_partitions(points, bif_id,
         list of partitions
     """
 
-    def create_partition(edges1, edges2, starting_point, inlets):
+    topology = CenterlineTopology(edges1, edges2, points.shape[0])
+
+    def create_partition(topology, starting_point, inlets):
         sampling_indices = [starting_point]
         new_edges1 = []
         new_edges2 = []
@@ -822,9 +1020,7 @@ def create_partitions(points, bif_id,
         while len(points_to_visit) > 0:
             j = points_to_visit[0]
             del points_to_visit[0]
-            iedges = np.where(edges1 == j)[0]
-            for iedg in iedges:
-                next_point = edges2[iedg]
+            for next_point in topology.successors(j):
                 numbering[next_point] = count
                 count = count + 1
                 sampling_indices.append(next_point)
@@ -853,10 +1049,10 @@ def create_partitions(points, bif_id,
             j = ipoint
             next = -1
             while True:
-                iedg = np.where(edges1 == j)[0]
-                if len(iedg) == 0:
+                successors = topology.successors(j)
+                if len(successors) == 0:
                     break
-                j = edges2[iedg[0]]
+                j = successors[0]
                 if bif_id[j] != -1:
                     next = j
                     break
@@ -872,7 +1068,7 @@ def create_partitions(points, bif_id,
     partitions = []
 
     for ipartition in range(len(inlets)):
-        pedges1, pedges2, sampling_indices = create_partition(edges1, edges2,
+        pedges1, pedges2, sampling_indices = create_partition(topology,
                                                             inlets[ipartition],
                                                             inlets)
         ppoints = points[sampling_indices,:]
@@ -890,16 +1086,18 @@ def create_partitions(points, bif_id,
             partitions.append(new_partition)
     return partitions
 
-def resample_time(field, timestep, period, shift = 0):
+def resample_time(field, times, timestep, period, shift = 0):
     """
     Resample timesteps.
 
     Given a time-dependent field distributed over graph nodes, this function
-    resamples the field in time using B-spline interpolation at every node.
+    resamples the field in time using B-spline interpolation. A single
+    interpolating cubic spline is computed along the time axis for all the
+    nodes at once.
 
     Arguments:
-        field: dictionary containing the field for all timesteps
-               (key: timestep, value: n-dimensional numpy array)
+        field: n x m numpy array containing the field at all timesteps
+        times: m-dimensional numpy array of (sorted) timesteps
         timestep (float): the new timestep
         period (float): period of the simulation. We restrict to one cardiac
                         cycle
@@ -908,40 +1106,620 @@ def resample_time(field, timestep, period, shift = 0):
                        Default value -> 0
 
     Returns:
-        Dictionary containing the field for all resampled timesteps
-            (key: timestep, value: n-dimensional numpy array)
+        n x k numpy array containing the field at the resampled timesteps
+        k-dimensional numpy array of resampled timesteps
     """
-    original_timesteps = [t for t in field]
-    original_timesteps.sort()
-
-    t0 = original_timesteps[0]
-    T = original_timesteps[-1]
+    t0 = times[0]
+    T = times[-1]
     t = [t0 + shift]
-    nnodes = field[t0].size
-    resampled_field = {t0 + shift: np.zeros(nnodes)}
     while t[-1] < T and t[-1] <= t[0] + period:
         t.append(t[-1] + timestep)
-        resampled_field[t[-1]] = np.zeros(nnodes)
+    t = np.array(t)
+
+    spline = interpolate.make_interp_spline(times, field, k = 3, axis = 1)
+
+    return spline(t), t
+
+def generate_geometry(point_data, points, edges1, edges2, rcr_values,
+                      params):
+    """
+    Generate the time-independent part of a graph.
+
+    The centerline is resampled and the graph (without time-dependent fields)
+    is generated from the resampled points.
+
+    Arguments:
+        point_data: dictionary containing point data (key: name, value: data)
+        points: n x 3 numpy array of point coordinates
+        edges1: numpy array containing indices of source nodes for every edge
+        edges2: numpy array containing indices of dest nodes for every edge
+        rcr_values: dictionary associating each branch id outlet to values 
+                    of RCR boundary conditions
+        params: dictionary of generation parameters (see default_parameters)
+
+    Returns:
+        DGL graph
+        numpy array with indices of the points kept after resampling
+
+    """
+    point_data = dict(point_data)
+    point_data['tangent'] = generate_tangents(points,
+                                              point_data['BranchIdTmp'])
+    inlet = [0]
+    outlets = find_outlets(edges1, edges2)
+
+    indices = {'inlet': inlet,
+               'outlets': outlets}
+
+    resample_perc = params['resample_perc']
+    remove_caps = params['remove_caps']
+    success = False
+
+    # the collapses are computed once, retries only truncate them
+    collapse_sequence = compute_collapse_sequence(points, edges1,
+                                                  edges2, indices,
+                                                  remove_caps)
+    while not success:
+        try:
+            sampled_indices, points, \
+            edges1, edges2, _ = resample_points(points.copy(),
+                                            edges1.copy(),
+                                            edges2.copy(),
+                                            dict(indices),
+                                            resample_perc,
+                                            remove_caps,
+                                            collapse_sequence)
+            success = True
+        except Exception as e:
+            print(e)
+            resample_perc = np.min([resample_perc * 2, 1])
+
+    for ndata in point_data:
+        point_data[ndata] = point_data[ndata][sampled_indices]
+
+    graph, _, _, _, _, _ = generate_graph(point_data, points, edges1, edges2,
+                                          params['add_boundary_edges'],
+                                          params['add_junction_edges'],
+                                          rcr_values,
+                                          params['n_boundary_edges'])
+
+    return graph, sampled_indices
+
+def hash_geometry(point_data, points, edges1, edges2, params):
+    """
+    Compute the SHA-256 hash of a geometry.
+
+    The hash depends on the points, the connectivity, the point data and the
+    generation parameters that affect the time-independent part of graphs.
+
+    Arguments:
+        point_data: dictionary containing point data (key: name, value: data)
+        points: n x 3 numpy array of point coordinates
+        edges1: numpy array containing indices of source nodes for every edge
+        edges2: numpy array containing indices of dest nodes for every edge
+        params: dictionary of generation parameters (see default_parameters)
+
+    Returns:
+        hexadecimal digest (string)
+
+    """
+    sha = hashlib.sha256()
+    arrays = [('points', points), ('edges1', edges1), ('edges2', edges2)]
+    arrays += [(name, point_data[name]) for name in sorted(point_data)]
+    for name, array in arrays:
+        array = np.ascontiguousarray(array)
+        sha.update('{} {} {}'.format(name, array.dtype,
+                                     array.shape).encode())
+        sha.update(array.tobytes())
+    geometry_params = {name: params[name] for name in ['resample_perc',
+                                                       'remove_caps',
+                                                       'add_boundary_edges',
+                                                       'add_junction_edges',
+                                                       'n_boundary_edges']}
+    sha.update(json.dumps(geometry_params, sort_keys = True).encode())
+    return sha.hexdigest()
+
+def load_geometry(key, cache_dir):
+    """
+    Load a geometry from the cache.
+
+    Arguments:
+        key (string): hash of the geometry (see hash_geometry)
+        cache_dir (string): path to cache directory
+
+    Returns:
+        DGL graph (None if the geometry is not in the cache)
+        numpy array with indices of the points kept after resampling (None if
+            the geometry is not in the cache)
+
+    """
+    fname = cache_dir + key + '.grph'
+    if not os.path.exists(fname):
+        return None, None
+    graphs, labels = dgl.load_graphs(fname)
+    return graphs[0], labels['sampled_indices'].detach().numpy()
+
+def save_geometry(graph, sampled_indices, key, cache_dir):
+    """
+    Save a geometry to the cache.
+
+    Arguments:
+        graph: DGL graph without time-dependent fields
+        sampled_indices: numpy array with indices of the points kept after
+                         resampling
+        key (string): hash of the geometry (see hash_geometry)
+        cache_dir (string): path to cache directory
+
+    """
+    os.makedirs(cache_dir, exist_ok = True)
+    labels = {'sampled_indices': th.tensor(sampled_indices)}
+    io.write_atomically(lambda f: dgl.save_graphs(f, graph, labels),
+                        cache_dir + key + '.grph')
+
+def prune_geometry_cache(keys, cache_dir):
+    """
+    Remove the geometries that are not used by any file from the cache.
+
+    Arguments:
+        keys: set of keys of the geometries to keep (see hash_geometry)
+        cache_dir (string): path to cache directory
 
-    for inode in range(nnodes):
-        values = []
-        for time in original_timesteps:
-            values.append(field[time][inode])
+    """
+    if not os.path.isdir(cache_dir):
+        return
+    for fname in os.listdir(cache_dir):
+        # temporary files of interrupted writes are left untouched
+        if fname.endswith('.grph') and fname[:-len('.grph')] not in keys:
+            os.remove(cache_dir + fname)
+
+def generate_graphs_from_file(file, input_dir, output_dir, dataset_info,
+                              params):
+    """
+    Generate graphs from a vtp file.
+
+    The graphs (one per time-shifted copy) are saved in output_dir. If
+    params['graph_format'] is 'store', all copies are saved in a single graph
+    store (see graph_store.save_store) named after the vtp file; otherwise,
+    every copy is saved in its own .grph file. Every file is written
+    atomically, so that an interrupted run does not leave partially written
+    graphs. If params['geometry_cache'] is True, the time-independent part of
+    the graph is stored in output_dir + GEOMETRY_CACHE_DIR and reused by all
+    simulations on the same geometry. The catalog entries of the generated
+    files (see graph_store.catalog_entry) are computed from the graphs in
+    memory.
+
+    Arguments:
+        file (string): name of the vtp file
+        input_dir (string): path to input directory
+        output_dir (string): path to output directory
+        dataset_info: dictionary containing dataset information
+                      (key: simulation name, value: info)
+        params: dictionary of generation parameters (see default_parameters)
+
+    Returns:
+        list of names of the generated graph files
+        dictionary of catalog entries (key: graph file name, value: entry)
+        key of the geometry in the cache (see hash_geometry). None if
+            params['geometry_cache'] is False
+
+    """
+    point_data, time_data, \
+    points, edges1, edges2 = load_vtp_fields(file, input_dir,
+                                             ['area', 'BifurcationId',
+                                              'BranchId', 'BranchIdTmp'],
+                                             ['pressure', 'flow', 'velocity'])
+
+    fname = file.replace('.vtp','')
+    graph = None
+    key = None
+    if params['geometry_cache']:
+        cache_dir = output_dir + GEOMETRY_CACHE_DIR + '/'
+        key = hash_geometry(point_data, points, edges1, edges2, params)
+        graph, sampled_indices = load_geometry(key, cache_dir)
+    if graph == None:
+        graph, sampled_indices = generate_geometry(point_data, points,
+                                                   edges1, edges2,
+                                                   dataset_info[fname],
+                                                   params)
+        if params['geometry_cache']:
+            save_geometry(graph, sampled_indices, key, cache_dir)
+    else:
+        # boundary conditions might differ between simulations
+        add_boundary_conditions(graph, dataset_info[fname])
+
+    if 'flow' not in time_data:
+        time_data['flow'] = time_data['velocity']
+
+    # time-dependent fields are stored as n x m arrays (n nodes, m timesteps)
+    timestep = float(dataset_info[fname]['dt'])
+    times = time_data['pressure']['times'] * timestep
+    pressure = time_data['pressure']['values'][sampled_indices,:]
+    flowrate = time_data['flow']['values'][sampled_indices,:]
+
+    # scale pressure to be mmHg
+    pressure = pressure / 1333.2
+
+    do_resample_time = params['resample_time']
+    dt = params['dt']
+    ncopies = 1
+    if do_resample_time:
+        ncopies = params['ncopies']
+        offset = int(np.floor((dt / timestep) / ncopies))
+
+    filenames = []
+    blocks = {}
+    metadata = []
+    catalog = {}
+    model_type = dataset_info[fname].get('model_type')
+    intime = 0
+    for icopy in range(ncopies):
+        c_times = times[intime:]
+        c_pressure = pressure[:,intime:]
+        c_flowrate = flowrate[:,intime:]
+
+        if do_resample_time:
+            period = dataset_info[fname]['T']
+            shift = dataset_info[fname]['time_shift']
+            c_pressure, r_times = resample_time(c_pressure, c_times,
+                                                timestep = dt,
+                                                period = period,
+                                                shift = shift)
+            c_flowrate, r_times = resample_time(c_flowrate, c_times,
+                                                timestep = dt,
+                                                period =  period,
+                                                shift = shift)
+            c_times = r_times
+            intime = intime + offset
+
+        padt = params['padt']
+        add_fields(graph, c_pressure, c_times, 'pressure',
+                   pad = int(padt / dt))
+        add_fields(graph, c_flowrate, c_times, 'flowrate',
+                   pad = int(padt / dt))
+
+        filename = file.replace('.vtp','.' + str(icopy) + '.grph')
+        metadata.append((filename, gs.graph_metadata(graph)))
+        if params['graph_format'] == 'store':
+            blocks[filename] = {field: graph.ndata[field]
+                                for field in gs.TIME_FIELDS}
+        else:
+            gs.save_graph(output_dir + filename, graph, params['codec'])
+            filenames.append(filename)
+            catalog[filename] = gs.catalog_entry(output_dir + filename,
+                                                 metadata[-1:], model_type)
+
+    if params['graph_format'] == 'store':
+        # topology and static features are stored once for all copies
+        filename = file.replace('.vtp','.grphs')
+        gs.save_store(output_dir + filename, graph, blocks, params['codec'])
+        filenames.append(filename)
+        # graphs are read from a store sorted by name
+        metadata = sorted(metadata, key = lambda entry: entry[0])
+        catalog[filename] = gs.catalog_entry(output_dir + filename, metadata,
+                                             model_type)
+
+    return filenames, catalog, key
+
+def generate_graphs_from_file_safe(file, input_dir, output_dir, dataset_info,
+                                   params):
+    """
+    Generate graphs from a vtp file, catching any error.
+
+    Arguments:
+        file (string): name of the vtp file
+        input_dir (string): path to input directory
+        output_dir (string): path to output directory
+        dataset_info: dictionary containing dataset information
+                      (key: simulation name, value: info)
+        params: dictionary of generation parameters (see default_parameters)
+
+    Returns:
+        name of the vtp file
+        list of names of the generated graph files
+        dictionary of catalog entries of the generated graph files
+        key of the geometry in the cache (see generate_graphs_from_file)
+        string containing the traceback of the error (None if no error
+            occurred)
+
+    """
+    try:
+        filenames, catalog, key = generate_graphs_from_file(file, input_dir,
+                                                            output_dir,
+                                                            dataset_info,
+                                                            params)
+        return file, filenames, catalog, key, None
+    except Exception:
+        return file, [], {}, None, traceback.format_exc()
 
-        tck, _ = scipy.interpolate.splprep([values],
-                                           u = original_timesteps, s = 0)
-        values_interpolated = interpolate.splev(t, tck)[0]
+def default_parameters():
+    """
+    Default graph generation parameters.
+
+    Returns:
+        dictionary of parameters
+    """
+    params = {'resample_perc': 0.06,
+              'remove_caps': 3,
+              'add_boundary_edges': True,
+              'n_boundary_edges': 1,
+              'add_junction_edges': False,
+              'resample_time': True,
+              'ncopies': 4,
+              'dt': 0.01,
+              'padt': 0.1,
+              'geometry_cache': True,
+              'graph_format': 'store',
+              'codec': None}
+    return params
+
+def generate_all_graphs(files, input_dir, output_dir, dataset_info, params,
+                        nworkers = 1):
+    """
+    Generate graphs from a list of vtp files.
 
-        for i, time in enumerate(t):
-            resampled_field[time][inode] = values_interpolated[i]
+    Files are independent and are processed by a pool of nworkers processes.
+    Errors are caught file by file, so that a failing file does not stop the
+    generation of the others.
 
-    return resampled_field
+    Arguments:
+        files: list of names of vtp files
+        input_dir (string): path to input directory
+        output_dir (string): path to output directory
+        dataset_info: dictionary containing dataset information
+                      (key: simulation name, value: info)
+        params: dictionary of generation parameters (see default_parameters)
+        nworkers (int): number of worker processes. If 1, files are
+                        processed in the current process. Default -> 1
+
+    Returns:
+        dictionary of generated graph files (key: vtp file, value: list of
+            graph file names)
+        dictionary of catalog entries (key: graph file name, value: entry,
+            see graph_store.catalog_entry)
+        dictionary of geometry keys of the generated files (key: vtp file,
+            value: key in the geometry cache, see hash_geometry)
+        dictionary of failed files (key: vtp file, value: traceback)
+
+    """
+    generated = {}
+    catalog = {}
+    geometries = {}
+    failed = {}
+
+    def collect(result):
+        file, filenames, entries, key, error = result
+        if error == None:
+            generated[file] = filenames
+            catalog.update(entries)
+            geometries[file] = key
+        else:
+            failed[file] = error
+            print('Failed to generate graphs from {}:'.format(file))
+            print(error, flush = True)
+
+    if nworkers == 1:
+        for file in tqdm(files, desc = 'Generating graphs', colour='green'):
+            collect(generate_graphs_from_file_safe(file, input_dir, output_dir,
+                                                   dataset_info, params))
+    else:
+        with ProcessPoolExecutor(max_workers = nworkers) as executor:
+            futures = [executor.submit(generate_graphs_from_file_safe, file,
+                                       input_dir, output_dir, dataset_info,
+                                       params) for file in files]
+            for future in tqdm(as_completed(futures), total = len(futures),
+                               desc = 'Generating graphs', colour='green'):
+                collect(future.result())
+
+    return generated, catalog, geometries, failed
+
+def hash_file(fname):
+    """
+    Compute the SHA-256 hash of a file.
+
+    Arguments:
+        fname (string): name of the file
+
+    Returns:
+        hexadecimal digest (string)
+
+    """
+    sha = hashlib.sha256()
+    with open(fname, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def hash_inputs(file, input_dir, dataset_info, params):
+    """
+    Compute the hashes of all the inputs used to generate graphs from a file.
+
+    Arguments:
+        file (string): name of the vtp file
+        input_dir (string): path to input directory
+        dataset_info: dictionary containing dataset information
+                      (key: simulation name, value: info)
+        params: dictionary of generation parameters (see default_parameters)
+
+    Returns:
+        dictionary containing the hashes of the vtp file ('vtp'), of its
+            dataset_info entry ('dataset_info') and of the generation
+            parameters ('params')
+
+    """
+    def hash_json(data):
+        return hashlib.sha256(json.dumps(data,
+                                         sort_keys = True).encode()).hexdigest()
+
+    return {'vtp': hash_file(input_dir + file),
+            'dataset_info': hash_json(dataset_info.get(file.replace('.vtp',''))),
+            'params': hash_json(params)}
+
+def load_manifest(output_dir):
+    """
+    Load the manifest of a graph folder.
+
+    The manifest associates each vtp file with the hashes of its inputs, with
+    the list of graph files generated from it and with the key of its
+    geometry in the cache (see hash_geometry).
+
+    Arguments:
+        output_dir (string): path to output directory
+
+    Returns:
+        dictionary (key: vtp file, value: dictionary with keys 'hashes',
+            'outputs' and 'geometry'). Empty if the manifest does not exist
+
+    """
+    fname = output_dir + MANIFEST_FILE
+    if not os.path.exists(fname):
+        return {}
+    with open(fname, 'r') as f:
+        return json.load(f)['files']
+
+def save_manifest(manifest, output_dir):
+    """
+    Save the manifest of a graph folder.
+
+    Arguments:
+        manifest: dictionary (key: vtp file, value: dictionary with keys
+                  'hashes', 'outputs' and 'geometry')
+        output_dir (string): path to output directory
+
+    """
+    def write(fname):
+        with open(fname, 'w') as outfile:
+            json.dump({'files': manifest}, outfile, indent = 4,
+                      sort_keys = True)
+
+    io.write_atomically(write, output_dir + MANIFEST_FILE)
+
+def update_graphs(files, input_dir, output_dir, dataset_info, params,
+                  nworkers = 1, manifest = None):
+    """
+    Generate graphs only for the files whose inputs changed.
+
+    Graphs are regenerated if the hash of the vtp file, of its dataset_info
+    entry, or of the generation parameters differs from the one in the
+    manifest, or if some of the outputs are missing. Outputs of files that are
+    no longer in the list are removed, as well as the geometries in the cache
+    that no file uses. The manifest and the catalog (see
+    graph_store.catalog_entry) are updated on disk.
+
+    Arguments:
+        files: list of names of vtp files
+        input_dir (string): path to input directory
+        output_dir (string): path to output directory
+        dataset_info: dictionary containing dataset information
+                      (key: simulation name, value: info)
+        params: dictionary of generation parameters (see default_parameters)
+        nworkers (int): number of worker processes. Default -> 1
+        manifest: dictionary (key: vtp file, value: dictionary with keys
+                  'hashes', 'outputs' and 'geometry'). Default -> None (read
+                  the manifest in output_dir)
+
+    Returns:
+        dictionary of failed files (key: vtp file, value: traceback)
+
+    """
+    if manifest == None:
+        manifest = load_manifest(output_dir)
+
+    def remove_outputs(outputs):
+        for output in outputs:
+            if os.path.exists(output_dir + output):
+                os.remove(output_dir + output)
+
+    for file in list(manifest):
+        if file not in files:
+            remove_outputs(manifest[file]['outputs'])
+            del manifest[file]
+
+    hashes = {}
+    files_to_update = []
+    for file in files:
+        hashes[file] = hash_inputs(file, input_dir, dataset_info, params)
+        if file in manifest and manifest[file].get('hashes') == hashes[file] and \
+           all(os.path.exists(output_dir + output)
+               for output in manifest[file]['outputs']):
+            continue
+        files_to_update.append(file)
+
+    print('Generating graphs for {} out of {} files'.format(
+          len(files_to_update), len(files)))
+    generated, entries, \
+    geometries, failed = generate_all_graphs(files_to_update, input_dir,
+                                             output_dir, dataset_info,
+                                             params, nworkers)
+
+    for file in generated:
+        if file in manifest:
+            remove_outputs([output for output in manifest[file]['outputs']
+                            if output not in generated[file]])
+        manifest[file] = {'hashes': hashes[file],
+                          'outputs': generated[file],
+                          'geometry': geometries[file]}
+    # failed files are generated again at the next update
+    for file in failed:
+        if file in manifest:
+            del manifest[file]['hashes']
+
+    save_manifest(manifest, output_dir)
+
+    # entries of removed outputs are dropped
+    catalog = gs.load_catalog(output_dir)
+    catalog.update(entries)
+    outputs = set(output for file in manifest
+                  for output in manifest[file]['outputs'])
+    gs.save_catalog({output: catalog[output] for output in catalog
+                     if output in outputs}, output_dir)
+
+    # geometries of files that were removed, or whose geometry changed, are
+    # dropped. Manifests written by older versions do not record geometries:
+    # the geometry of these files is computed again when they are regenerated
+    prune_geometry_cache(set(manifest[file].get('geometry')
+                             for file in manifest),
+                         output_dir + GEOMETRY_CACHE_DIR + '/')
+
+    return failed
 
 """
 The main function reads all vtps files from the folder specified in input_dir
-and generates DGL graphs. The graphs are saved in output_dir.
+and generates DGL graphs. The graphs are saved in output_dir. The number of
+worker processes can be set with --nworkers. With --incremental, only the
+graphs whose inputs changed since the last run (see manifest.json in
+output_dir) are generated.
 """
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate graphs')
+    parser.add_argument('--nworkers', help='number of worker processes',
+                        type=int, default=1)
+    parser.add_argument('--incremental', help='only generate graphs whose ' + \
+                        'inputs changed since the last run',
+                        action='store_true')
+    parser.add_argument('--n_boundary_edges', help='number of closest ' + \
+                        'boundary nodes every node is connected to',
+                        type=int, default=1)
+    parser.add_argument('--ncopies', help='number of time-shifted ' + \
+                        'copies of every simulation (use 1 when time ' + \
+                        'shifts are applied by the dataset)',
+                        type=int, default=4)
+    parser.add_argument('--graph_format', help='store all copies of a ' + \
+                        'simulation in one graph store (store) or every ' + \
+                        'copy in its own file (graphs)',
+                        choices=['store', 'graphs'], default='store')
+    parser.add_argument('--codec', help='store pressure and flow rate ' + \
+                        'with reduced precision (none: not encoded, ' + \
+                        'float32: compressed only)',
+                        choices=['none', 'float32', 'float16', 'bfloat16',
+                                 'int16'],
+                        default='none')
+    parser.add_argument('--compression', help='compression of the ' + \
+                        'fields stored with reduced precision (zstd and ' + \
+                        'lz4 fall back to zlib if not installed)',
+                        choices=['zstd', 'lz4', 'zlib', 'none'],
+                        default='zstd')
+    args = parser.parse_args()
+
     data_location = io.data_location()
     input_dir = data_location + 'vtps/'
     output_dir = data_location + 'graphs/'
@@ -953,119 +1731,24 @@ if __name__ == "__main__":
     print('Processing all files in {}'.format(input_dir))
     print('File list:')
     print(files)
-    for file in tqdm(files, desc = 'Generating graphs', colour='green'):
-        if '.vtp' in file and 's' in file:
-            point_data, points, edges1, edges2 = load_vtp(file, input_dir)
-            try:
-                point_data['tangent'] = generate_tangents(points,
-                                                      point_data['BranchIdTmp'])
-            except Exception:
-                continue
-            inlet = [0]
-            outlets = find_outlets(edges1, edges2)
-
-            indices = {'inlet': inlet,
-                       'outlets': outlets}
-
-            resample_perc = 0.06
-            success = False
-
-            while not success:
-                try:
-                    sampled_indices, points, \
-                    edges1, edges2, _ = resample_points(points.copy(),
-                                                    edges1.copy(),
-                                                    edges2.copy(), indices,
-                                                    resample_perc,
-                                                    remove_caps = 3)
-                    success = True
-                except Exception as e:
-                    print(e)
-                    resample_perc = np.min([resample_perc * 2, 1])
-
-            for ndata in point_data:
-                point_data[ndata] = point_data[ndata][sampled_indices]
-
-            inlet = [0]
-            outlets = find_outlets(edges1, edges2)
-
-            indices = {'inlet': inlet,
-                       'outlets': outlets}
-
-            pressure = io.gather_array(point_data, 'pressure')
-            flowrate = io.gather_array(point_data, 'flow')
-            if len(flowrate) == 0:
-                flowrate = io.gather_array(point_data, 'velocity')
-
-            times = [t for t in pressure]
-            timestep = float(dataset_info[file.replace('.vtp','')]['dt'])
-            for t in times:
-                pressure[t * timestep] = pressure[t]
-                flowrate[t * timestep] = flowrate[t]
-                del pressure[t]
-                del flowrate[t]
-
-            # scale pressure to be mmHg
-            for t in pressure:
-                pressure[t] = pressure[t] / 1333.2
-
-            times = [t for t in pressure]
-
-            sampling_inqdices = np.arange(points.shape[0])
-            part = {'point_data': point_data,
-                     'points': points,
-                     'edges1': edges1,
-                     'edges2': edges2,
-                     'sampling_indices': sampling_indices}
-
-            add_boundary_edges = True
-            add_junction_edges = False
-
-            fname = file.replace('.vtp','')
-            graph, indices, \
-            points, bif_id, \
-            edges1, edges2 = generate_graph(part['point_data'],
-                                            part['points'],
-                                            part['edges1'],
-                                            part['edges2'],
-                                            add_boundary_edges,
-                                            add_junction_edges,
-                                            dataset_info[fname])
-
-            do_resample_time = True
-            ncopies = 1
-            if do_resample_time:
-                ncopies = 4
-                dt = 0.01
-                offset = int(np.floor((dt / timestep) / ncopies))
-
-            intime = 0
-            for icopy in range(ncopies):
-                c_pressure = {}
-                c_flowrate = {}
-                
-                for t in times[intime:]:
-                    c_pressure[t] = pressure[t][part['sampling_indices']]
-                    c_flowrate[t] = flowrate[t][part['sampling_indices']]
-
-                if do_resample_time:
-                    period = dataset_info[fname]['T']
-                    shift = dataset_info[fname]['time_shift']
-                    c_pressure = resample_time(c_pressure, timestep = dt, 
-                                            period = period,
-                                            shift = shift)
-                    c_flowrate = resample_time(c_flowrate, 
-                                            timestep = dt,
-                                            period =  period,
-                                            shift = shift)
-                    intime = intime + offset
-
-                padt = 0.1
-                add_fields(graph, c_pressure, 'pressure', pad = int(padt / dt))
-                add_fields(graph, c_flowrate, 'flowrate', pad = int(padt / dt))
-
-                filename = file.replace('.vtp','.' + str(icopy) + '.grph')
-                dgl.save_graphs(output_dir + filename, graph)
-
-    shutil.copy(input_dir + 'dataset_info.json',  
+    files = [file for file in files if '.vtp' in file and 's' in file]
+    params = default_parameters()
+    params['n_boundary_edges'] = args.n_boundary_edges
+    params['graph_format'] = args.graph_format
+    params['ncopies'] = args.ncopies
+    if args.codec != 'none':
+        params['codec'] = fc.default_codec()
+        params['codec']['dtype'] = args.codec
+        params['codec']['compression'] = args.compression
+    manifest = None
+    if not args.incremental:
+        # all graphs are generated, but we still record the manifest
+        manifest = {}
+    failed = update_graphs(files, input_dir, output_dir, dataset_info,
+                           params, args.nworkers, manifest)
+    if len(failed) > 0:
+        print('Graph generation failed for {} files:'.format(len(failed)))
+        print(sorted(failed))
+
+    shutil.copy(input_dir + 'dataset_info.json',
                 output_dir + 'dataset_info.json')
@@ -22,14 +22,28 @@ import sys
 import os
 sys.path.append(os.getcwd())
 import tools.io_utils as io
+import graph1d.graph_store as gs
+import graph1d.field_statistics as fs
 import dgl
 import torch as th
 from tqdm import tqdm
-from dgl.data.utils import load_graphs as lg
 import numpy as np
 import json
+import hashlib
+import shutil
 import random
 import scipy
+from concurrent.futures import ThreadPoolExecutor
+
+DELTA_FIELDS = {'dp': 'pressure', 'dq': 'flowrate'}
+STATISTICS_FILE = 'statistics.json'
+CACHE_DIR = 'normalized_cache'
+# version of the normalized graphs in the cache. It must be increased when
+# the normalized graphs change (e.g., features, compaction or statistics),
+# so that caches written by previous versions are not used
+CACHE_VERSION = 1
+# number of timesteps per chunk of cached graphs in 'chunked' format
+CHUNK_SIZE = 16
 
 def normalize(field, field_name, statistics, norm_dict_label):
     """
@@ -96,116 +110,416 @@ def invert_normalize(field, field_name, statistics, norm_dict_label):
         raise Exception('Normalization type not implemented')
     return field
 
-def load_graphs(input_dir):
+def load_graph_file(fname):
     """
-    Load all graphs in directory.
+    Load all graphs contained in a file.
+
+    Arguments:
+        fname (string): name of a .grph file, of a graph store (.grphs) or of
+                        a graph in columnar format (gs.COLUMNAR_EXT)
+
+    Returns:
+        dictionary of graphs (key: graph name, value: DGL graph)
+
+    """
+    if fname.endswith('.grphs'):
+        store = gs.GraphStore(fname)
+        return {name: store.get_graph(name) for name in store.names()}
+    if fname.endswith(gs.COLUMNAR_EXT):
+        graph, name = gs.load_columnar(fname)
+        return {name: graph}
+    return {os.path.basename(fname): gs.load_graph(fname)}
+
+def list_graph_files(input_dir):
+    """
+    List graph files (.grph and .grphs) in directory, in random order.
+
+    The order is fixed by a seed and determines the train/test splits.
 
     Arguments:
         input_dir (string): input directory path
 
     Returns:
-        list of DGL graphs
+        list of file names
 
     """
-    files = os.listdir(input_dir)
+    # only the files written by generate_graphs in previous versions (graphs
+    # and dataset_info.json) are shuffled, so that any other file in the
+    # folder (e.g., STATISTICS_FILE, CACHE_DIR, the catalog, the manifest
+    # and the geometry cache) does not change the order of the graphs
+    files = [file for file in os.listdir(input_dir)
+             if 'grph' in file or file == 'dataset_info.json']
     random.seed(10)
     random.shuffle(files)
+    return [file for file in files if 'grph' in file]
+
+def read_graph_files(input_dir, files, nworkers = 1, lazy = False,
+                     max_graphs = None):
+    """
+    Read graph files.
+
+    Graphs are either stored in .grph files (one graph per file), in graph
+    stores (.grphs files, see graph_store.save_store) or in columnar format
+    (see graph_store.save_columnar). Files are read by a pool of nworkers
+    threads.
+
+    If lazy is True, graphs are only loaded when they are first accessed, and
+    at most max_graphs graphs are kept in memory (see graph_store.LazyGraphs).
+    Graph stores are still read once to collect the names of the graphs they
+    contain.
+
+    Arguments:
+        input_dir (string): input directory path
+        files: list of file names
+        nworkers (int): number of threads reading files. Default -> 1
+        lazy (bool): load graphs on first access. Default -> False
+        max_graphs (int): maximum number of graphs kept in memory in lazy
+                          mode. Default -> None (no limit)
 
-    graphs = {}
-    for file in tqdm(files, desc = 'Loading graphs', colour='green'):
-        if 'grph' in file:
-            graphs[file] = lg(input_dir + file)[0][0]
+    Returns:
+        list of DGL graphs, in the order of the files
+
+    """
+    def read(file):
+        if lazy and file.endswith('.grph'):
+            return [file]
+        if lazy and file.endswith(gs.COLUMNAR_EXT):
+            return [gs.columnar_name(input_dir + file)]
+        return load_graph_file(input_dir + file)
+
+    with ThreadPoolExecutor(max_workers = nworkers) as executor:
+        loaded = list(tqdm(executor.map(read, files), total = len(files),
+                           desc = 'Loading graphs', colour='green'))
+
+    graphs = gs.LazyGraphs(max_graphs if lazy else None)
+    for file, file_graphs in zip(files, loaded):
+        if lazy:
+            fname = input_dir + file
+            graphs.add_source(list(file_graphs),
+                              lambda fname = fname: load_graph_file(fname),
+                              file)
+        else:
+            for name in file_graphs:
+                graphs[name] = file_graphs[name]
+                graphs.files[name] = file
 
     return graphs
 
-def compute_statistics(graphs, fields, statistics):
+def load_graphs(input_dir, nworkers = 1, lazy = False, max_graphs = None):
+    """
+    Load all graphs in directory (see list_graph_files and read_graph_files).
+
+    Arguments:
+        input_dir (string): input directory path
+        nworkers (int): number of threads reading files. Default -> 1
+        lazy (bool): load graphs on first access. Default -> False
+        max_graphs (int): maximum number of graphs kept in memory in lazy
+                          mode. Default -> None (no limit)
+
+    Returns:
+        list of DGL graphs
+
+    """
+    return read_graph_files(input_dir, list_graph_files(input_dir),
+                            nworkers, lazy, max_graphs)
+
+def simulation_name(graph_name):
+    """
+    Name of the simulation a graph was generated from.
+
+    Arguments:
+        graph_name (string): name of the graph
+
+    Returns:
+        simulation name (key of dataset_info)
+
+    """
+    return ".".join(graph_name.split(".", 2)[:2])
+
+def update_catalog(input_dir, nworkers = 1):
+    """
+    Update the catalog of a graph folder.
+
+    The catalog (input_dir + graph_store.CATALOG_FILE) contains an entry for
+    every graph file (see graph_store.catalog_entry). Entries are usually
+    written by generate_graphs; only files that are not in the catalog or
+    that changed since their entry was written are read.
+
+    Arguments:
+        input_dir (string): input directory path
+        nworkers (int): number of threads reading files. Default -> 1
+
+    Returns:
+        dictionary (key: file name, value: dictionary with keys 'signature'
+        and 'graphs')
+
+    """
+    catalog = gs.load_catalog(input_dir)
+
+    files = list_graph_files(input_dir)
+    signatures = {file: io.file_signature(input_dir + file) for file in files}
+    changed = [file for file in files if file not in catalog or
+               catalog[file]['signature'] != signatures[file]]
+    removed = [file for file in catalog if file not in signatures]
+    if len(changed) == 0 and len(removed) == 0:
+        return catalog
+
+    dataset_info = {}
+    if os.path.exists(input_dir + 'dataset_info.json'):
+        with open(input_dir + 'dataset_info.json', 'r') as infile:
+            dataset_info = json.load(infile)
+
+    def read(file):
+        file_graphs = load_graph_file(input_dir + file)
+        metadata = [(name, gs.graph_metadata(file_graphs[name]))
+                    for name in file_graphs]
+        model_type = None
+        if len(metadata) > 0:
+            model_type = dataset_info.get(simulation_name(metadata[0][0]),
+                                          {}).get('model_type')
+        return gs.catalog_entry(input_dir + file, metadata, model_type)
+
+    with ThreadPoolExecutor(max_workers = nworkers) as executor:
+        entries = list(tqdm(executor.map(read, changed), total = len(changed),
+                            desc = 'Updating catalog', colour='green'))
+
+    for file in removed:
+        del catalog[file]
+    for file, entry in zip(changed, entries):
+        catalog[file] = entry
+
+    gs.save_catalog(catalog, input_dir)
+    return catalog
+
+def load_selected_graphs(input_dir, names = None, types = None,
+                         types_to_keep = None, n_graphs_to_keep = -1,
+                         nworkers = 1, lazy = False, max_graphs = None):
+    """
+    Load a selection of the graphs in a directory.
+
+    Graphs are selected using the catalog (see update_catalog), and only the
+    files containing selected graphs are read (see read_graph_files). The
+    order of the graphs is the same as in load_graphs.
+
+    Arguments:
+        input_dir (string): input directory path
+        names: list of names of graphs to keep. Default -> None (keep all)
+        types: dictionary with all types (key: model name, value: type).
+               Default -> None
+        types_to_keep: list with types to keep. Default -> None (keep all)
+        n_graphs_to_keep: number of simulations to keep (see
+                          keep_simulations). Default -> -1 (keep all)
+        nworkers (int): number of threads reading files. Default -> 1
+        lazy (bool): load graphs on first access. Default -> False
+        max_graphs (int): maximum number of graphs kept in memory in lazy
+                          mode. Default -> None (no limit)
+
+    Returns:
+        list of DGL graphs
+
+    """
+    files = list_graph_files(input_dir)
+    catalog = update_catalog(input_dir, nworkers)
+
+    selected = [entry['name'] for file in files
+                for entry in catalog[file]['graphs']]
+    if names != None:
+        names = set(names)
+        selected = [name for name in selected if name in names]
+    if types_to_keep != None:
+        selected = restrict_names(selected, types, types_to_keep)
+    if n_graphs_to_keep != -1:
+        selected = keep_simulations(selected, n_graphs_to_keep)
+
+    selected_set = set(selected)
+    files = [file for file in files
+             if any(entry['name'] in selected_set
+                    for entry in catalog[file]['graphs'])]
+    graphs = read_graph_files(input_dir, files, nworkers, lazy, max_graphs)
+    return select_graphs(graphs, selected)
+
+def apply_to_graphs(graphs, transform, desc):
+    """
+    Apply a transform to all graphs.
+
+    If graphs are loaded lazily (see graph_store.LazyGraphs), the transform is
+    also applied to graphs when they are loaded.
+
+    Arguments:
+        graphs: list of graphs
+        transform: function modifying a DGL graph in place
+        desc (string): description shown in the progress bar
+
+    """
+    if isinstance(graphs, gs.LazyGraphs):
+        graphs.add_transform(transform)
+    else:
+        for graph_n in tqdm(graphs, desc = desc, colour='green'):
+            transform(graphs[graph_n])
+
+def select_graphs(graphs, names):
+    """
+    Select a subset of graphs.
+
+    Arguments:
+        graphs: list of graphs
+        names: list of names of graphs to keep
+
+    Returns:
+        restricted list of DGL graphs
+
+    """
+    if isinstance(graphs, gs.LazyGraphs):
+        return graphs.subset(names)
+    return {name: graphs[name] for name in names}
+
+def graph_statistics(graph, fields):
+    """
+    Compute the accumulators of a single graph.
+
+    Besides the requested fields, the number of nodes ('nodes'), of edges
+    ('edges') and of timesteps ('tsteps') of the graph are accumulated.
+
+    Arguments:
+        graph: DGL graph
+        fields: dictionary containing field names, divided into node, edge,
+                outlet_node and delta fields. Delta fields (see DELTA_FIELDS)
+                are the increments of a node field from time t to t+1
+    Returns:
+        dictionary (key: field name, value: FieldStatistics)
+
+    """
+    accumulators = {}
+    for etype in fields:
+        for field_name in fields[etype]:
+            if etype == 'node':
+                d = graph.ndata[field_name]
+            elif etype == 'edge':
+                d = graph.edata[field_name]
+            elif etype == 'outlet_node':
+                mask = graph.ndata['outlet_mask'].bool()
+                d = graph.ndata[field_name][mask]
+            elif etype == 'delta':
+                f = graph.ndata[DELTA_FIELDS[field_name]]
+                d = f[:,:,1:] - f[:,:,:-1]
+            accumulators[field_name] = fs.FieldStatistics()
+            accumulators[field_name].update(d)
+
+    for name, size in [('nodes', graph.ndata['x'].shape[0]),
+                       ('edges', graph.edata['distance'].shape[0]),
+                       ('tsteps', graph.ndata['pressure'].shape[2])]:
+        accumulators[name] = fs.FieldStatistics()
+        accumulators[name].update([size])
+
+    return accumulators
+
+def accumulate_statistics(graphs, fields, accumulators = None,
+                          statistics_file = None, input_dir = None):
+    """
+    Accumulate statistics on a list of graphs.
+
+    Every graph is visited once and all fields are updated at the same time
+    (see graph_statistics).
+
+    If statistics_file is provided, the accumulators of every graph are
+    persisted in it (see field_statistics.save_graph_accumulators), together
+    with the signature of the file containing the graph. Graphs whose
+    accumulators are already stored and whose file did not change since are
+    not visited, so that only new graphs are streamed when the dataset grows.
+
+    Arguments:
+        graphs: list of graphs
+        fields: dictionary containing field names, divided into node, edge,
+                outlet_node and delta fields
+        accumulators: dictionary (key: field name, value: FieldStatistics)
+                      to update. Default -> None (start from empty
+                      accumulators)
+        statistics_file (string): name of the file containing the
+                                  accumulators of every graph.
+                                  Default -> None (do not persist)
+        input_dir (string): directory containing the graph files. Required
+                            if statistics_file is provided. Default -> None
+    Returns:
+        dictionary of accumulators (key: field name, value: FieldStatistics)
+
+    """
+    if accumulators == None:
+        accumulators = {}
+
+    stored = {}
+    if statistics_file != None and os.path.exists(statistics_file):
+        stored = fs.load_graph_accumulators(statistics_file)
+        stored = {name: stored[name] for name in stored
+                  if os.path.exists(input_dir + stored[name]['file'])}
+
+    names = [field_name for etype in fields for field_name in fields[etype]]
+    nnew = 0
+    for graph_n in tqdm(graphs, desc = 'Statistics', colour='green'):
+        signature = None
+        if statistics_file != None:
+            file = graphs.files[graph_n]
+            signature = io.file_signature(input_dir + file)
+            if graph_n in stored and \
+               stored[graph_n]['signature'] == signature and \
+               all(name in stored[graph_n]['fields'] for name in names):
+                fs.merge_accumulators(accumulators,
+                                      stored[graph_n]['fields'])
+                continue
+        graph_accumulators = graph_statistics(graphs[graph_n], fields)
+        fs.merge_accumulators(accumulators, graph_accumulators)
+        nnew = nnew + 1
+        if statistics_file != None:
+            stored[graph_n] = {'file': file, 'signature': signature,
+                               'fields': graph_accumulators}
+
+    if statistics_file != None and nnew > 0:
+        fs.save_graph_accumulators(stored, statistics_file)
+
+    return accumulators
+
+def compute_statistics(graphs, fields, statistics, statistics_file = None,
+                       input_dir = None):
     """
     Compute statistics on a list of graphs.
 
     The computet statistics are: min value, max value, mean, and standard
     deviation.
 
+    Statistics of delta fields (see DELTA_FIELDS) are computed on the
+    increments of the normalized node fields. Since the normalization is
+    affine, they are derived from the statistics of the increments of the
+    original fields, which do not depend on the dataset.
+
     Arguments:
         graphs: list of graphs
-        fields: dictionary containing field names, divided into node and edge
-                fields
+        fields: dictionary containing field names, divided into node, edge,
+                outlet_node and delta fields
         statistics: dictionary containining statistics
-                    (key: statistics name, value: value)
+                    (key: statistics name, value: value). It must contain
+                    the statistics of the fields in DELTA_FIELDS if delta
+                    fields are requested
+        statistics_file (string): name of the file containing the
+                                  accumulators of every graph (see
+                                  accumulate_statistics).
+                                  Default -> None (do not persist)
+        input_dir (string): directory containing the graph files.
+                            Default -> None
     Returns:
         dictionary containining statistics (key: statistics name, value: value).
         New fields are appended to the input 'statistics' argument.
 
     """
     print('Compute statistics')
-    for etype in fields:
-            for field_name in fields[etype]:
-                cur_statistics = {}
-                minv = np.infty
-                maxv = np.NINF
-                Ns = []
-                Ms = []
-                means = []
-                meansqs = []
-                for graph_n in tqdm(graphs, desc = field_name, \
-                                    colour='green'):
-                    graph = graphs[graph_n]
-                    if etype == 'node':
-                        d = graph.ndata[field_name]
-                    elif etype == 'edge':
-                        d = graph.edata[field_name]
-                    elif etype == 'outlet_node':
-                        mask = graph.ndata['outlet_mask'].bool()
-                        d = graph.ndata[field_name][mask]
-
-                    # number of nodes
-                    N = d.shape[0]
-                    # number of times
-                    M = d.shape[2]
-                    minv = np.min([minv, th.min(d)])
-                    maxv = np.max([maxv, th.max(d)])
-                    mean = th.mean(d)
-                    meansq = th.mean(d**2)
-
-                    means.append(mean)
-                    meansqs.append(meansq)
-                    Ns.append(N)
-                    Ms.append(M)
-
-                ngraphs = len(graphs)
-                MNs = 0
-                for i in range(ngraphs):
-                    MNs = MNs + Ms[i] * Ns[i]
-
-                mean = 0
-                meansq = 0
-                for i in range(ngraphs):
-                    coeff = Ms[i] * Ns[i] / MNs
-                    mean = mean + coeff * means[i]
-                    meansq = meansq + coeff * meansqs[i]
-
-                cur_statistics['min'] = minv
-                cur_statistics['max'] = maxv
-                cur_statistics['mean'] = float(mean)
-                cur_statistics['stdv'] = float(np.sqrt(meansq - mean**2))
-                statistics[field_name] = cur_statistics
-
-    graph_sts = {'nodes': [], 'edges': [], 'tsteps': []}
-
-    for graph_n in graphs:
-        graph = graphs[graph_n]
-        graph_sts['nodes'].append(graph.ndata['x'].shape[0])
-        graph_sts['edges'].append(graph.edata['distance'].shape[0])
-        graph_sts['tsteps'].append(graph.ndata['pressure'].shape[2])
-
-    for name in graph_sts:
-        cur_statistics = {}
-
-        cur_statistics['min'] = np.min(graph_sts[name])
-        cur_statistics['max'] = np.max(graph_sts[name])
-        cur_statistics['mean'] = np.mean(graph_sts[name])
-        cur_statistics['stdv'] = np.std(graph_sts[name])
-
-        statistics[name] = cur_statistics
+    accumulators = accumulate_statistics(graphs, fields, None,
+                                         statistics_file, input_dir)
+    for name in accumulators:
+        acc = accumulators[name]
+        if name in DELTA_FIELDS:
+            scale = normalize(1.0, DELTA_FIELDS[name], statistics, 'features')
+            scale = scale - normalize(0.0, DELTA_FIELDS[name], statistics,
+                                      'features')
+            acc = acc.scaled(scale)
+        statistics[name] = acc.statistics()
 
     return statistics
 
@@ -223,33 +537,37 @@ def normalize_graphs(graphs, fields, statistics, norm_dict_label):
 
     """
     print('Normalize graphs')
-    for etype in fields:
+    def transform(graph):
+        for etype in fields:
             for field_name in fields[etype]:
-                for graph_n in tqdm(graphs, desc = field_name,
-                                    colour='green'):
-                    graph = graphs[graph_n]
-                    if etype == 'node':
-                        d = graph.ndata[field_name]
-                        graph.ndata[field_name] = normalize(d, field_name,
-                                                            statistics,
-                                                            norm_dict_label)
-                    elif etype == 'edge':
-                        d = graph.edata[field_name]
-                        graph.edata[field_name] = normalize(d, field_name,
-                                                            statistics,
-                                                            norm_dict_label)
-                    elif etype == 'outlet_node':
-                        d = graph.ndata[field_name]
-                        graph.ndata[field_name] = normalize(d, field_name,
-                                                            statistics,
-                                                            norm_dict_label)
+                if etype == 'node':
+                    d = graph.ndata[field_name]
+                    graph.ndata[field_name] = normalize(d, field_name,
+                                                        statistics,
+                                                        norm_dict_label)
+                elif etype == 'edge':
+                    d = graph.edata[field_name]
+                    graph.edata[field_name] = normalize(d, field_name,
+                                                        statistics,
+                                                        norm_dict_label)
+                elif etype == 'outlet_node':
+                    d = graph.ndata[field_name]
+                    graph.ndata[field_name] = normalize(d, field_name,
+                                                        statistics,
+                                                        norm_dict_label)
+
+    apply_to_graphs(graphs, transform, 'Normalize')
 
 def add_features(graphs, nodes_features = None, edges_features = None):
     """
     Add features to graphs.
 
     This function adds node and edge features to all graphs in
-    the input list.
+    the input list. Node features that do not depend on time are stored
+    only once ('nfeatures_static', dim 1: node index, dim 2: feature),
+    while pressure, flowrate and loading are stored for all timesteps
+    ('nfeatures_dynamic', dim 1: node index, dim 2: feature, dim 3: time).
+    The node features at one timestep are obtained with get_node_features.
 
     Arguments:
         graphs: list of graphs.
@@ -280,63 +598,45 @@ def add_features(graphs, nodes_features = None, edges_features = None):
             'type']
         
 
-    for graph_n in tqdm(graphs, desc = 'Add features', colour='green'):
-        graph = graphs[graph_n]
-        ntimes = graph.ndata['pressure'].shape[2]
-
+    def transform(graph):
         cf = []
 
         def add_feature(tensor, desired_features, label):
             if label in desired_features:
                 cf.append(tensor)
 
-        # graph.ndata['dt'].repeat(1, 1, ntimes)
-        add_feature(graph.ndata['area'].repeat(1, 1, ntimes), 
-                    nodes_features, 
-                    'area')
-        add_feature(graph.ndata['tangent'].repeat(1, 1, ntimes), 
-                    nodes_features, 
-                    'tangent')
-        add_feature(graph.ndata['type'].repeat(1, 1, ntimes), 
-                    nodes_features, 
-                    'type')
-        add_feature(graph.ndata['T'].repeat(1, 1, ntimes), 
-                    nodes_features, 
-                    'T')
-
-        loading = graph.ndata['loading']
-
-        p = graph.ndata['pressure'].clone()
-        q = graph.ndata['flowrate'].clone()
-
-        add_feature(th.ones(p.shape[0],1,ntimes) * th.min(p), 
-                    nodes_features, 
-                    'dip')
-        add_feature(th.ones(p.shape[0],1,ntimes) * th.max(p), 
-                    nodes_features, 
-                    'sysp')
+        add_feature(graph.ndata['area'][:,:,0], nodes_features, 'area')
+        add_feature(graph.ndata['tangent'][:,:,0], nodes_features, 'tangent')
+        add_feature(graph.ndata['type'][:,:,0], nodes_features, 'type')
+        add_feature(graph.ndata['T'][:,:,0], nodes_features, 'T')
+
+        p = graph.ndata['pressure']
+        q = graph.ndata['flowrate']
+
+        add_feature(th.ones(p.shape[0],1) * th.min(p), nodes_features, 'dip')
+        add_feature(th.ones(p.shape[0],1) * th.max(p), nodes_features, 'sysp')
 
         outmask = graph.ndata['outlet_mask'].bool()
         nnodes = outmask.shape[0]
 
-        r1 = th.zeros((nnodes,1,ntimes))
-        c = th.zeros((nnodes,1,ntimes))
-        r2 = th.zeros((nnodes,1,ntimes))
-        r1[outmask,0,:] = graph.ndata['resistance1'][outmask,0,:]
-        c[outmask,0,:] = graph.ndata['capacitance'][outmask,0,:]
-        r2[outmask,0,:] = graph.ndata['resistance2'][outmask,0,:]
+        r1 = th.zeros((nnodes,1))
+        c = th.zeros((nnodes,1))
+        r2 = th.zeros((nnodes,1))
+        r1[outmask,0] = graph.ndata['resistance1'][outmask,0,0]
+        c[outmask,0] = graph.ndata['capacitance'][outmask,0,0]
+        r2[outmask,0] = graph.ndata['resistance2'][outmask,0,0]
         add_feature(r1, nodes_features, 'resistance1')
         add_feature(c, nodes_features, 'capacitance')
         add_feature(r2, nodes_features, 'resistance2')
 
-        cfeatures = th.cat(cf, axis = 1)
+        graph.ndata['nfeatures_static'] = th.cat(cf, axis = 1)
 
         if 'loading' in nodes_features:
             loading = graph.ndata['loading']
-            graph.ndata['nfeatures'] = th.cat((p, q, cfeatures, loading), 
-                                               axis = 1)
+            graph.ndata['nfeatures_dynamic'] = th.cat((p, q, loading),
+                                                      axis = 1)
         else:
-            graph.ndata['nfeatures'] = th.cat((p, q, cfeatures), axis = 1)
+            graph.ndata['nfeatures_dynamic'] = th.cat((p, q), axis = 1)
 
         cf = []
         add_feature(graph.edata['rel_position'], edges_features, 'rel_position')
@@ -345,6 +645,8 @@ def add_features(graphs, nodes_features = None, edges_features = None):
 
         graph.edata['efeatures'] = th.cat(cf, axis = 1)
 
+    apply_to_graphs(graphs, transform, 'Add features')
+
 # for graph_n in tqdm(graphs, desc = 'Add features', colour='green'):
 #         graph = graphs[graph_n]
 #         ntimes = graph.ndata['pressure'].shape[2]
@@ -394,6 +696,75 @@ def add_features(graphs, nodes_features = None, edges_features = None):
 #         else:
 #             graph.edata['efeatures'] = th.cat((rp, rpn), axis = 1)
 
+def assemble_node_features(static, dynamic):
+    """
+    Assemble node features from static and dynamic features.
+
+    The features are ordered as pressure, flowrate, static features, and the
+    remaining dynamic features (loading).
+
+    Arguments:
+        static: 2D tensor of static features (dim 1: node index,
+                dim 2: feature)
+        dynamic: 2D tensor of dynamic features at one timestep (dim 1: node
+                 index, dim 2: feature)
+
+    Returns:
+        2D tensor of node features (dim 1: node index, dim 2: feature)
+
+    """
+    return th.cat((dynamic[:,0:2], static, dynamic[:,2:]), axis = 1)
+
+def get_node_features(graph, itime):
+    """
+    Get node features of a graph at one timestep (see add_features).
+
+    Arguments:
+        graph: DGL graph
+        itime (int): index of the timestep
+
+    Returns:
+        2D tensor of node features (dim 1: node index, dim 2: feature)
+
+    """
+    return assemble_node_features(graph.ndata['nfeatures_static'],
+                                  get_dynamic_features(graph, itime,
+                                                       itime + 1)[:,:,0])
+
+def num_timesteps(graph):
+    """
+    Number of timesteps of the dynamic node features of a graph.
+
+    Arguments:
+        graph: DGL graph
+
+    Returns:
+        number of timesteps
+
+    """
+    return gs.num_times(graph, 'nfeatures_dynamic')
+
+def get_dynamic_features(graph, start = 0, stop = None):
+    """
+    Get dynamic node features of a graph in the time window [start, stop).
+
+    The features can be split in chunks of timesteps (see
+    graph_store.chunk_time_series), in which case only the chunks
+    overlapping the window are read.
+
+    Arguments:
+        graph: DGL graph
+        start (int): first timestep. Default -> 0
+        stop (int): timestep after the last one. Default -> None (number
+                    of timesteps)
+
+    Returns:
+        3D tensor of dynamic features (dim 1: node index, dim 2: feature,
+            dim 3: time)
+
+    """
+    return gs.time_window(graph, 'nfeatures_dynamic', start, stop)
+
 def add_deltas(graphs):
     """
     Compute pressure and flowrate increments.
@@ -405,15 +776,74 @@ def add_deltas(graphs):
         graphs: list of graphs
 
     """
-    for graph_n in tqdm(graphs, desc = 'Add deltas', colour='green'):
-        graph = graphs[graph_n]
-
+    def transform(graph):
         graph.ndata['dp'] = graph.ndata['pressure'][:,:,1:] - \
                             graph.ndata['pressure'][:,:,:-1]
 
         graph.ndata['dq'] = graph.ndata['flowrate'][:,:,1:] - \
                             graph.ndata['flowrate'][:,:,:-1]
 
+    apply_to_graphs(graphs, transform, 'Add deltas')
+
+def graph_nbytes(graph):
+    """
+    Memory used by the node and edge fields of a graph.
+
+    Arguments:
+        graph: DGL graph
+
+    Returns:
+        number of bytes
+
+    """
+    nbytes = 0
+    for data in [graph.ndata, graph.edata]:
+        for field in data:
+            nbytes = nbytes + data[field].numel() * data[field].element_size()
+    return nbytes
+
+def compact_graphs(graphs, nodes_fields = None, edges_fields = None):
+    """
+    Remove node and edge fields that are not needed after add_features.
+
+    Masks are always kept. The memory saved is printed.
+
+    Arguments:
+        graphs: list of graphs
+        nodes_fields: list of node fields to keep (besides masks).
+                      Default value -> None (fields used by training,
+                      rollout and plotting)
+        edges_fields: list of edge fields to keep.
+                      Default value -> None (fields used by training,
+                      rollout and plotting)
+
+    """
+    if nodes_fields == None:
+        nodes_fields = ['nfeatures_static', 'nfeatures_dynamic',
+                        'nfeatures_dynamic' + gs.CHUNKS_SUFFIX,
+                        'nfeatures_dynamic' + gs.NTIMES_SUFFIX,
+                        'dt', 'x', 'type', 'branch_id']
+
+    if edges_fields == None:
+        edges_fields = ['efeatures', 'type']
+
+    saved = [0, 0]
+    def transform(graph):
+        nbytes = graph_nbytes(graph)
+        for field in list(graph.ndata):
+            if 'mask' not in field and field not in nodes_fields:
+                del graph.ndata[field]
+        for field in list(graph.edata):
+            if field not in edges_fields:
+                del graph.edata[field]
+        saved[0] = saved[0] + nbytes
+        saved[1] = saved[1] + nbytes - graph_nbytes(graph)
+
+    apply_to_graphs(graphs, transform, 'Compact graphs')
+    if saved[0] > 0:
+        print('Compaction freed {:.2f} MB out of {:.2f} MB'.format(
+              saved[1] / 1e6, saved[0] / 1e6))
+
 def save_graphs(graphs, output_dir):
     """
     Save all graphs contained in a list to file.
@@ -426,6 +856,148 @@ def save_graphs(graphs, output_dir):
     for graph_name in tqdm(graphs, desc = 'Saving graphs', colour='green'):
         dgl.save_graphs(output_dir + graph_name, graphs[graph_name])
 
+def hash_normalization(input_dir, settings):
+    """
+    Hash the inputs of generate_normalized_graphs.
+
+    Graph files are identified by their name and signature (see
+    io_utils.file_signature). The hash also includes CACHE_VERSION.
+
+    Arguments:
+        input_dir (string): input directory path
+        settings: dictionary containing the arguments affecting the
+                  normalized graphs
+
+    Returns:
+        sha256 hex digest
+
+    """
+    sha = hashlib.sha256()
+    for file in sorted(list_graph_files(input_dir)):
+        sha.update(json.dumps([file,
+                               io.file_signature(input_dir + file)]).encode())
+    sha.update(json.dumps(settings, sort_keys = True).encode())
+    sha.update(json.dumps(CACHE_VERSION).encode())
+    return sha.hexdigest()
+
+def save_cache(graphs, params, cache_dir, graph_format = 'columnar',
+               chunk_size = CHUNK_SIZE, settings = None):
+    """
+    Save normalized graphs and parameters to a cache directory.
+
+    Every graph is saved to its own file. The index (names of the graph
+    files, in order, parameters, settings and CACHE_VERSION) is written
+    last, so that incomplete caches are never read.
+
+    Arguments:
+        graphs: list of graphs
+        params: dictionary of parameters
+        cache_dir (string): path of the cache directory
+        graph_format (string): 'columnar' (see graph_store.save_columnar;
+                               graphs are memory-mapped when loaded),
+                               'chunked' (columnar, with the dynamic
+                               features split in chunks of timesteps, see
+                               graph_store.chunk_time_series) or
+                               'grph' (dgl.save_graphs).
+                               Default -> 'columnar'
+        chunk_size (int): number of timesteps per chunk in 'chunked'
+                          format. Default -> CHUNK_SIZE
+        settings: dictionary containing the arguments affecting the
+                  normalized graphs (see hash_normalization).
+                  Default -> None
+
+    """
+    os.makedirs(cache_dir, exist_ok = True)
+    files = []
+    for graph_name in tqdm(graphs, desc = 'Caching graphs', colour='green'):
+        if graph_format == 'columnar':
+            file = graph_name + gs.COLUMNAR_EXT
+            gs.save_columnar(cache_dir + file, graphs[graph_name], graph_name)
+        elif graph_format == 'chunked':
+            file = graph_name + gs.COLUMNAR_EXT
+            # chunks are added to a local copy, graphs are not modified
+            graph = graphs[graph_name].local_var()
+            if 'nfeatures_dynamic' in graph.ndata:
+                gs.chunk_time_series(graph, 'nfeatures_dynamic', chunk_size)
+            gs.save_columnar(cache_dir + file, graph, graph_name)
+        elif graph_format == 'grph':
+            file = graph_name
+            io.write_atomically(lambda f: dgl.save_graphs(f,
+                                                          graphs[graph_name]),
+                                cache_dir + file)
+        else:
+            raise Exception('Graph format not implemented')
+        files.append(file)
+
+    def write(f):
+        with open(f, 'w') as outfile:
+            json.dump({'files': files, 'params': params,
+                       'settings': settings, 'version': CACHE_VERSION},
+                      outfile)
+
+    io.write_atomically(write, cache_dir + 'index.json')
+
+def prune_cache(cache_dir):
+    """
+    Remove the caches superseded by a cache directory.
+
+    Caches in the same parent directory are superseded if they were written
+    by a different CACHE_VERSION, or with the same settings (i.e., the
+    graph files changed since). Caches without index (being written or
+    interrupted) are left untouched.
+
+    Arguments:
+        cache_dir (string): path of the cache directory (see save_cache)
+
+    """
+    def read_index(dirname):
+        if not os.path.exists(dirname + 'index.json'):
+            return None
+        with open(dirname + 'index.json', 'r') as infile:
+            return json.load(infile)
+
+    def key(index):
+        return json.dumps(index.get('settings'), sort_keys = True)
+
+    index = read_index(cache_dir)
+    parent_dir = os.path.dirname(os.path.normpath(cache_dir)) + '/'
+    for dirname in os.listdir(parent_dir):
+        dirname = parent_dir + dirname + '/'
+        if os.path.samefile(dirname, cache_dir):
+            continue
+        other = read_index(dirname)
+        if other == None:
+            continue
+        if other.get('version') != CACHE_VERSION or key(other) == key(index):
+            print('Removing superseded cache ' + dirname)
+            shutil.rmtree(dirname, ignore_errors = True)
+
+def load_cache(cache_dir, nworkers = 1, lazy = False, max_graphs = None):
+    """
+    Load normalized graphs and parameters from a cache directory (see
+    save_cache).
+
+    Arguments:
+        cache_dir (string): path of the cache directory
+        nworkers (int): number of threads reading files. Default -> 1
+        lazy (bool): load graphs on first access. Default -> False
+        max_graphs (int): maximum number of graphs kept in memory in lazy
+                          mode. Default -> None (no limit)
+
+    Returns:
+        List of normalized graphs
+        Dictionary of parameters
+        (None, None) if the cache does not exist
+
+    """
+    if not os.path.exists(cache_dir + 'index.json'):
+        return None, None
+    with open(cache_dir + 'index.json', 'r') as infile:
+        index = json.load(infile)
+    graphs = read_graph_files(cache_dir, index['files'], nworkers, lazy,
+                              max_graphs)
+    return graphs, index['params']
+
 def save_parameters(params, output_dir):
     """
     Save normalization parameters to file .
@@ -438,6 +1010,26 @@ def save_parameters(params, output_dir):
     with open(output_dir + '/parameters.json', 'w') as outfile:
         json.dump(params, outfile, indent=4)
 
+def restrict_names(names, types, types_to_keep):
+    """
+    Restrict a list of graph names to the types that we are interested in.
+
+    Arguments:
+        names: list of graph names
+        types: dictionary with all types (key: model name, value: type)
+        types_to_keep: list with types to keep:
+
+    Returns:
+        restricted list of graph names
+
+    """
+    selected_names = []
+    for name in names:
+        id = name.replace('.grph','').split('.')
+        if types[id[0] + '.' + id[1]]['model_type'] in types_to_keep:
+            selected_names.append(name)
+    return selected_names
+
 def restrict_graphs(graphs, types, types_to_keep):
     """
     Restrict the list of graphs to the types that we are interested in.
@@ -451,19 +1043,47 @@ def restrict_graphs(graphs, types, types_to_keep):
         restricted list of DGL graphs
 
     """
-    selected_graphs = {}
-    for graph in graphs:
-        id = graph.replace('.grph','').split('.')
-        if types[id[0] + '.' + id[1]]['model_type'] in types_to_keep:
-            selected_graphs[graph] = graphs[graph]
-    graphs = selected_graphs
+    selected_graphs = restrict_names(list(graphs), types, types_to_keep)
+    graphs = select_graphs(graphs, selected_graphs)
     return graphs
 
+def keep_simulations(names, n_graphs_to_keep):
+    """
+    Keep the graphs of the first n_graphs_to_keep simulations.
+
+    Arguments:
+        names: list of graph names
+        n_graphs_to_keep: number of simulations to keep
+
+    Returns:
+        restricted list of graph names
+
+    """
+    graphs_ = []
+    graphs_names = []
+    count = 0
+    for key in names:
+        graph_name = simulation_name(key)
+        if graph_name not in graphs_names and count != n_graphs_to_keep:
+            graphs_names.append(graph_name)
+            graphs_.append(key)
+            count = count + 1
+        elif graph_name in graphs_names:
+            graphs_.append(key)
+    return graphs_
+
 def generate_normalized_graphs(input_dir, norm_type, bc_type,
                                types_to_keep = None,
                                n_graphs_to_keep = -1,
                                statistics = None,
-                               features = None):
+                               features = None,
+                               nworkers = 1,
+                               max_graphs = None,
+                               persist_statistics = True,
+                               compact = True,
+                               cache = True,
+                               cache_format = 'columnar',
+                               names = None):
     """
     Generate normalized graphs.
 
@@ -480,8 +1100,36 @@ def generate_normalized_graphs(input_dir, norm_type, bc_type,
                        types. Default value -> None.
         n_graphs_to_keep: number of graphs to keep. If -1, keep all graphs.
                           Default value -> -1.
+        statistics: dictionary containing statistics used for normalization.
+                    If None, statistics are computed on the graphs.
+                    Default value -> None
         features: dictionary of features to include in graphs
                   Default value -> None (include all)
+        nworkers (int): number of threads reading graph files.
+                        Default value -> 1
+        max_graphs (int): if not None, graphs are loaded lazily and at most
+                          max_graphs graphs are kept in memory (see
+                          load_graphs). Default value -> None
+        compact (bool): if True, remove fields that are not needed after
+                        the features are assembled (see compact_graphs).
+                        Default value -> True
+        names: list of names of the graphs to load. Only the files containing
+               these graphs are read (see load_selected_graphs).
+               Default value -> None (load all graphs)
+        cache (bool): if True, normalized graphs are saved to input_dir +
+                      CACHE_DIR + '/<hash>/' (see hash_normalization and
+                      save_cache) and loaded from there when this function
+                      is called again with the same inputs. Caches
+                      superseded by the new one are removed (see
+                      prune_cache). Default value -> True
+        cache_format (string): format of the cached graphs (see
+                               save_cache). Default value -> 'columnar'
+        persist_statistics (bool): if True, the accumulators of every graph
+                                   are stored in input_dir +
+                                   STATISTICS_FILE and only new graphs
+                                   are visited to compute statistics (see
+                                   accumulate_statistics).
+                                   Default value -> True
 
     Return:
         List of normalized graphs
@@ -495,42 +1143,45 @@ def generate_normalized_graphs(input_dir, norm_type, bc_type,
                                            'capacitance',
                                            'resistance2']}
 
+    if cache:
+        settings = {'norm_type': norm_type, 'bc_type': bc_type,
+                    'types_to_keep': types_to_keep,
+                    'n_graphs_to_keep': n_graphs_to_keep,
+                    'statistics': statistics, 'features': features,
+                    'compact': compact, 'names': names,
+                    'cache_format': cache_format}
+        cache_dir = input_dir + CACHE_DIR + '/' + \
+                    hash_normalization(input_dir, settings) + '/'
+        graphs, params = load_cache(cache_dir, nworkers, max_graphs != None,
+                                    max_graphs)
+        if graphs != None:
+            print('Normalized graphs loaded from ' + cache_dir)
+            return graphs, params
+
     docompute_statistics = True
     if statistics != None:
         docompute_statistics = False
 
     if docompute_statistics:
         statistics = {'normalization_type': norm_type}
-    graphs = load_graphs(input_dir)
-
+    types, ttk = None, None
     if types_to_keep != None and types_to_keep['types_to_keep'] != None:
-        graphs = restrict_graphs(graphs, types_to_keep['dataset_info'], 
-                                 types_to_keep['types_to_keep'])
-
-    if n_graphs_to_keep != -1:
-        graphs_ = {}
-        graphs_names = []
-        count = 0
-        for key, value in graphs.items():
-            # if count == n_graphs_to_keep:
-            #     break
-            # graph_name = key.replace('.graph','')
-            # graph_name = graph_name[0:graph_name.find('.')]
-            graph_name = ".".join(key.split(".", 2)[:2])
-            if graph_name not in graphs_names and count != n_graphs_to_keep:
-                graphs_names.append(graph_name)
-                graphs_[key] = value
-                count = count + 1
-            elif graph_name in graphs_names:
-                graphs_[key] = value
-        graphs = graphs_
+        types = types_to_keep['dataset_info']
+        ttk = types_to_keep['types_to_keep']
+    graphs = load_selected_graphs(input_dir, names, types, ttk,
+                                  n_graphs_to_keep, nworkers,
+                                  max_graphs != None, max_graphs)
 
     if docompute_statistics:
-        compute_statistics(graphs, fields_to_normalize, statistics)
+        statistics_file = None
+        if persist_statistics:
+            statistics_file = input_dir + STATISTICS_FILE
+        fields = dict(fields_to_normalize)
+        fields['delta'] = list(DELTA_FIELDS)
+        compute_statistics(graphs, fields, statistics, statistics_file,
+                           input_dir)
     normalize_graphs(graphs, fields_to_normalize, statistics, 'features')
     add_deltas(graphs)
-    if docompute_statistics:
-        compute_statistics(graphs, {'node' : ['dp', 'dq']}, statistics)
     normalize_graphs(graphs, {'node' : ['dp', 'dq']}, statistics, 'labels')
     params = {'bc_type': bc_type}
     params['statistics'] = statistics
@@ -540,5 +1191,11 @@ def generate_normalized_graphs(input_dir, norm_type, bc_type,
         add_features(graphs, 
                      features['nodes_features'], 
                      features['edges_features'])
+    if compact:
+        compact_graphs(graphs)
+    if cache:
+        save_cache(graphs, params, cache_dir, cache_format,
+                   settings = settings)
+        prune_cache(cache_dir)
 
     return graphs, params
\ No newline at end of file
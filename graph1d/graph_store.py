@@ -0,0 +1,663 @@
+# Copyright 2023 Stanford University
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy 
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights 
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell 
+# copies of the Software, and to permit persons to whom the Software is 
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in 
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR 
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, 
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE 
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER 
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, 
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE 
+# SOFTWARE.
+import sys
+import os
+import collections.abc
+sys.path.append(os.getcwd())
+import tools.io_utils as io
+import graph1d.field_codec as fc
+import dgl
+import torch as th
+import numpy as np
+import json
+import shutil
+
+# node fields that change between the time-shifted copies of a simulation
+TIME_FIELDS = ['pressure', 'flowrate', 'loading', 'dt', 'T']
+# extension of graphs saved in columnar format
+COLUMNAR_EXT = '.grphc'
+# suffixes of the node fields of a time series split in chunks
+CHUNKS_SUFFIX = '_chunks'
+NTIMES_SUFFIX = '_ntimes'
+# catalog of the graph files contained in a folder
+CATALOG_FILE = 'catalog.json'
+
+def save_store(fname, graph, blocks, codec = None):
+    """
+    Save a graph store.
+
+    A graph store contains the topology and the static node and edge features
+    only once, together with several named blocks of time-dependent node
+    features. The file is written atomically.
+
+    Arguments:
+        fname (string): name of the store file
+        graph: DGL graph containing topology and static features
+        blocks: dictionary of time-dependent node features (key: graph name,
+                value: dictionary with key: field name, value: tensor)
+        codec: dictionary of codec parameters used to encode time-dependent
+               fields (see field_codec.default_codec).
+               Default -> None (fields are stored as they are)
+
+    """
+    static = dgl.graph(graph.edges(), num_nodes = graph.num_nodes(),
+                       idtype = graph.idtype)
+    for field in graph.ndata:
+        if field not in TIME_FIELDS:
+            static.ndata[field] = graph.ndata[field]
+    for field in graph.edata:
+        static.edata[field] = graph.edata[field]
+
+    labels = {}
+    for name in blocks:
+        for field in blocks[name]:
+            labels[name + '/' + field] = blocks[name][field]
+    if codec != None:
+        labels = fc.encode_labels(labels, codec)
+
+    io.write_atomically(lambda f: dgl.save_graphs(f, [static], labels), fname)
+
+def save_graph(fname, graph, codec = None):
+    """
+    Save a single graph. The file is written atomically.
+
+    Arguments:
+        fname (string): name of the graph file
+        graph: DGL graph
+        codec: dictionary of codec parameters used to encode time-dependent
+               fields (see field_codec.default_codec). Encoded fields are
+               stored as labels of the file.
+               Default -> None (fields are stored as they are)
+
+    """
+    labels = {}
+    if codec != None:
+        encoded = [field for field in graph.ndata if field in codec['fields']]
+        if len(encoded) > 0:
+            labels = fc.encode_labels({field: graph.ndata[field]
+                                       for field in encoded}, codec)
+            stripped = dgl.graph(graph.edges(),
+                                 num_nodes = graph.num_nodes(),
+                                 idtype = graph.idtype)
+            for field in graph.ndata:
+                if field not in encoded:
+                    stripped.ndata[field] = graph.ndata[field]
+            for field in graph.edata:
+                stripped.edata[field] = graph.edata[field]
+            graph = stripped
+
+    io.write_atomically(lambda f: dgl.save_graphs(f, graph, labels), fname)
+
+def load_graph(fname):
+    """
+    Load a single graph (see save_graph). Encoded fields are decoded.
+
+    Arguments:
+        fname (string): name of the graph file
+
+    Returns:
+        DGL graph
+
+    """
+    graphs, labels = dgl.load_graphs(fname)
+    graph = graphs[0]
+    labels = fc.decode_labels(labels)
+    for field in labels:
+        graph.ndata[field] = labels[field]
+    return graph
+
+def save_columnar(dirname, graph, name):
+    """
+    Save a graph in columnar format.
+
+    The graph is saved to a directory (usually with extension COLUMNAR_EXT)
+    containing the topology in CSR format ('indptr.npy', 'indices.npy' and
+    'eids.npy', the ids of the edges), one .npy file per node field
+    ('ndata.<field>.npy') and per edge field ('edata.<field>.npy'), and a
+    file 'meta.json' with the name of the graph, the number of nodes and the
+    names of the fields. The directory is written atomically. Unlike
+    dgl.save_graphs, the arrays can be memory-mapped (see load_columnar).
+    Time series split in chunks (see chunk_time_series) are saved with the
+    chunk index as first dimension, so that each chunk is contiguous on disk.
+
+    Arguments:
+        dirname (string): name of the directory
+        graph: DGL graph
+        name (string): name of the graph
+
+    """
+    def write(tmp_dirname):
+        os.makedirs(tmp_dirname)
+        indptr, indices, eids = graph.adj_tensors('csr')
+        arrays = {'indptr': indptr, 'indices': indices, 'eids': eids}
+        for field in graph.ndata:
+            if field.endswith(CHUNKS_SUFFIX):
+                arrays['ndata.' + field] = graph.ndata[field].movedim(1, 0)
+            else:
+                arrays['ndata.' + field] = graph.ndata[field]
+        for field in graph.edata:
+            arrays['edata.' + field] = graph.edata[field]
+        for array in arrays:
+            np.save(tmp_dirname + '/' + array + '.npy',
+                    arrays[array].detach().cpu().numpy())
+        meta = {'name': name, 'num_nodes': graph.num_nodes(),
+                'ndata': list(graph.ndata), 'edata': list(graph.edata)}
+        with open(tmp_dirname + '/meta.json', 'w') as outfile:
+            json.dump(meta, outfile)
+
+    if os.path.exists(dirname):
+        shutil.rmtree(dirname)
+    io.write_atomically(write, dirname)
+
+def columnar_name(dirname):
+    """
+    Name of a graph saved in columnar format (see save_columnar).
+
+    Arguments:
+        dirname (string): name of the directory
+
+    Returns:
+        name of the graph
+
+    """
+    with open(dirname + '/meta.json', 'r') as infile:
+        return json.load(infile)['name']
+
+def load_columnar(dirname):
+    """
+    Load a graph saved in columnar format (see save_columnar).
+
+    Arrays are memory-mapped in copy-on-write mode: the tensors of the graph
+    are backed by the page cache, which is shared by all the processes
+    loading the same graph. Pages are only copied to private memory if they
+    are modified.
+
+    Arguments:
+        dirname (string): name of the directory
+
+    Returns:
+        DGL graph
+        name of the graph
+
+    """
+    with open(dirname + '/meta.json', 'r') as infile:
+        meta = json.load(infile)
+
+    def load(array):
+        return th.from_numpy(np.load(dirname + '/' + array + '.npy',
+                                     mmap_mode = 'c'))
+
+    graph = dgl.graph(('csr', (load('indptr'), load('indices'),
+                               load('eids'))),
+                      num_nodes = meta['num_nodes'])
+    for field in meta['ndata']:
+        if field.endswith(CHUNKS_SUFFIX):
+            graph.ndata[field] = load('ndata.' + field).movedim(0, 1)
+        else:
+            graph.ndata[field] = load('ndata.' + field)
+    for field in meta['edata']:
+        graph.edata[field] = load('edata.' + field)
+    return graph, meta['name']
+
+def chunk_time_series(graph, field, chunk_size):
+    """
+    Split a time-dependent node field in chunks of consecutive timesteps.
+
+    The field (last dimension: time) is replaced by field + CHUNKS_SUFFIX,
+    with dimensions (node, chunk, ..., timestep in chunk), and by
+    field + NTIMES_SUFFIX, containing the number of timesteps. The chunks
+    are stored one after the other in memory (the last one is padded with
+    zeros), so that reading a time window (see time_window) only touches the
+    chunks overlapping it. This is useful when the graph is saved in
+    columnar format and memory-mapped: only the pages of those chunks are
+    read from disk, and the page cache keeps the most recently used ones.
+
+    Arguments:
+        graph: DGL graph
+        field (string): name of the node field
+        chunk_size (int): number of timesteps per chunk
+
+    """
+    series = graph.ndata.pop(field)
+    ntimes = series.shape[-1]
+    nchunks = (ntimes + chunk_size - 1) // chunk_size
+    padding = nchunks * chunk_size - ntimes
+    series = th.nn.functional.pad(series, (0, padding))
+    series = series.reshape(series.shape[:-1] + (nchunks, chunk_size))
+    # chunk index first, so that each chunk is contiguous
+    series = series.movedim(-2, 0).contiguous()
+    graph.ndata[field + CHUNKS_SUFFIX] = series.movedim(0, 1)
+    graph.ndata[field + NTIMES_SUFFIX] = th.full((graph.num_nodes(),),
+                                                 ntimes, dtype = th.int64)
+
+def num_times(graph, field):
+    """
+    Number of timesteps of a time-dependent node field.
+
+    The field can be stored as a single tensor (last dimension: time) or
+    split in chunks (see chunk_time_series).
+
+    Arguments:
+        graph: DGL graph
+        field (string): name of the node field
+
+    Returns:
+        number of timesteps
+
+    """
+    if field in graph.ndata:
+        return graph.ndata[field].shape[-1]
+    return int(graph.ndata[field + NTIMES_SUFFIX][0])
+
+def time_window(graph, field, start = 0, stop = None):
+    """
+    Read timesteps [start, stop) of a time-dependent node field.
+
+    The field can be stored as a single tensor (last dimension: time) or
+    split in chunks (see chunk_time_series). In the latter case, only the
+    chunks overlapping the window are read. As when slicing a tensor, stop
+    is clamped to the number of timesteps.
+
+    Arguments:
+        graph: DGL graph
+        field (string): name of the node field
+        start (int): first timestep. Default -> 0
+        stop (int): timestep after the last one. Default: None, i.e., the
+                    number of timesteps
+
+    Returns:
+        tensor with the timesteps in the window (last dimension: time)
+
+    """
+    if field in graph.ndata:
+        return graph.ndata[field][..., start:stop]
+    ntimes = num_times(graph, field)
+    if stop == None or stop > ntimes:
+        stop = ntimes
+    stop = max(start, stop)
+    chunks = graph.ndata[field + CHUNKS_SUFFIX]
+    chunk_size = chunks.shape[-1]
+    first = start // chunk_size
+    last = (stop + chunk_size - 1) // chunk_size
+    window = chunks[:, first:last].movedim(1, -2)
+    window = window.reshape(window.shape[:-2] + (-1,))
+    return window[..., start - first * chunk_size:stop - first * chunk_size]
+
+def graph_metadata(graph):
+    """
+    Metadata of a graph stored in the catalog.
+
+    Arguments:
+        graph: DGL graph
+
+    Returns:
+        dictionary with keys 'nodes', 'edges', 'tsteps' (numbers of nodes,
+        edges and timesteps), 'node_fields' and 'edge_fields'
+
+    """
+    return {'nodes': graph.num_nodes(), 'edges': graph.num_edges(),
+            'tsteps': graph.ndata['pressure'].shape[2],
+            'node_fields': sorted(graph.ndata),
+            'edge_fields': sorted(graph.edata)}
+
+def catalog_entry(fname, metadata, model_type = None):
+    """
+    Catalog entry of a graph file.
+
+    The entry contains the signature of the file (see
+    io_utils.file_signature) and the list of graphs it contains, in order.
+    For every graph, it stores the name, the index in the file, the model
+    type and the metadata computed by graph_metadata.
+
+    Arguments:
+        fname (string): name of the graph file
+        metadata: list of (graph name, metadata) pairs, in the order of
+                  the graphs in the file
+        model_type (string): model type of the graphs. Default -> None
+
+    Returns:
+        dictionary with keys 'signature' and 'graphs'
+
+    """
+    graphs = []
+    for i, (name, graph_metadata) in enumerate(metadata):
+        entry = {'name': name, 'index': i, 'model_type': model_type}
+        entry.update(graph_metadata)
+        graphs.append(entry)
+    return {'signature': io.file_signature(fname), 'graphs': graphs}
+
+def load_catalog(dirname):
+    """
+    Load the catalog of a graph folder.
+
+    Arguments:
+        dirname (string): path of the folder
+
+    Returns:
+        dictionary (key: file name, value: catalog entry, see
+        catalog_entry). Empty if the catalog does not exist
+
+    """
+    fname = dirname + CATALOG_FILE
+    if not os.path.exists(fname):
+        return {}
+    with open(fname, 'r') as infile:
+        return json.load(infile)['files']
+
+def save_catalog(catalog, dirname):
+    """
+    Save the catalog of a graph folder. The file is written atomically.
+
+    Arguments:
+        catalog: dictionary (key: file name, value: catalog entry, see
+                 catalog_entry)
+        dirname (string): path of the folder
+
+    """
+    def write(f):
+        with open(f, 'w') as outfile:
+            json.dump({'files': catalog}, outfile, indent = 4)
+
+    io.write_atomically(write, dirname + CATALOG_FILE)
+
+class GraphStore:
+    """
+    Class to read a graph store (see save_store). Encoded fields are decoded
+    when the store is read.
+
+    Attributes:
+        graph: DGL graph containing topology and static features
+        blocks: dictionary of time-dependent node features (key: graph name,
+                value: dictionary with key: field name, value: tensor)
+
+    """
+    def __init__(self, fname):
+        """
+        Init GraphStore.
+
+        Arguments:
+            fname (string): name of the store file
+
+        """
+        graphs, labels = dgl.load_graphs(fname)
+        labels = fc.decode_labels(labels)
+        self.graph = graphs[0]
+        self.blocks = {}
+        # labels are not saved in a fixed order: graphs are sorted by name
+        for label in sorted(labels):
+            name, field = label.rsplit('/', 1)
+            if name not in self.blocks:
+                self.blocks[name] = {}
+            self.blocks[name][field] = labels[label]
+
+    def names(self):
+        """
+        Names of the graphs contained in the store, sorted.
+
+        Returns:
+            list of graph names
+
+        """
+        return list(self.blocks)
+
+    def get_graph(self, name):
+        """
+        Reconstruct a graph.
+
+        Static features are shared by all graphs reconstructed from the
+        store; they are meant to be replaced, not modified in place.
+
+        Arguments:
+            name (string): name of the graph
+
+        Returns:
+            DGL graph
+
+        """
+        graph = dgl.graph(self.graph.edges(),
+                          num_nodes = self.graph.num_nodes(),
+                          idtype = self.graph.idtype)
+        for field in self.graph.ndata:
+            graph.ndata[field] = self.graph.ndata[field]
+        for field in self.blocks[name]:
+            graph.ndata[field] = self.blocks[name][field]
+        for field in self.graph.edata:
+            graph.edata[field] = self.graph.edata[field]
+        return graph
+
+class LazyGraphs(collections.abc.MutableMapping):
+    """
+    Dictionary of graphs that are loaded when they are first accessed.
+
+    Graphs are either set directly, or registered together with a source,
+    i.e., a function returning a dictionary of graphs (key: graph name,
+    value: DGL graph). A source can provide several graphs (for example, all
+    graphs contained in a graph store), which are all kept when the source is
+    loaded. If max_graphs is set, the least recently accessed graphs that
+    have a source are evicted and loaded again when needed.
+
+    Transforms (functions modifying a graph in place) can be registered;
+    they are applied to the graphs in memory and to every graph when it is
+    loaded, so that evicted graphs are reloaded in the same state.
+
+    Attributes:
+        sources: dictionary (key: graph name, value: source of the graph,
+                 None for graphs set directly)
+        files: dictionary (key: graph name, value: name of the file
+               containing the graph, if known)
+        graphs: ordered dictionary containing graphs in memory (key: graph
+                name, value: DGL graph), from least to most recently accessed
+        transforms: list of transforms
+        max_graphs (int): maximum number of graphs with a source kept in
+                          memory (None -> no limit)
+
+    """
+    def __init__(self, max_graphs = None):
+        """
+        Init LazyGraphs.
+
+        Arguments:
+            max_graphs (int): maximum number of graphs with a source kept in
+                              memory. Default -> None (no limit)
+
+        """
+        self.sources = {}
+        self.files = {}
+        self.graphs = collections.OrderedDict()
+        self.transforms = []
+        self.max_graphs = max_graphs
+
+    def add_source(self, names, source, file = None):
+        """
+        Register graphs provided by a source.
+
+        Arguments:
+            names: list of graph names
+            source: function returning a dictionary of graphs (key: graph
+                    name, value: DGL graph) containing all graphs in names
+            file (string): name of the file containing the graphs.
+                           Default -> None (unknown)
+
+        """
+        for name in names:
+            self.sources[name] = source
+            if file != None:
+                self.files[name] = file
+
+    def add_transform(self, transform):
+        """
+        Register a transform.
+
+        The transform is applied immediately to the graphs in memory.
+
+        Arguments:
+            transform: function modifying a DGL graph in place
+
+        """
+        for name in self.graphs:
+            transform(self.graphs[name])
+        self.transforms.append(transform)
+
+    def subset(self, names):
+        """
+        Restrict to a subset of graphs.
+
+        Arguments:
+            names: list of graph names
+
+        Returns:
+            LazyGraphs containing only the graphs in names
+
+        """
+        graphs = LazyGraphs(self.max_graphs)
+        graphs.transforms = list(self.transforms)
+        for name in names:
+            graphs.sources[name] = self.sources[name]
+            if name in self.files:
+                graphs.files[name] = self.files[name]
+            if name in self.graphs:
+                graphs.graphs[name] = self.graphs[name]
+        return graphs
+
+    def evict(self):
+        """
+        Evict least recently accessed graphs if there are too many in memory.
+
+        """
+        if self.max_graphs == None:
+            return
+        evictable = [name for name in self.graphs
+                     if self.sources[name] != None]
+        nevict = len(evictable) - self.max_graphs
+        for name in evictable[:max(nevict, 0)]:
+            del self.graphs[name]
+
+    def __getitem__(self, name):
+        """
+        Get a graph, loading it if necessary.
+
+        Arguments:
+            name (string): name of the graph
+
+        Returns:
+            DGL graph
+
+        """
+        if name not in self.graphs:
+            loaded = self.sources[name]()
+            for lname in loaded:
+                if lname in self.sources and lname not in self.graphs:
+                    for transform in self.transforms:
+                        transform(loaded[lname])
+                    self.graphs[lname] = loaded[lname]
+        self.graphs.move_to_end(name)
+        graph = self.graphs[name]
+        self.evict()
+        return graph
+
+    def __setitem__(self, name, graph):
+        """
+        Set a graph. Graphs set directly are never evicted.
+
+        Arguments:
+            name (string): name of the graph
+            graph: DGL graph
+
+        """
+        self.sources[name] = None
+        self.graphs[name] = graph
+
+    def __delitem__(self, name):
+        """
+        Remove a graph.
+
+        Arguments:
+            name (string): name of the graph
+
+        """
+        del self.sources[name]
+        self.files.pop(name, None)
+        if name in self.graphs:
+            del self.graphs[name]
+
+    def __iter__(self):
+        """
+        Iterate over graph names.
+
+        Returns:
+            iterator over graph names
+
+        """
+        return iter(list(self.sources))
+
+    def __len__(self):
+        """
+        Number of graphs.
+
+        Returns:
+            number of graphs
+
+        """
+        return len(self.sources)
+
+class GraphList(collections.abc.Sequence):
+    """
+    List view of some graphs of a dictionary, which are only accessed when
+    needed (see LazyGraphs).
+
+    Attributes:
+        graphs: dictionary of graphs (key: graph name, value: DGL graph)
+        names: list of graph names
+
+    """
+    def __init__(self, graphs, names):
+        """
+        Init GraphList.
+
+        Arguments:
+            graphs: dictionary of graphs (key: graph name, value: DGL graph)
+            names: list of graph names
+
+        """
+        self.graphs = graphs
+        self.names = list(names)
+
+    def __getitem__(self, i):
+        """
+        Get ith graph.
+
+        Arguments:
+            i (int): index of the graph
+
+        Returns:
+            DGL graph
+
+        """
+        return self.graphs[self.names[i]]
+
+    def __len__(self):
+        """
+        Number of graphs.
+
+        Returns:
+            number of graphs
+
+        """
+        return len(self.names)
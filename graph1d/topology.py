@@ -0,0 +1,409 @@
+# Copyright 2023 Stanford University
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy 
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights 
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell 
+# copies of the Software, and to permit persons to whom the Software is 
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in 
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR 
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, 
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE 
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER 
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, 
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE 
+# SOFTWARE.
+
+import numpy as np
+import scipy
+from scipy.sparse import csgraph
+
+class CenterlineTopology:
+    """
+    Class to store and query the connectivity of a centerline.
+
+    Edges are directed from edges1 to edges2 and are stored in compressed
+    sparse row (CSR) format, both by source node (outgoing edges) and by
+    destination node (incoming edges).
+
+    Attributes:
+        npoints (int): number of nodes
+        edges1: numpy array containing indices of source nodes for every edge
+        edges2: numpy array containing indices of dest nodes for every edge
+        out_indptr: (npoints + 1) numpy array. The outgoing edges of node i
+                    are stored between out_indptr[i] and out_indptr[i+1]
+        out_nodes: numpy array containing the dest nodes of outgoing edges
+        out_edges: numpy array containing the indices of outgoing edges
+        in_indptr: (npoints + 1) numpy array. The incoming edges of node i
+                   are stored between in_indptr[i] and in_indptr[i+1]
+        in_nodes: numpy array containing the source nodes of incoming edges
+        in_edges: numpy array containing the indices of incoming edges
+
+    """
+    def __init__(self, edges1, edges2, npoints = None):
+        """
+        Init CenterlineTopology.
+
+        Arguments:
+            edges1: numpy array containing indices of source nodes for every
+                    edge
+            edges2: numpy array containing indices of dest nodes for every edge
+            npoints (int): number of nodes. Default -> None (largest node
+                           index + 1)
+
+        """
+        self.edges1 = np.asarray(edges1, dtype = np.int64)
+        self.edges2 = np.asarray(edges2, dtype = np.int64)
+        if npoints == None:
+            npoints = 0
+            if self.edges1.size > 0:
+                npoints = int(max(np.max(self.edges1),
+                                  np.max(self.edges2))) + 1
+        self.npoints = npoints
+
+        self.out_indptr, self.out_nodes, \
+        self.out_edges = self.compress(self.edges1, self.edges2)
+        self.in_indptr, self.in_nodes, \
+        self.in_edges = self.compress(self.edges2, self.edges1)
+
+    def compress(self, rows, cols):
+        """
+        Compress edges in CSR format.
+
+        Arguments:
+            rows: numpy array containing the nodes used to sort the edges
+            cols: numpy array containing the other node of every edge
+
+        Returns:
+            (npoints + 1) numpy array of row pointers
+            numpy array containing the other node of every sorted edge
+            numpy array containing the original index of every sorted edge
+
+        """
+        order = np.argsort(rows, kind = 'stable')
+        counts = np.bincount(rows, minlength = self.npoints)
+        indptr = np.concatenate((np.zeros(1, dtype = np.int64),
+                                 np.cumsum(counts)))
+        return indptr, cols[order], order
+
+    def nedges(self):
+        """
+        Number of edges.
+
+        Returns:
+            number of edges
+
+        """
+        return self.edges1.size
+
+    def out_degree(self):
+        """
+        Number of outgoing edges of every node.
+
+        Returns:
+            n-dimensional numpy array containing the out degrees
+
+        """
+        return np.diff(self.out_indptr)
+
+    def in_degree(self):
+        """
+        Number of incoming edges of every node.
+
+        Returns:
+            n-dimensional numpy array containing the in degrees
+
+        """
+        return np.diff(self.in_indptr)
+
+    def successors(self, index):
+        """
+        Nodes reached by the outgoing edges of a node.
+
+        Arguments:
+            index (int): index of the node
+
+        Returns:
+            numpy array containing the indices of the successors
+
+        """
+        return self.out_nodes[self.out_indptr[index]:
+                              self.out_indptr[index + 1]]
+
+    def predecessors(self, index):
+        """
+        Nodes reaching a node through its incoming edges.
+
+        Arguments:
+            index (int): index of the node
+
+        Returns:
+            numpy array containing the indices of the predecessors
+
+        """
+        return self.in_nodes[self.in_indptr[index]:
+                             self.in_indptr[index + 1]]
+
+    def inlets(self):
+        """
+        Find inlets.
+
+        Inlets are the nodes without incoming edges.
+
+        Returns:
+            list of inlet indices
+
+        """
+        return list(np.where(self.in_degree() == 0)[0])
+
+    def outlets(self):
+        """
+        Find outlets.
+
+        Outlets are the nodes without outgoing edges. The indices are
+        returned in the order they appear in edges2.
+
+        Returns:
+            list of outlet indices
+
+        """
+        return list(self.edges2[self.out_degree()[self.edges2] == 0])
+
+    def remove_points(self, idxs_to_delete, idxs_to_replace):
+        """
+        Remove points.
+
+        Every deleted node is replaced by another node, and the edges that
+        become loops are removed. The remaining nodes are renumbered
+        consecutively.
+
+        Arguments:
+            idxs_to_delete: indices of nodes to delete
+            idxs_to_replace: indices of nodes that replace the deleted nodes.
+                             Must have the same number of components as
+                             idxs_to_delete
+
+        Returns:
+            numpy array with indices of the remaining nodes
+            CenterlineTopology of the remaining nodes
+
+        """
+        # we find the node that finally replaces every deleted node by
+        # traversing the replacements backwards
+        replacement = np.arange(self.npoints)
+        for i in reversed(range(len(idxs_to_delete))):
+            replacement[idxs_to_delete[i]] = replacement[idxs_to_replace[i]]
+
+        edges1 = replacement[self.edges1]
+        edges2 = replacement[self.edges2]
+
+        edges_to_keep = edges1 != edges2
+        edges1 = edges1[edges_to_keep]
+        edges2 = edges2[edges_to_keep]
+
+        sampled_indices = np.delete(np.arange(self.npoints), idxs_to_delete)
+        new_indices = np.zeros(self.npoints, dtype = np.int64)
+        new_indices[sampled_indices] = np.arange(sampled_indices.size)
+
+        return sampled_indices, CenterlineTopology(new_indices[edges1],
+                                                   new_indices[edges2],
+                                                   sampled_indices.size)
+
+    def adjacency_matrix(self, points):
+        """
+        Sparse adjacency matrix weighted by edge lengths.
+
+        Repeated edges are stored only once. Edges between coincident points
+        are stored as explicit zeros, which are considered edges by
+        scipy.sparse.csgraph.
+
+        Arguments:
+            points: n x 3 numpy array of point coordinates
+
+        Returns:
+            n x n scipy.sparse.csr_matrix
+
+        """
+        # edges are encoded as single integers, which are much faster to
+        # sort than rows
+        keys = np.unique(self.edges1 * self.npoints + self.edges2)
+        edges1 = keys // self.npoints
+        edges2 = keys % self.npoints
+        # self loops do not change any distance
+        edges1, edges2 = edges1[edges1 != edges2], edges2[edges1 != edges2]
+        weights = np.linalg.norm(points[edges2,:] - points[edges1,:],
+                                 axis = 1)
+        return scipy.sparse.csr_matrix((weights, (edges1, edges2)),
+                                       shape = (self.npoints, self.npoints))
+
+    def geodesic_distances(self, points, indices):
+        """
+        Compute geodesic distances from a set of seed nodes.
+
+        The shortest paths from all seeds are computed in a single call to
+        the heap-based Dijkstra's algorithm in scipy.sparse.csgraph.
+
+        Arguments:
+            points: n x 3 numpy array of point coordinates
+            indices: list of indices of the seed nodes
+
+        Returns:
+            m x n numpy array (m being the number of seeds) containing all
+                shortest path lengths
+            m x n numpy array containing the previous nodes explored when
+                traversing the graph (-1 if there is no previous node)
+
+        """
+        dists, prevs = csgraph.dijkstra(self.adjacency_matrix(points),
+                                        directed = True,
+                                        indices = np.asarray(indices,
+                                                             dtype = np.int64),
+                                        return_predecessors = True)
+        prevs = prevs.astype(np.float64)
+        prevs[prevs < 0] = -1
+        return dists, prevs
+
+class ArcLengthIndex:
+    """
+    Class to query path lengths along a tree-shaped centerline.
+
+    A single depth-first traversal from the root gives the entry/exit times
+    of every node and its cumulative arc length, computed with array
+    operations in linear time. Entry/exit times allow to check in
+    constant time whether a node is an ancestor of another (the entry times
+    of the descendants of a node lie between its entry and exit times). The
+    path length between a node and one of its ancestors is then a
+    subtraction.
+
+    Attributes:
+        root (int): index of the root node
+        root_distance: n-dimensional numpy array containing the arc length
+                       from the root to every node along the traversal
+                       (inf if not reachable)
+        parent: n-dimensional numpy array containing the parent of every
+                node in the traversal (-1 for the root and unreached nodes)
+        tin: n-dimensional numpy array containing the entry time of every
+             node in the traversal (-1 for unreached nodes)
+        tout: n-dimensional numpy array containing the exit time of every
+              node in the traversal (-1 for unreached nodes)
+        is_tree (bool): True if the (undirected) centerline is a tree
+
+    """
+    def __init__(self, topology, points, root = 0):
+        """
+        Init ArcLengthIndex.
+
+        Edges are considered undirected.
+
+        Arguments:
+            topology: CenterlineTopology of the centerline
+            points: n x 3 numpy array of point coordinates
+            root (int): index of the root node. Default -> 0
+
+        """
+        npoints = topology.npoints
+        adjacency = topology.adjacency_matrix(points)
+
+        self.root = root
+        order, parent = csgraph.depth_first_order(adjacency, root,
+                                                  directed = False,
+                                                  return_predecessors = True)
+        self.parent = parent.astype(np.int64)
+        self.parent[self.parent < 0] = -1
+        children = order[1:]
+        parents = self.parent[children]
+
+        # entry time is the position in the traversal
+        self.tin = np.full(npoints, -1, dtype = np.int64)
+        self.tin[order] = np.arange(order.size)
+
+        # exit time is one plus the entry time of the last descendant, which
+        # is found by following the last visited child of every node. These
+        # chains are the connected components of the graph linking every
+        # node to its last child, and the last descendant of a node is the
+        # node of its chain with the largest entry time
+        last_child = np.full(npoints, -1, dtype = np.int64)
+        np.maximum.at(last_child, parents, self.tin[children])
+        has_child = last_child >= 0
+        chains = scipy.sparse.csr_matrix((np.ones(np.sum(has_child)),
+                                          (np.where(has_child)[0],
+                                           order[last_child[has_child]])),
+                                         shape = (npoints, npoints))
+        _, labels = csgraph.connected_components(chains, directed = False)
+        last_descendant = np.full(npoints, -1, dtype = np.int64)
+        np.maximum.at(last_descendant, labels[order], self.tin[order])
+        self.tout = np.full(npoints, -1, dtype = np.int64)
+        self.tout[order] = last_descendant[labels[order]] + 1
+
+        # the arc length of a node is the sum of the lengths of the edges
+        # entering its ancestors (and itself). Every edge length is added
+        # at the entry time of its child and removed at its exit time, so
+        # that the cumulative sum at an entry time only includes ancestors
+        lengths = np.linalg.norm(points[children,:] - points[parents,:],
+                                 axis = 1)
+        increments = np.zeros(order.size + 1)
+        np.add.at(increments, self.tin[children], lengths)
+        np.add.at(increments, self.tout[children], -lengths)
+        self.root_distance = np.full(npoints, np.inf)
+        self.root_distance[order] = np.cumsum(increments)[self.tin[order]]
+
+        # a connected graph is a tree if it has n - 1 (undirected) edges
+        lower = np.minimum(topology.edges1, topology.edges2)
+        upper = np.maximum(topology.edges1, topology.edges2)
+        loops = lower == upper
+        keys = np.unique(lower[~loops] * npoints + upper[~loops])
+        nedges = keys.size
+        self.is_tree = np.all(self.tin >= 0) and nedges == npoints - 1
+
+    def is_ancestor(self, ancestors, nodes):
+        """
+        Check whether nodes are descendants of other nodes.
+
+        Every node is considered an ancestor of itself.
+
+        Arguments:
+            ancestors: numpy array containing indices of candidate ancestors
+            nodes: numpy array containing indices of nodes
+
+        Returns:
+            boolean numpy array, True where ancestors[i] is an ancestor of
+                nodes[i]
+
+        """
+        ancestors = np.asarray(ancestors, dtype = np.int64)
+        nodes = np.asarray(nodes, dtype = np.int64)
+        return (self.tin[ancestors] >= 0) & (self.tin[nodes] >= 0) & \
+               (self.tin[ancestors] <= self.tin[nodes]) & \
+               (self.tout[nodes] <= self.tout[ancestors])
+
+    def distances(self, sources, targets):
+        """
+        Path lengths between pairs of nodes.
+
+        Distances are only available if one node of the pair is an ancestor
+        of the other.
+
+        Arguments:
+            sources: numpy array containing indices of source nodes
+            targets: numpy array containing indices of target nodes
+
+        Returns:
+            numpy array containing the path length between sources[i] and
+                targets[i] (nan if neither node is an ancestor of the other
+                or if the centerline is not a tree)
+
+        """
+        sources = np.asarray(sources, dtype = np.int64)
+        targets = np.asarray(targets, dtype = np.int64)
+        dists = np.full(sources.size, np.nan)
+        if not self.is_tree:
+            return dists
+        related = self.is_ancestor(sources, targets) | \
+                  self.is_ancestor(targets, sources)
+        dists[related] = np.abs(self.root_distance[targets[related]] - \
+                                self.root_distance[sources[related]])
+        return dists
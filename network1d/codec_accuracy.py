@@ -0,0 +1,194 @@
+# Copyright 2023 Stanford University
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy 
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights 
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell 
+# copies of the Software, and to permit persons to whom the Software is 
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in 
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR 
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, 
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE 
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER 
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, 
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE 
+# SOFTWARE.
+
+import sys
+import os
+sys.path.append(os.getcwd())
+import torch as th
+import graph1d.generate_normalized_graphs as gng
+import graph1d.graph_store as gs
+import graph1d.field_codec as fc
+import tools.io_utils as io
+from network1d.tester import get_gnn_and_graphs
+from network1d.rollout import rollout
+import argparse
+import tempfile
+
+def encode_graphs(input_dir, output_dir, codec):
+    """
+    Save all graphs in a directory, one graph per file, encoding
+    time-dependent fields with a codec.
+
+    Arguments:
+        input_dir (string): path of the directory containing the graphs
+        output_dir (string): path of the output directory
+        codec: dictionary of codec parameters (see field_codec.default_codec).
+               If None, fields are stored as float32
+
+    Returns:
+        total size of the graph files in bytes
+
+    """
+    size = 0
+    for file in gng.list_graph_files(input_dir):
+        graphs = gng.load_graph_file(input_dir + file)
+        for name in graphs:
+            gs.save_graph(output_dir + name, graphs[name], codec)
+            size = size + os.path.getsize(output_dir + name)
+    return size
+
+def field_errors(graphs, ref_graphs, fields):
+    """
+    Compute the maximum error of node fields relative to the maximum absolute
+    value of the reference fields.
+
+    Arguments:
+        graphs: list of graphs
+        ref_graphs: list of reference graphs
+        fields: list of node field names
+
+    Returns:
+        dictionary (key: field name, value: relative error)
+
+    """
+    errs = {}
+    for field in fields:
+        diff = 0
+        ref = 0
+        for name in ref_graphs:
+            f = graphs[name].ndata[field].double()
+            ref_f = ref_graphs[name].ndata[field].double()
+            diff = max(diff, float(th.max(th.abs(f - ref_f))))
+            ref = max(ref, float(th.max(th.abs(ref_f))))
+        errs[field] = diff / ref
+    return errs
+
+def rollout_errors(gnn_model, params, graphs):
+    """
+    Compute average rollout errors.
+
+    Arguments:
+        gnn_model: the GNN
+        params: dictionary of parameters
+        graphs: list of normalized graphs
+
+    Returns:
+        1D tensor containing average pressure and flow rate relative errors
+
+    """
+    tot_errs = 0
+    for name in graphs:
+        _, _, errs, _, _ = rollout(gnn_model, params, graphs[name])
+        tot_errs = tot_errs + errs
+    return tot_errs / len(graphs)
+
+def evaluate_codecs(path, graphs_folder = 'graphs/', data_location = None,
+                    dtypes = ['float16', 'bfloat16', 'int16'],
+                    compression = 'zstd'):
+    """
+    Report size and accuracy loss of the storage codecs.
+
+    Graphs are encoded with every codec and decoded by the loaders. The
+    errors on the stored fields and the rollout errors of a trained GNN are
+    compared to those obtained with float32 fields.
+
+    Arguments:
+        path (string): path to the GNN model folder (see
+                       tester.get_gnn_and_graphs)
+        graphs_folder: name of folder containing graphs
+        data_location (string): location of the 'gROM_data' folder. If None,
+                                we take the default location (which must be
+                                specified in data_location.txt).
+                                Default -> None
+        dtypes: list of reduced precision types (see field_codec.quantize).
+                Default -> ['float16', 'bfloat16', 'int16']
+        compression (string): compression method (see field_codec.compress)
+                              Default -> 'zstd'
+
+    Returns:
+        dictionary (key: codec type, value: dictionary with keys 'size',
+        'field_errors', 'rollout_errors')
+
+    """
+    if data_location == None:
+        data_location = io.data_location()
+    input_dir = data_location + graphs_folder
+
+    report = {}
+    ref_graphs = None
+    for dtype in ['float32'] + dtypes:
+        codec = None
+        if dtype != 'float32':
+            codec = fc.default_codec()
+            codec['dtype'] = dtype
+            codec['compression'] = compression
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_dir = tmp_dir + '/'
+            size = encode_graphs(input_dir, tmp_dir, codec)
+            graphs = gng.load_graphs(tmp_dir)
+            if ref_graphs == None:
+                ref_graphs = graphs
+            ferrs = field_errors(graphs, ref_graphs, fc.default_codec()
+                                                      ['fields'])
+            gnn_model, graphs, params = get_gnn_and_graphs(path,
+                                                           '',
+                                                           tmp_dir)
+            errs = rollout_errors(gnn_model, params, graphs)
+        report[dtype] = {'size': size, 'field_errors': ferrs,
+                         'rollout_errors': errs}
+
+    ref = report['float32']
+    print('codec        size (MB)  ratio  field errors (p, q)    ' + \
+          'rollout errors (p, q)  change vs float32 (p, q)')
+    for dtype in report:
+        r = report[dtype]
+        change = r['rollout_errors'] - ref['rollout_errors']
+        print('{:<12} {:>9.3f} {:>6.2f}  {:.2e}, {:.2e}     {:.4e}, {:.4e}'
+              '  {:+.2e}, {:+.2e}'.format(dtype, r['size'] / 1e6,
+                                          ref['size'] / r['size'],
+                                          r['field_errors']['pressure'],
+                                          r['field_errors']['flowrate'],
+                                          r['rollout_errors'][0],
+                                          r['rollout_errors'][1],
+                                          change[0], change[1]))
+    return report
+
+"""
+This script reports the accuracy loss of the storage codecs. It expects the
+location of a saved model folder as command line argument. This is typically
+located in 'models/' after launching 'network1d/training.py'.
+"""
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Codec accuracy')
+    parser.add_argument('path', help='path to the GNN model folder')
+    parser.add_argument('--graphs_folder', help='folder containing graphs',
+                        default='graphs/')
+    parser.add_argument('--data_location', help='folder containing ' + \
+                        'graphs_folder', default=None)
+    parser.add_argument('--codecs', help='reduced precision types', nargs='+',
+                        choices=['float16', 'bfloat16', 'int16'],
+                        default=['float16', 'bfloat16', 'int16'])
+    parser.add_argument('--compression', help='compression method',
+                        choices=['zstd', 'lz4', 'zlib', 'none'],
+                        default='zstd')
+    args = parser.parse_args()
+
+    evaluate_codecs(args.path, args.graphs_folder, args.data_location,
+                    args.codecs, args.compression)
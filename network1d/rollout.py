@@ -143,19 +143,20 @@ def rollout(gnn_model, params, graph, average_branches = True):
 
     """
     gnn_model.eval()
-    times = graph.ndata['nfeatures'].shape[2]
+    times = nz.num_timesteps(graph)
     graph = copy.deepcopy(graph)
     true_graph = copy.deepcopy(graph)
 
-    tfc = true_graph.ndata['nfeatures'].clone()
-    graph.ndata['nfeatures'] = tfc[:,:,0].clone()
+    tfc = nz.get_dynamic_features(true_graph).clone()
+    graph.ndata['nfeatures'] = nz.get_node_features(true_graph, 0)
     graph.edata['efeatures'] = true_graph.edata['efeatures'].squeeze().clone()
 
     r_features = graph.ndata['nfeatures'][:,0:2].unsqueeze(axis = 2).clone()
     start = time.time()
     for it in range(times-1):
         # set loading variable
-        graph.ndata['nfeatures'][:,-1] = tfc[:,-1,it]
+        graph.ndata['nfeatures'][:,-1] = nz.get_node_features(true_graph,
+                                                              it)[:,-1]
         gf = perform_timestep(gnn_model, params, graph, tfc, it + 1)
 
         if average_branches:
@@ -168,7 +169,7 @@ def rollout(gnn_model, params, graph, average_branches = True):
         # graph.ndata['nfeatures'][:,0:2] = tfc[:,0:2,it + 1].clone()
 
     end = time.time()
-    tfc = true_graph.ndata['nfeatures'][:,0:2,:].clone()
+    tfc = nz.get_dynamic_features(true_graph)[:,0:2,:].clone()
 
     rfc = r_features.clone()
 
@@ -104,7 +104,7 @@ def evaluate_all_models(dataset, split_name, gnn_model, params, doplot = False):
            total_time / N, total_timesteps / N
 
 def get_gnn_and_graphs(path, graphs_folder = 'graphs/', 
-                       data_location = None):
+                       data_location = None, names = None):
 
     """
     Get GNN and list of graphs given the path to a saved model folder.
@@ -118,6 +118,8 @@ def get_gnn_and_graphs(path, graphs_folder = 'graphs/',
                                 we take the default location (which must be 
                                 specified in data_location.txt).
                                 Default -> None
+        names: list of names of the graphs to load.
+               Default -> None (load all graphs)
     Returns:
         GNN model
         List of graphs
@@ -136,7 +138,8 @@ def get_gnn_and_graphs(path, graphs_folder = 'graphs/',
                                                       ['normalization_type'],
                                                 params['bc_type'],
                                                 statistics = params 
-                                                             ['statistics'])
+                                                             ['statistics'],
+                                                names = names)
 
     return gnn_model, graphs, params
 
@@ -159,9 +162,13 @@ def get_dataset_and_gnn(path, graphs_folder = 'graphs/', data_location = None):
         Dictionary containing parameters
 
     """
+    params = json.load(open(path + '/parameters.json'))
+    # only graphs in the train and test splits are loaded
+    names = params['train_split'] + params['test_split']
     gnn_model, graphs, params = get_gnn_and_graphs(path,
                                                    graphs_folder,
-                                                   data_location)
+                                                   data_location,
+                                                   names)
 
     dataset = dset.generate_dataset_from_params(graphs, params)
     return dataset, gnn_model, params
@@ -517,6 +517,20 @@ def parse_command_line_arguments():
                         type=int, default=1)
     parser.add_argument('--stride', help='stride for multistep training',
                         type=int, default=5)
+    parser.add_argument('--time_shifts', help='number of random time ' + \
+                        'shifts (fractions of timestep) for augmentation',
+                        type=int, default=1)
+    parser.add_argument('--load_workers', help='number of threads ' + \
+                        'loading graphs', type=int, default=1)
+    parser.add_argument('--max_graphs', help='maximum number of graphs ' + \
+                        'kept in memory (-1: load all graphs eagerly)',
+                        type=int, default=-1)
+    parser.add_argument('--cache_format', help='format of the cached ' + \
+                        'normalized graphs (columnar: memory-mapped, ' + \
+                        'chunked: memory-mapped, only the time windows ' + \
+                        'used by training samples are read from disk)',
+                        type=str, default='columnar',
+                        choices=['columnar', 'chunked', 'grph'])
     parser.add_argument('--bcs_gnn', help='path to graph for bcs',
                         type=str, default='models_bcs/31.10.2022_01.35.31')
     args = parser.parse_args()
@@ -534,6 +548,7 @@ def parse_command_line_arguments():
                 'rate_noise': args.rate_noise,
                 'rate_noise_features': args.rate_noise_features,
                 'stride': args.stride,
+                'time_shifts': args.time_shifts,
                 'bcs_gnn': args.bcs_gnn}
 
     return t_params, args
@@ -542,7 +557,10 @@ def get_graphs_params(label_normalization, types_to_keep,
                       n_graphs_to_keep = -1,
                       graphs_folder = 'graphs/',
                       data_location = io.data_location(),
-                      features = None):
+                      features = None,
+                      nworkers = 1,
+                      max_graphs = None,
+                      cache_format = 'columnar'):
     """
     Get normalized graphs and associated parameters
 
@@ -556,6 +574,12 @@ def get_graphs_params(label_normalization, types_to_keep,
         data_location: path of folder containing 'graphs/' folder
         features: dictionary with node and edge features to include
                         Default value -> None (keep all)
+        nworkers: number of threads loading graphs. Default: 1
+        max_graphs: maximum number of graphs kept in memory. Graphs are
+                    loaded lazily if not None. Default: None
+        cache_format: format of the cached normalized graphs (see
+                      generate_normalized_graphs.save_cache).
+                      Default: 'columnar'
     Returns:
         Graphs
         Dictionary of parameters
@@ -573,7 +597,10 @@ def get_graphs_params(label_normalization, types_to_keep,
                                                     {'dataset_info' : info,
                                                     'types_to_keep': t2k},
                                                     n_graphs_to_keep=ngtk,
-                                                    features=features)
+                                                    features=features,
+                                                    nworkers=nworkers,
+                                                    max_graphs=max_graphs,
+                                                    cache_format=cache_format)
 
     return graphs, params, info
 
@@ -604,13 +631,17 @@ def training(parallel, rank = 0, graphs_folder = 'graphs/',
     elif args.label_norm == 2:
         label_normalization = 'none'
     
+    max_graphs = None
+    if args.max_graphs > 0:
+        max_graphs = args.max_graphs
     graphs, params, info = get_graphs_params(label_normalization,
                                              types_to_keep, -1,
                                              graphs_folder, data_location,
-                                             features)
+                                             features, args.load_workers,
+                                             max_graphs, args.cache_format)
     graph = graphs[list(graphs)[0]]
 
-    infeat_nodes = graph.ndata['nfeatures'].shape[1] + 1
+    infeat_nodes = gng.get_node_features(graph, 0).shape[1] + 1
     infeat_edges = graph.edata['efeatures'].shape[1]
     nout = 2
 
@@ -0,0 +1,9 @@
+#!/bin/bash
+
+set -e
+
+source gromenv/bin/activate 
+python test/test_topology.py
+python test/test_field_statistics.py
+python test/test_field_codec.py
+python test/test_graph_store.py
\ No newline at end of file
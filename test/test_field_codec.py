@@ -0,0 +1,173 @@
+# Copyright 2023 Stanford University
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy 
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights 
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell 
+# copies of the Software, and to permit persons to whom the Software is 
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in 
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR 
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, 
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE 
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER 
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, 
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE 
+# SOFTWARE.
+
+import sys
+import os
+sys.path.append(os.getcwd())
+import numpy as np
+import json
+import torch as th
+import graph1d.field_codec as fc
+
+def codec(dtype, compression = 'zlib', chunk_size = 7):
+    """
+    Codec parameters used in the tests.
+
+    Arguments:
+        dtype (string): data type
+        compression (string): compression. Default -> 'zlib'
+        chunk_size (int): number of timesteps per chunk. Default -> 7
+
+    Returns:
+        dictionary of codec parameters
+
+    """
+    params = fc.default_codec()
+    params['dtype'] = dtype
+    params['compression'] = compression
+    params['chunk_size'] = chunk_size
+    return params
+
+def round_trip(tensor, params):
+    """
+    Encode and decode a tensor.
+
+    Arguments:
+        tensor: float32 tensor
+        params: dictionary of codec parameters
+
+    Returns:
+        decoded float32 tensor
+        dictionary of encoding parameters stored in the header
+
+    """
+    header, data = fc.encode(tensor, params)
+    decoded = fc.decode(header, data)
+    if decoded.dtype != th.float32 or decoded.shape != tensor.shape:
+        raise ValueError('Incorrect type or shape of decoded field')
+    return decoded, json.loads(header.numpy().tobytes().decode())
+
+def field(shape, seed = 0):
+    """
+    Random field with the magnitude of pressure (mmHg) and flow rate.
+
+    Arguments:
+        shape: shape of the field (last dimension: time)
+        seed (int): random seed. Default -> 0
+
+    Returns:
+        float32 tensor
+
+    """
+    rng = np.random.default_rng(seed)
+    values = 80 + 20 * np.sin(np.linspace(0, 6, shape[-1])) + \
+             rng.normal(0, 1, shape)
+    return th.tensor(values, dtype = th.float32)
+
+def test_exact_round_trip():
+    # chunk sizes dividing the number of timesteps or not, and zero-length
+    # series
+    for shape in [(10, 1, 21), (10, 1, 23), (4, 2, 1), (5, 1, 0), (0, 1, 6)]:
+        tensor = field(shape)
+        for compression in ['none', 'zlib']:
+            decoded, _ = round_trip(tensor, codec('float32', compression))
+            if not th.equal(decoded, tensor):
+                raise ValueError('float32 round trip is not exact')
+
+def test_bounded_error():
+    tensor = field((50, 1, 45))
+    # relative errors of float16 and bfloat16 are bounded by half the
+    # machine epsilon (11 and 8 bits of mantissa)
+    for dtype, rtol in [('float16', 2**-11), ('bfloat16', 2**-8)]:
+        decoded, _ = round_trip(tensor, codec(dtype))
+        error = th.max(th.abs(decoded - tensor) / th.abs(tensor))
+        if error > rtol:
+            raise ValueError('Error of ' + dtype + ' too large')
+
+    # int16 error is bounded by half the scale (plus float32 rounding)
+    decoded, header = round_trip(tensor, codec('int16'))
+    tol = header['scale'] / 2 + 1e-6 * th.max(th.abs(tensor))
+    if th.max(th.abs(decoded - tensor)) > tol or \
+       th.min(decoded) < th.min(tensor) - tol or \
+       th.max(decoded) > th.max(tensor) + tol:
+        raise ValueError('Error of int16 too large')
+
+def test_bfloat16_bits():
+    tensor = field((8, 1, 9))
+    values, _, _ = fc.quantize(tensor.numpy(), 'bfloat16')
+    bits = tensor.to(th.bfloat16).view(th.int16).numpy()
+    if values.dtype != np.int16 or not np.array_equal(values, bits):
+        raise ValueError('bfloat16 values are not stored as their bits')
+    decoded = fc.dequantize(values, 'bfloat16', 1.0, 0.0)
+    if not np.array_equal(decoded, tensor.to(th.bfloat16).float().numpy()):
+        raise ValueError('Incorrect bfloat16 values')
+
+def test_int16_constant():
+    tensor = th.full((6, 1, 10), 83.25)
+    values, scale, offset = fc.quantize(tensor.numpy(), 'int16')
+    if scale != 1.0 or offset != 83.25 or np.any(values != 0):
+        raise ValueError('Incorrect quantization of constant field')
+    decoded, _ = round_trip(tensor, codec('int16'))
+    if not th.equal(decoded, tensor):
+        raise ValueError('Constant field is not decoded exactly')
+
+    # zero-length series
+    decoded, header = round_trip(th.zeros(3, 1, 0), codec('int16'))
+    if header['chunks'] != [] or header['scale'] != 1.0:
+        raise ValueError('Incorrect encoding of zero-length series')
+
+def test_compression_fallback():
+    zstandard, lz4 = fc.zstandard, fc.lz4
+    fc.zstandard, fc.lz4 = None, None
+    try:
+        tensor = field((10, 1, 30))
+        for compression in ['zstd', 'lz4']:
+            decoded, header = round_trip(tensor, codec('float32', compression))
+            if header['compression'] != 'zlib' or \
+               not th.equal(decoded, tensor):
+                raise ValueError('Incorrect fallback to zlib')
+    finally:
+        fc.zstandard, fc.lz4 = zstandard, lz4
+
+def test_labels():
+    labels = {'graph.0/pressure': field((5, 1, 12), 1),
+              'graph.0/flowrate': field((5, 1, 12), 2),
+              'graph.0/dt': th.ones(5, 1)}
+    params = codec('float16')
+    encoded = fc.encode_labels(labels, params)
+    if 'graph.0/pressure' in encoded or \
+       'graph.0/pressure' + fc.HEADER_SUFFIX not in encoded or \
+       'graph.0/pressure' + fc.DATA_SUFFIX not in encoded or \
+       not th.equal(encoded['graph.0/dt'], labels['graph.0/dt']):
+        raise ValueError('Incorrect encoded labels')
+    decoded = fc.decode_labels(encoded)
+    if sorted(decoded) != sorted(labels):
+        raise ValueError('Incorrect decoded labels')
+    for label in labels:
+        if not th.allclose(decoded[label], labels[label], rtol = 2**-11):
+            raise ValueError('Incorrect decoded field ' + label)
+
+if __name__ == "__main__":
+    test_exact_round_trip()
+    test_bounded_error()
+    test_bfloat16_bits()
+    test_int16_constant()
+    test_compression_fallback()
+    test_labels()
@@ -0,0 +1,143 @@
+# Copyright 2023 Stanford University
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy 
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights 
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell 
+# copies of the Software, and to permit persons to whom the Software is 
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in 
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR 
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, 
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE 
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER 
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, 
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE 
+# SOFTWARE.
+
+import sys
+import os
+sys.path.append(os.getcwd())
+import numpy as np
+import torch as th
+import tempfile
+import graph1d.field_statistics as fs
+
+def check_statistics(accumulator, values, message):
+    """
+    Compare an accumulator with the statistics computed by numpy.
+
+    Arguments:
+        accumulator: FieldStatistics
+        values: numpy array of values
+        message (string): error message
+
+    """
+    values = np.asarray(values, dtype = np.float64).reshape(-1)
+    if accumulator.count != values.size or \
+       accumulator.min != np.min(values) or \
+       accumulator.max != np.max(values) or \
+       not np.isclose(accumulator.mean, np.mean(values),
+                      rtol = 1e-12, atol = 0) or \
+       not np.isclose(accumulator.stdv(), np.std(values),
+                      rtol = 1e-9, atol = 0):
+        raise ValueError(message)
+
+def batches(values, nbatches, rng):
+    """
+    Split values in batches of random sizes (some of them can be empty).
+
+    Arguments:
+        values: numpy array of values
+        nbatches (int): number of batches
+        rng: numpy random generator
+
+    Returns:
+        list of numpy arrays
+
+    """
+    splits = np.sort(rng.integers(0, values.size, nbatches - 1))
+    return np.split(values, splits)
+
+def test_update():
+    rng = np.random.default_rng(0)
+    # large mean and small variance, as for pressure
+    values = 1e5 + rng.normal(0, 1e-1, 10000).astype(np.float32)
+    accumulator = fs.FieldStatistics()
+    for batch in batches(values, 17, rng):
+        accumulator.update(th.tensor(batch))
+    accumulator.update(np.zeros(0))
+    check_statistics(accumulator, values, 'Incorrect statistics of batches')
+
+def test_merge():
+    rng = np.random.default_rng(1)
+    values = rng.exponential(3, 5000) - 10
+    accumulators = []
+    for batch in batches(values, 9, rng):
+        accumulator = fs.FieldStatistics()
+        accumulator.update(batch)
+        accumulators.append(accumulator)
+
+    # merging in any order gives the same statistics
+    for order in [range(9), reversed(range(9)), rng.permutation(9)]:
+        merged = fs.FieldStatistics()
+        for i in order:
+            merged.merge(accumulators[i])
+        check_statistics(merged, values, 'Incorrect merged statistics')
+
+    # tree reduction, as when accumulators come from several processes
+    while len(accumulators) > 1:
+        accumulators[0].merge(accumulators[1])
+        accumulators = accumulators[2:] + accumulators[0:1]
+    check_statistics(accumulators[0], values, 'Incorrect tree reduction')
+
+    # merging with empty accumulators does not change anything
+    merged = fs.FieldStatistics()
+    merged.merge(accumulators[0])
+    merged.merge(fs.FieldStatistics())
+    check_statistics(merged, values, 'Incorrect merge with empty')
+
+    empty = fs.FieldStatistics()
+    empty.merge(fs.FieldStatistics())
+    if empty.count != 0 or not np.isnan(empty.stdv()) or \
+       empty.min != np.inf or empty.max != -np.inf:
+        raise ValueError('Incorrect merge of empty accumulators')
+
+    merged = fs.merge_accumulators({'a': accumulators[0]},
+                                   {'a': fs.FieldStatistics(),
+                                    'b': accumulators[0]})
+    check_statistics(merged['b'], values, 'Incorrect merge of dictionaries')
+
+def test_scaled():
+    rng = np.random.default_rng(2)
+    values = rng.normal(2, 5, 1000)
+    accumulator = fs.FieldStatistics()
+    accumulator.update(values)
+    for factor in [3.5, -0.25]:
+        check_statistics(accumulator.scaled(factor), values * factor,
+                         'Incorrect scaled statistics')
+    if fs.FieldStatistics().scaled(-2).count != 0:
+        raise ValueError('Incorrect scaled empty accumulator')
+
+def test_save_load():
+    rng = np.random.default_rng(3)
+    values = rng.normal(0, 1, 100)
+    accumulators = {'pressure': fs.FieldStatistics(),
+                    'dp': fs.FieldStatistics()}
+    accumulators['pressure'].update(values)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fname = tmp_dir + '/statistics.json'
+        fs.save_accumulators(accumulators, fname)
+        loaded = fs.load_accumulators(fname)
+    check_statistics(loaded['pressure'], values, 'Incorrect loaded statistics')
+    if loaded['dp'].count != 0:
+        raise ValueError('Incorrect loaded empty accumulator')
+
+if __name__ == "__main__":
+    test_update()
+    test_merge()
+    test_scaled()
+    test_save_load()
@@ -0,0 +1,228 @@
+# Copyright 2023 Stanford University
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy 
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights 
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell 
+# copies of the Software, and to permit persons to whom the Software is 
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in 
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR 
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, 
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE 
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER 
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, 
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE 
+# SOFTWARE.
+
+import sys
+import os
+sys.path.append(os.getcwd())
+import numpy as np
+import torch as th
+import dgl
+import tempfile
+import graph1d.graph_store as gs
+import graph1d.field_codec as fc
+import graph1d.generate_normalized_graphs as gng
+
+def static_graph(nnodes = 12):
+    """
+    Chain graph with static node and edge features.
+
+    Arguments:
+        nnodes (int): number of nodes. Default -> 12
+
+    Returns:
+        DGL graph
+
+    """
+    rng = np.random.default_rng(0)
+    graph = dgl.graph((th.arange(nnodes - 1), th.arange(1, nnodes)),
+                      num_nodes = nnodes, idtype = th.int32)
+    graph.ndata['x'] = th.tensor(rng.normal(0, 1, (nnodes, 3)),
+                                 dtype = th.float32)
+    graph.ndata['area'] = th.tensor(rng.uniform(0.1, 1, (nnodes, 1)),
+                                    dtype = th.float32)
+    graph.edata['distance'] = th.tensor(rng.uniform(0.1, 1, nnodes - 1),
+                                        dtype = th.float32)
+    return graph
+
+def blocks(names, nnodes = 12, ntimes = 20):
+    """
+    Time-dependent node features of several copies of a simulation.
+
+    Arguments:
+        names: list of graph names
+        nnodes (int): number of nodes. Default -> 12
+        ntimes (int): number of timesteps. Default -> 20
+
+    Returns:
+        dictionary of time-dependent node features (key: graph name,
+            value: dictionary with key: field name, value: tensor)
+
+    """
+    rng = np.random.default_rng(1)
+    result = {}
+    for icopy, name in enumerate(names):
+        result[name] = {
+            'pressure': th.tensor(80 + rng.normal(0, 5, (nnodes, 1, ntimes)),
+                                  dtype = th.float32),
+            'flowrate': th.tensor(rng.normal(0, 1, (nnodes, 1, ntimes)),
+                                  dtype = th.float32),
+            'dt': th.full((nnodes, 1), 0.01 * (icopy + 1))}
+    return result
+
+def check_graphs(graphs, graph, fields, rtol, message):
+    """
+    Compare graphs read from a store with the fields that were saved.
+
+    Arguments:
+        graphs: dictionary of DGL graphs (key: graph name)
+        graph: DGL graph containing topology and static features
+        fields: dictionary of time-dependent node features (see blocks)
+        rtol (float): relative tolerance of encoded fields
+        message (string): error message
+
+    """
+    if list(graphs) != sorted(fields):
+        raise ValueError(message + ': incorrect order of graphs')
+    for name in fields:
+        read = graphs[name]
+        if not th.equal(th.stack(read.edges()), th.stack(graph.edges())):
+            raise ValueError(message + ': incorrect topology')
+        for field in ['x', 'area']:
+            if not th.equal(read.ndata[field], graph.ndata[field]):
+                raise ValueError(message + ': incorrect field ' + field)
+        if not th.equal(read.edata['distance'], graph.edata['distance']):
+            raise ValueError(message + ': incorrect edge field distance')
+        for field in fields[name]:
+            if read.ndata[field].dtype != th.float32 or \
+               not th.allclose(read.ndata[field], fields[name][field],
+                               rtol = rtol, atol = 0):
+                raise ValueError(message + ': incorrect field ' + field)
+
+def test_store_round_trip():
+    graph = static_graph()
+    # names are not inserted in sorted order
+    names = ['s0001_0001.3.grph', 's0001_0001.0.grph', 's0001_0001.2.grph',
+             's0001_0001.1.grph']
+    fields = blocks(names)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fname = tmp_dir + '/s0001_0001.grphs'
+        gs.save_store(fname, graph, fields)
+        store = gs.GraphStore(fname)
+        if store.names() != sorted(names):
+            raise ValueError('Names of the graphs in the store are not sorted')
+        check_graphs(gng.load_graph_file(fname), graph, fields, 0,
+                     'Store')
+        for lazy in [False, True]:
+            graphs = gng.read_graph_files(tmp_dir + '/', ['s0001_0001.grphs'],
+                                          lazy = lazy)
+            check_graphs(graphs, graph, fields, 0, 'Store read from folder')
+
+def test_store_codec():
+    graph = static_graph()
+    names = ['s0002_0001.1.grph', 's0002_0001.0.grph']
+    fields = blocks(names)
+    codec = fc.default_codec()
+    codec['compression'] = 'zlib'
+    codec['chunk_size'] = 7
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fname = tmp_dir + '/s0002_0001.grphs'
+        gs.save_store(fname, graph, fields, codec)
+        # relative error of float16 is bounded by half the machine epsilon;
+        # fields that are not encoded (dt) are compared within the same
+        # tolerance
+        check_graphs(gng.load_graph_file(fname), graph, fields, 2**-11,
+                     'Encoded store')
+        dt = gs.GraphStore(fname).blocks['s0002_0001.1.grph']['dt']
+        if not th.equal(dt, fields['s0002_0001.1.grph']['dt']):
+            raise ValueError('Field that is not encoded is modified')
+
+def test_columnar_round_trip():
+    graph = static_graph()
+    graph.ndata['pressure'] = blocks(['graph'])['graph']['pressure']
+    gs.chunk_time_series(graph, 'pressure', 6)
+    loaded_arrays = []
+    load = np.load
+
+    def load_spy(*args, **kwargs):
+        array = load(*args, **kwargs)
+        loaded_arrays.append(array)
+        return array
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        dirname = tmp_dir + '/graph' + gs.COLUMNAR_EXT
+        gs.save_columnar(dirname, graph, 'graph.0.grph')
+        np.load = load_spy
+        try:
+            loaded, name = gs.load_columnar(dirname)
+        finally:
+            np.load = load
+        if name != 'graph.0.grph' or \
+           gs.columnar_name(dirname) != 'graph.0.grph':
+            raise ValueError('Incorrect name of columnar graph')
+        if len(loaded_arrays) == 0 or \
+           any(not isinstance(array, np.memmap) or array.mode != 'c'
+               for array in loaded_arrays):
+            raise ValueError('Columnar arrays are not memory-mapped in '
+                             'copy-on-write mode')
+        if not th.equal(th.stack(loaded.edges(order = 'eid')),
+                        th.stack(graph.edges(order = 'eid'))):
+            raise ValueError('Incorrect topology of columnar graph')
+        for field in graph.ndata:
+            if not th.equal(loaded.ndata[field], graph.ndata[field]):
+                raise ValueError('Incorrect field ' + field)
+        if not th.equal(loaded.edata['distance'], graph.edata['distance']):
+            raise ValueError('Incorrect edge field distance')
+
+        # tensors can be modified in place without modifying the files
+        loaded.ndata['x'] += 1
+        loaded.ndata['pressure' + gs.CHUNKS_SUFFIX][:, 0] = 0
+        loaded.edata['distance'] *= 2
+        reloaded, _ = gs.load_columnar(dirname)
+        for field in graph.ndata:
+            if not th.equal(reloaded.ndata[field], graph.ndata[field]):
+                raise ValueError('Columnar file modified by in-place update')
+        if not th.equal(reloaded.edata['distance'], graph.edata['distance']):
+            raise ValueError('Columnar file modified by in-place update')
+
+def test_time_window():
+    graph = static_graph()
+    # 20 timesteps in chunks of 6: the last chunk contains 2 timesteps
+    dense = blocks(['graph'])['graph']['pressure']
+    graph.ndata['pressure'] = dense
+    gs.chunk_time_series(graph, 'pressure', 6)
+    if 'pressure' in graph.ndata or gs.num_times(graph, 'pressure') != 20:
+        raise ValueError('Incorrect chunked time series')
+    # windows within a chunk, crossing chunk boundaries, touching the last
+    # (partial) chunk, past the end and empty
+    windows = [(0, 6), (2, 5), (5, 7), (4, 17), (6, 18), (11, 20), (17, 19),
+               (18, 20), (0, 20), (13, 25), (0, None), (7, None), (9, 9),
+               (20, None)]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        dirname = tmp_dir + '/graph' + gs.COLUMNAR_EXT
+        gs.save_columnar(dirname, graph, 'graph')
+        loaded, _ = gs.load_columnar(dirname)
+        for chunked in [graph, loaded]:
+            for start, stop in windows:
+                window = gs.time_window(chunked, 'pressure', start, stop)
+                if not th.equal(window, dense[..., start:stop]):
+                    raise ValueError('Incorrect time window ' +
+                                     str((start, stop)))
+    # fields that are not chunked are sliced
+    graph.ndata['flowrate'] = dense
+    if not th.equal(gs.time_window(graph, 'flowrate', 5, 13),
+                    dense[..., 5:13]) or \
+       gs.num_times(graph, 'flowrate') != 20:
+        raise ValueError('Incorrect time window of dense field')
+
+if __name__ == "__main__":
+    test_store_round_trip()
+    test_store_codec()
+    test_columnar_round_trip()
+    test_time_window()
@@ -0,0 +1,180 @@
+# Copyright 2023 Stanford University
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy 
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights 
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell 
+# copies of the Software, and to permit persons to whom the Software is 
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in 
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR 
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, 
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE 
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER 
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, 
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE 
+# SOFTWARE.
+
+import sys
+import os
+sys.path.append(os.getcwd())
+import numpy as np
+from graph1d.topology import CenterlineTopology, ArcLengthIndex
+
+def branched_tree():
+    """
+    Small branched centerline.
+
+    The inlet (0) is connected to a junction node (3), which splits into two
+    branches ending at the outlets 5 and 7:
+
+        0 -> 1 -> 2 -> 3 -> 4 -> 5
+                       3 -> 6 -> 7
+
+    Returns:
+        n x 3 numpy array of point coordinates
+        numpy array containing indices of source nodes for every edge
+        numpy array containing indices of dest nodes for every edge
+
+    """
+    points = np.array([[0, 0, 0], [1, 0, 0], [2, 0, 0], [3, 0, 0],
+                       [3, 1, 0], [3, 2, 0], [3, -1, 0], [3, -3, 0]],
+                      dtype = np.float64)
+    edges1 = np.array([0, 1, 2, 3, 4, 3, 6])
+    edges2 = np.array([1, 2, 3, 4, 5, 6, 7])
+    return points, edges1, edges2
+
+def test_connectivity():
+    _, edges1, edges2 = branched_tree()
+    topology = CenterlineTopology(edges1, edges2)
+
+    if topology.npoints != 8 or topology.nedges() != 7:
+        raise ValueError('Incorrect number of nodes or edges')
+    if topology.inlets() != [0]:
+        raise ValueError('Incorrect inlets')
+    # outlets are returned in the order they appear in edges2
+    if topology.outlets() != [5, 7]:
+        raise ValueError('Incorrect outlets')
+    if sorted(topology.successors(3).tolist()) != [4, 6]:
+        raise ValueError('Incorrect successors')
+    if topology.predecessors(3).tolist() != [2] or \
+       topology.predecessors(0).size != 0:
+        raise ValueError('Incorrect predecessors')
+    if topology.out_degree().tolist() != [1, 1, 1, 2, 1, 0, 1, 0] or \
+       topology.in_degree().tolist() != [0, 1, 1, 1, 1, 1, 1, 1]:
+        raise ValueError('Incorrect degrees')
+
+def test_remove_points():
+    _, edges1, edges2 = branched_tree()
+    topology = CenterlineTopology(edges1, edges2)
+
+    # 1 is replaced by 2, which is later replaced by 3: 1 must end up as 3.
+    # 7 is replaced by 6 (an outlet is moved one node back)
+    idxs_to_delete = [1, 2, 7]
+    idxs_to_replace = [2, 3, 6]
+    sampled_indices, \
+    new_topology = topology.remove_points(idxs_to_delete, idxs_to_replace)
+
+    # apply the replacements one by one
+    e1, e2 = edges1.copy(), edges2.copy()
+    for idelete, ireplace in zip(idxs_to_delete, idxs_to_replace):
+        e1[e1 == idelete] = ireplace
+        e2[e2 == idelete] = ireplace
+    keep = e1 != e2
+    new_indices = {index: i for i, index in enumerate(sampled_indices)}
+    expected = sorted((new_indices[a], new_indices[b])
+                      for a, b in zip(e1[keep], e2[keep]))
+
+    if sampled_indices.tolist() != [0, 3, 4, 5, 6]:
+        raise ValueError('Incorrect sampled indices')
+    if new_topology.npoints != 5:
+        raise ValueError('Incorrect number of nodes')
+    edges = sorted(zip(new_topology.edges1.tolist(),
+                       new_topology.edges2.tolist()))
+    if edges != expected or edges != [(0, 1), (1, 2), (1, 4), (2, 3)]:
+        raise ValueError('Incorrect edges after removing points')
+    if new_topology.outlets() != [3, 4]:
+        raise ValueError('Incorrect outlets after removing points')
+
+def test_adjacency_matrix():
+    points, edges1, edges2 = branched_tree()
+    # repeated edge, self loop and edge between coincident points
+    points = np.concatenate((points, points[7:8,:]))
+    edges1 = np.concatenate((edges1, [0, 2, 7]))
+    edges2 = np.concatenate((edges2, [1, 2, 8]))
+    adjacency = CenterlineTopology(edges1, edges2).adjacency_matrix(points)
+
+    if adjacency.shape != (9, 9) or adjacency.nnz != 8:
+        raise ValueError('Incorrect number of stored edges')
+    if adjacency[0, 1] != 1 or adjacency[6, 7] != 2 or adjacency[2, 2] != 0:
+        raise ValueError('Incorrect edge weights')
+    # the zero-length edge is stored explicitly
+    if adjacency.indptr[8] - adjacency.indptr[7] != 1:
+        raise ValueError('Zero-length edge not stored')
+
+def test_geodesic_distances():
+    points, edges1, edges2 = branched_tree()
+    topology = CenterlineTopology(edges1, edges2)
+    dists, prevs = topology.geodesic_distances(points, [0, 3])
+
+    if dists.shape != (2, 8) or prevs.shape != (2, 8):
+        raise ValueError('Incorrect shape of distances')
+    if not np.allclose(dists[0,:], [0, 1, 2, 3, 4, 5, 4, 6]):
+        raise ValueError('Incorrect distances from inlet')
+    # edges are directed: nodes upstream of the junction are not reachable
+    if not np.all(np.isinf(dists[1,0:3])) or \
+       not np.allclose(dists[1,3:], [0, 1, 2, 1, 3]):
+        raise ValueError('Incorrect distances from junction')
+    if prevs[0,0] != -1 or prevs[0,7] != 6 or prevs[0,4] != 3 or \
+       prevs[1,1] != -1:
+        raise ValueError('Incorrect previous nodes')
+
+def test_arc_length_index():
+    points, edges1, edges2 = branched_tree()
+    topology = CenterlineTopology(edges1, edges2)
+    arc_length = ArcLengthIndex(topology, points, root = 0)
+
+    if not arc_length.is_tree:
+        raise ValueError('Centerline not recognized as a tree')
+    if not np.allclose(arc_length.root_distance, [0, 1, 2, 3, 4, 5, 4, 6]):
+        raise ValueError('Incorrect arc lengths')
+    if arc_length.parent.tolist() != [-1, 0, 1, 2, 3, 4, 3, 6]:
+        raise ValueError('Incorrect parents')
+    # exit time minus entry time is the size of the subtree
+    sizes = arc_length.tout - arc_length.tin
+    if sizes.tolist() != [8, 7, 6, 5, 2, 1, 2, 1]:
+        raise ValueError('Incorrect subtree sizes')
+    if arc_length.is_ancestor([3, 4, 7, 5], [7, 7, 7, 3]).tolist() != \
+       [True, False, True, False]:
+        raise ValueError('Incorrect ancestors')
+    dists = arc_length.distances([5, 7, 0, 5], [0, 3, 7, 7])
+    if not np.allclose(dists[0:3], [5, 3, 6]) or not np.isnan(dists[3]):
+        raise ValueError('Incorrect distances')
+
+    # edges are undirected: rooting the tree at an outlet
+    arc_length = ArcLengthIndex(topology, points, root = 5)
+    if not np.allclose(arc_length.root_distance, [5, 4, 3, 2, 1, 0, 3, 5]):
+        raise ValueError('Incorrect arc lengths from outlet')
+    if not np.allclose(arc_length.distances([7], [5]), [5]):
+        raise ValueError('Incorrect distances from outlet')
+
+    # unreachable nodes and cycles
+    points = np.concatenate((points, [[10, 0, 0]]))
+    topology = CenterlineTopology(np.append(edges1, 5), np.append(edges2, 7),
+                                  9)
+    arc_length = ArcLengthIndex(topology, points, root = 0)
+    if arc_length.is_tree or not np.isinf(arc_length.root_distance[8]) or \
+       arc_length.tin[8] != -1 or arc_length.tout[8] != -1:
+        raise ValueError('Incorrect index for a graph that is not a tree')
+    if not np.all(np.isnan(arc_length.distances([0], [3]))):
+        raise ValueError('Distances should not be available')
+
+if __name__ == "__main__":
+    test_connectivity()
+    test_remove_points()
+    test_adjacency_matrix()
+    test_geodesic_distances()
+    test_arc_length_index()
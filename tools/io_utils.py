@@ -19,6 +19,8 @@
 # SOFTWARE.
 
 import os
+import uuid
+import shutil
 import vtk
 import numpy as np
 from vtk.util.numpy_support import vtk_to_numpy as v2n
@@ -54,6 +56,47 @@ def create_directory(fdr_name):
     except OSError:
         print('Directory ' + fdr_name + ' exists')
 
+def write_atomically(write, fname):
+    """
+    Write a file atomically.
+
+    The file is first written to a temporary file in the same directory,
+    which is then renamed. Readers therefore never see partially written
+    files. The write function can also create a directory, in which case
+    fname must not exist or be an empty directory.
+
+    Arguments:
+        write: function taking the name of the file to write as argument
+        fname (string): name of the file
+
+    """
+    fdr = os.path.dirname(os.path.abspath(fname))
+    tmp_fname = os.path.join(fdr, '.{}.{}.tmp'.format(os.getpid(),
+                                                     uuid.uuid4().hex))
+    try:
+        write(tmp_fname)
+        os.replace(tmp_fname, fname)
+    except BaseException:
+        if os.path.isdir(tmp_fname):
+            shutil.rmtree(tmp_fname)
+        elif os.path.exists(tmp_fname):
+            os.remove(tmp_fname)
+        raise
+
+def file_signature(fname):
+    """
+    Signature of a file, used to detect if the file changed.
+
+    Arguments:
+        fname (string): name of the file
+
+    Returns:
+        list containing modification time (in ns) and size of the file
+
+    """
+    stat = os.stat(fname)
+    return [stat.st_mtime_ns, stat.st_size]
+
 def collect_arrays(celldata, components = None):
     """  
     Collect arrays from a cell data or point data object.
@@ -114,10 +157,98 @@ def get_all_arrays(geo, components = None):
     points = collect_points(geo.GetPoints(), components)
     return point_data, cell_data, points
 
+def get_arrays(pointdata, arraynames):
+    """
+    Get a subset of the arrays of a cell data or point data object.
+
+    Arguments:
+        pointdata: Input data
+        arraynames: list of names of the arrays to get. Names that are not
+                    found are skipped
+    Returns:
+        A dictionary of arrays (key: array name, value: numpy array)
+
+    """
+    res = {}
+    for name in arraynames:
+        data = pointdata.GetArray(name)
+        if data != None:
+            res[name] = v2n(data).astype(np.float32)
+    return res
+
+def index_time_arrays(pointdata, mintime = 1e-12):
+    """
+    Index time-dependent arrays of a cell data or point data object.
+
+    Time-dependent arrays are named as <field>_<time>. Array names are parsed
+    once, without loading the arrays.
+
+    Arguments:
+        pointdata: Input data
+        mintime (float): Minimum time to consider. Default value = 1e-12.
+    Returns:
+        Dictionary (key: field name, value: list of (time, array name) tuples
+            sorted by time)
+
+    """
+    index = {}
+    for i in range(pointdata.GetNumberOfArrays()):
+        name = pointdata.GetArrayName(i)
+        if '_' not in name:
+            continue
+        field, time = name.rsplit('_', 1)
+        try:
+            time = float(time)
+        except ValueError:
+            continue
+        if time > mintime:
+            if field not in index:
+                index[field] = []
+            index[field].append((time, name))
+    for field in index:
+        index[field].sort()
+    return index
+
+def get_time_series(pointdata, fieldname, index = None, mintime = 1e-12):
+    """
+    Get a time-dependent field from a cell data or point data object.
+
+    Only the arrays of the requested field are converted.
+
+    Arguments:
+        pointdata: Input data
+        fieldname (string): name of the field (arrays are named as
+                            <fieldname>_<time>)
+        index: dictionary returned by index_time_arrays. Default -> None
+               (compute it)
+        mintime (float): Minimum time to consider. Default value = 1e-12.
+    Returns:
+        Sorted m-dimensional numpy array of times (None if the field is not
+            found)
+        n x m numpy array containing the field at all times (None if the
+            field is not found)
+
+    """
+    if index == None:
+        index = index_time_arrays(pointdata, mintime)
+    if fieldname not in index:
+        return None, None
+
+    times = np.array([time for time, _ in index[fieldname]])
+    values = np.zeros((pointdata.GetNumberOfTuples(), times.size),
+                      dtype = np.float32)
+    for itime, (_, name) in enumerate(index[fieldname]):
+        values[:,itime] = v2n(pointdata.GetArray(name))
+    return times, values
+
 def get_edges(geo):
     """
     Get edges from geometry file.
-  
+
+    Connectivity is read directly from the VTK connectivity and offset
+    arrays when the geometry is made of lines (or is an unstructured grid),
+    otherwise cells are traversed one by one.
+
     Arguments:
         geo: Input geometry
         
@@ -126,9 +257,23 @@ def get_edges(geo):
         List of nodes indices (second nodes in each edge)
   
     """
+    ncells = geo.GetNumberOfCells()
+    cells = None
+    if isinstance(geo, vtk.vtkPolyData):
+        if geo.GetLines().GetNumberOfCells() == ncells:
+            cells = geo.GetLines()
+    elif isinstance(geo, vtk.vtkUnstructuredGrid):
+        cells = geo.GetCells()
+
+    if cells != None and ncells > 0:
+        offsets = v2n(cells.GetOffsetsArray())
+        connectivity = v2n(cells.GetConnectivityArray())
+        edges1 = connectivity[offsets[:-1]].astype(np.int64)
+        edges2 = connectivity[offsets[:-1] + 1].astype(np.int64)
+        return edges1, edges2
+
     edges1 = []
     edges2 = []
-    ncells = geo.GetNumberOfCells()
     for i in range(ncells):
         edges1.append(int(geo.GetCell(i).GetPointIds().GetId(0)))
         edges2.append(int(geo.GetCell(i).GetPointIds().GetId(1)))
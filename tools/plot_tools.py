@@ -167,7 +167,7 @@ def video_all_nodes(features, graph, params, time,
     indices = np.floor(np.linspace(0,features.shape[2]-1,nframes)).astype(int)
 
     sel_pred_features = features[:,:,indices]
-    sel_real_features = graph.ndata['nfeatures'][:,:,indices]
+    sel_real_features = gng.get_dynamic_features(graph)[:,:,indices]
 
     sel_pred_features[:,0,:] = gng.invert_normalize(sel_pred_features[:,0,:],
                                                    'pressure',